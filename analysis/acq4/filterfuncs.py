@@ -7,53 +7,33 @@ adapt to the NeuroDAQ environment.
 """
 
 import numpy as np
+from .. import filtering
 
 def applyFilter(data, b, a, padding=100, bidir=True):
     """Apply a linear filter with coefficients a, b. Optionally pad the data before filtering
-    and/or run the filter in both directions."""
+    and/or run the filter in both directions. Runs as second-order sections in chunks,
+    see analysis.filtering."""
     try:
         import scipy.signal
     except ImportError:
         raise Exception("applyFilter() requires the package scipy.signal.")
     
-    d1 = data.view(np.ndarray)
-    
-    if padding > 0:
-        d1 = np.hstack([d1[:padding], d1, d1[-padding:]])
-    
-    if bidir:
-        d1 = scipy.signal.lfilter(b, a, scipy.signal.lfilter(b, a, d1)[::-1])[::-1]
-    else:
-        d1 = scipy.signal.lfilter(b, a, d1)
-    
-    if padding > 0:
-        d1 = d1[padding:-padding]
-    return d1
+    return filtering.sos_filter(data.view(np.ndarray), scipy.signal.tf2sos(b, a), bidir, padding)
     
 def besselFilter(data, cutoff, order=1, dt=None, btype='low', bidir=True):
     """return data passed through bessel filter"""
-    try:
-        import scipy.signal
-    except ImportError:
-        raise Exception("besselFilter() requires the package scipy.signal.")
-    
     if dt is None:
         try:
             tvals = data.xvals('Time')
             dt = (tvals[-1]-tvals[0]) / (len(tvals)-1)
         except:
             dt = 1.0    
-    b,a = scipy.signal.bessel(order, cutoff * dt, btype=btype)    
-    return applyFilter(data, b, a, bidir=bidir)
+    sos = filtering.design_sos('bessel', order, cutoff, dt, btype)
+    return filtering.sos_filter(data.view(np.ndarray), sos, bidir)
 
 
 def butterworthFilter(data, wPass, wStop=None, gPass=2.0, gStop=20.0, order=1, dt=None, btype='low', bidir=True):
-    """return data passed through bessel filter"""
-    try:
-        import scipy.signal
-    except ImportError:
-        raise Exception("butterworthFilter() requires the package scipy.signal.")
-    
+    """return data passed through butterworth filter"""
     if dt is None:
         try:
             tvals = data.xvals('Time')
@@ -63,9 +43,8 @@ def butterworthFilter(data, wPass, wStop=None, gPass=2.0, gStop=20.0, order=1, d
     
     if wStop is None:
         wStop = wPass * 2.0
-    ord, Wn = scipy.signal.buttord(wPass*dt*2., wStop*dt*2., gPass, gStop)
-    b,a = scipy.signal.butter(ord, Wn, btype=btype) 
-    return applyFilter(data, b, a, bidir=bidir)
+    sos = filtering.butterworth_sos(wPass, wStop, gPass, gStop, dt, btype)
+    return filtering.sos_filter(data.view(np.ndarray), sos, bidir)
 
 
 def rollingSum(data, n):
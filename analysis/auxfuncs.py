@@ -86,14 +86,14 @@ def get_dataRange(plotWidget, item, cursors=False):
             c1 = temp
         # Coerce to data limits if necessary
         if c1 < 0: c1 = 0
-        if c2 > len(item.data) : c2 = (len(item.data))
+        if c2 > item.dataLength() : c2 = item.dataLength()
     else:
         c1 = 0
-        c2 = len(item.data)
+        c2 = item.dataLength()
     if cursors:
-        return item.data[c1:c2], c1, c1*dt, c2*dt
+        return item.dataRange(c1, c2), c1, c1*dt, c2*dt
     else:
-        return item.data[c1:c2], c1
+        return item.dataRange(c1, c2), c1
 
 
 def make_h5item(name, data, attrs):
@@ -148,9 +148,16 @@ def save_results(browser, parentText, results):
     parentWidget = browser.ui.workingDataTree.invisibleRootItem()
     browser.make_nameUnique(parentWidget, item, item.text(0))
     browser.ui.workingDataTree.addTopLevelItem(item)
+    # Names are made unique as in browser.make_nameUnique, keeping the
+    # names used so far rather than reading them back from the tree
+    names = set()
     for result in results:
-        child = h5Item([result[0]])
-        browser.make_nameUnique(item, child, child.text(0))
+        name, i = result[0], 1
+        while name in names:
+            name = result[0] + '_' + str(i)
+            i+=1
+        names.add(name)
+        child = h5Item([name])
         item.addChild(child)
         if len(result)>2: child.attrs = result[2]
         child.listIndex =  len(browser.ui.workingDataTree.dataItems)
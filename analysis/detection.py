@@ -0,0 +1,348 @@
+""" Threshold detection functions
+
+Traces are compared with the thresholds as whole arrays and reduced to
+runs of samples past each threshold (get_runs), and events are found
+from the runs, without going through the data sample by sample.
+
+Sweeps are detected separately (detect_sweeps), in a thread pool (see
+analysis.parallel), so that events do not run from the end of one sweep
+into the next and each onset keeps the sweep it came from.
+
+Template matching (match_chunks, detect_template) fits a scaled template
+plus an offset at each position of the data, as in Clements & Bekkers
+(1997), and detects events where the fitted scale over the standard
+error of the fit (the detection criterion) goes past a threshold. The
+sum of template x data is taken by FFT (overlap-add), and the sums of
+data and data squared from cumulative sums, so each position costs the
+same whatever the template length. Data are matched TEMPLATE_CHUNK
+positions at a time, each chunk overlapping the next by the template
+length, so memory does not grow with the length of the recording.
+"""
+
+import numpy as np
+import scipy.signal as signal
+from analysis.parallel import map_sweeps
+
+TEMPLATE_CHUNK = 2**20   # Positions matched at a time
+
+
+def get_runs(mask):
+    """ Start and end (exclusive) of the runs of True values in a
+    boolean array
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if len(mask)==0:
+        return np.zeros(0, dtype=int), np.zeros(0, dtype=int)
+    edges = np.flatnonzero(mask[1:]!=mask[:-1]) + 1
+    starts, ends = edges[mask[edges]], edges[~mask[edges]]
+    if mask[0]: starts = np.concatenate([[0], starts])
+    if mask[-1]: ends = np.concatenate([ends, [len(mask)]])
+    return starts, ends
+
+def detect_events(data, threshold, noiseSafety=0, minInterval=0, minDuration=0,
+                  direction='negative'):
+    """ Onsets of events in data, in samples.
+
+    An event starts at the first sample past threshold that comes more
+    than minInterval samples after the previous onset (and after sample
+    0), and lasts until data come back past threshold-noiseSafety.
+    Events shorter than minDuration samples are dropped, but still
+    count as the previous onset for the interval rule. 'direction' is
+    'negative' for events below threshold, 'positive' for events above.
+
+    Each onset follows from the previous one, so rather than scanning
+    the data, the onset that would follow each possible onset is found
+    for all of them at once. Possible onsets are the starts of runs past
+    threshold, and samples within a run that come minInterval after an
+    onset. The onsets that follow from the first one are then collected
+    by pointer doubling, in as many steps as the log of their number.
+    """
+    comp = np.less if direction=='negative' else np.greater
+    data = np.asarray(data)
+    runs = get_runs(comp(data, threshold))
+    holds = get_runs(comp(data, threshold-noiseSafety))
+    step = max(1, int(np.floor(minInterval))+1)   # Smallest interval allowed
+    first, within = next_onsets(np.array([step]), runs)
+    if first[0]<0:
+        return np.zeros(0, dtype=int)
+    # Possible onsets, with the end of their event and the onset that
+    # follows them: run starts, then onsets within runs that follow from
+    # possible onsets, until there are no new ones
+    onsets, ends, following = [], [], []
+    new = np.union1d(runs[0], first)
+    while len(new):
+        newEnds = event_ends(new, holds)
+        newFollowing, within = next_onsets(np.maximum(newEnds, new+step), runs)
+        onsets.append(new)
+        ends.append(newEnds)
+        following.append(newFollowing)
+        new = np.unique(newFollowing[within])
+    onsets, unique = np.unique(np.concatenate(onsets), return_index=True)
+    ends = np.concatenate(ends)[unique]
+    following = np.concatenate(following)[unique]
+    # Index of the onset that follows each one, len(onsets) if none
+    jump = np.append(np.searchsorted(onsets, following), len(onsets))
+    jump[:-1][following<0] = len(onsets)
+    # Follow from the first onset, doubling the steps taken each time
+    found = np.searchsorted(onsets, first)
+    while True:
+        more = jump[found]
+        more = more[more<len(onsets)]
+        if len(more)==0:
+            break
+        found = np.concatenate([found, more])
+        jump = jump[jump]
+    found = np.sort(found)
+    return onsets[found][ends[found]-onsets[found]>=minDuration]
+
+def detect_sweeps(sweeps, threshold, noiseSafety=0, minInterval=0, minDuration=0,
+                  direction='negative'):
+    """ detect_events for each of a list of sweeps, or the rows of a 2D
+    array. Returns the sweep index and the sample index within the sweep
+    of the onsets, ordered by sweep and onset.
+    """
+    onsets = map_sweeps(lambda sweep: detect_events(sweep, threshold, noiseSafety, minInterval,
+                                                    minDuration, direction), sweeps)
+    sweepIndex = np.repeat(np.arange(len(onsets)), [len(o) for o in onsets])
+    return sweepIndex, np.concatenate(onsets+[np.zeros(0, dtype=int)])
+
+def get_values(sweeps, sweepIndex, samples):
+    """ Values of sweeps at (sweep index, sample index) pairs ordered by
+    sweep, as returned by detect_sweeps and detect_spikes
+    """
+    if isinstance(sweeps, np.ndarray) and sweeps.ndim==2:
+        return sweeps[sweepIndex, samples]
+    bounds = np.searchsorted(sweepIndex, np.arange(len(sweeps)+1))
+    return np.concatenate([np.asarray(sweep)[samples[bounds[n]:bounds[n+1]]]
+                           for n, sweep in enumerate(sweeps)]+[np.zeros(0)])
+
+def detect_spikes(sweeps, threshold, refractory=0, direction='positive'):
+    """ Spikes in each of sweeps, the rows of a 2D array or a list of
+    traces: samples where data go above threshold, or the first sample
+    if a sweep starts above it (below threshold for 'negative'
+    direction). Crossings less than 'refractory' samples after the
+    previous spike of the same sweep are not spikes; refractory is one
+    value or one per sweep. Returns the sweep index and the sample index
+    of the spikes, ordered by sweep and time.
+    """
+    comp = np.less if direction=='negative' else np.greater
+    refractory = np.broadcast_to(np.asarray(refractory, dtype=float), (len(sweeps),))
+    if isinstance(sweeps, np.ndarray) and sweeps.ndim==2:
+        crossings = comp(sweeps, threshold)
+        crossings[:,1:] &= ~crossings[:,:-1]
+        sweepIndex, spikes = np.nonzero(crossings)
+    else:
+        spikes = [get_runs(comp(np.asarray(sweep), threshold))[0] for sweep in sweeps]
+        sweepIndex = np.repeat(np.arange(len(spikes)), [len(s) for s in spikes])
+        spikes = np.concatenate(spikes+[np.zeros(0, dtype=int)])
+    if np.any(refractory>0) and len(spikes):
+        spikeRefractory = refractory[sweepIndex]
+        close = (np.diff(spikes)<spikeRefractory[1:]) & (sweepIndex[1:]==sweepIndex[:-1])
+        if close.any():
+            # Only spikes that are kept start a refractory period
+            keep = np.ones(len(spikes), dtype=bool)
+            last = 0
+            for n in np.flatnonzero(close)+1:
+                if keep[n-1]: last = n-1
+                if sweepIndex[n]==sweepIndex[last] and spikes[n]-spikes[last]<spikeRefractory[n]:
+                    keep[n] = False
+            sweepIndex, spikes = sweepIndex[keep], spikes[keep]
+    return sweepIndex, spikes
+
+def spike_stats(sweepIndex, spikes, nSweeps, dt):
+    """ Number of spikes, latency of the first spike (ms), mean frequency
+    (1/mean ISI, Hz), initial frequency (1/first ISI, Hz) and adaptation
+    index of each of nSweeps sweeps, from the output of detect_spikes.
+    dt (ms) is one value or one per sweep.
+
+    The adaptation index is the mean of (ISI[n+1]-ISI[n])/(ISI[n+1]+ISI[n])
+    over the ISIs of a sweep. Frequencies are 0 for sweeps with less than
+    two spikes, latency and adaptation index NaN where not defined.
+    """
+    dt = np.broadcast_to(np.asarray(dt, dtype=float), (nSweeps,))
+    number = np.bincount(sweepIndex, minlength=nSweeps)
+    first = np.searchsorted(sweepIndex, np.arange(nSweeps))
+    latency = np.full(nSweeps, np.nan)
+    some = number>0
+    latency[some] = spikes[first[some]]*dt[some]
+    frequency, initialFrequency = np.zeros(nSweeps), np.zeros(nSweeps)
+    many = number>1
+    last = first[many]+number[many]-1
+    frequency[many] = 1000.*(number[many]-1)/((spikes[last]-spikes[first[many]])*dt[many])
+    initialFrequency[many] = 1000./((spikes[first[many]+1]-spikes[first[many]])*dt[many])
+    # Ratios of consecutive ISIs within each sweep
+    same = sweepIndex[1:]==sweepIndex[:-1]
+    isi, isiSweep = np.diff(spikes)[same].astype(float), sweepIndex[1:][same]
+    pairs = isiSweep[1:]==isiSweep[:-1]
+    ratios = ((isi[1:]-isi[:-1])/(isi[1:]+isi[:-1]))[pairs]
+    nPairs = np.bincount(isiSweep[1:][pairs], minlength=nSweeps)
+    adaptation = np.full(nSweeps, np.nan)
+    adaptation[nPairs>0] = (np.bincount(isiSweep[1:][pairs], weights=ratios, minlength=nSweeps)[nPairs>0]
+                            / nPairs[nPairs>0])
+    return number, latency, frequency, initialFrequency, adaptation
+
+def bin_counts(sweepIndex, onsets, nSweeps, binSize, nBins):
+    """ Number of onsets in each bin of binSize samples of each sweep, as
+    an nSweeps x nBins array. Bins are open intervals, so onsets exactly
+    on a bin edge are not counted. binSize is one value or one per sweep.
+    """
+    binSize = np.broadcast_to(np.asarray(binSize, dtype=int), (nSweeps,))[sweepIndex]
+    inside = onsets%binSize!=0
+    flat = sweepIndex[inside]*nBins + onsets[inside]//binSize[inside]
+    return np.bincount(flat, minlength=nSweeps*nBins).reshape(nSweeps, nBins)
+
+def window_counts(sweepIndex, onsets, nSweeps, starts, window):
+    """ Number of onsets in windows of 'window' samples from each of
+    starts, as an nSweeps x nStarts array. Windows are open intervals
+    like the bins of bin_counts, so onsets exactly on a window edge are
+    not counted. starts is one array for all sweeps or one row per
+    sweep, window one value or one per sweep.
+    """
+    starts = np.asarray(starts, dtype=int)
+    starts = np.broadcast_to(starts, (nSweeps, starts.shape[-1]))
+    window = np.broadcast_to(np.asarray(window, dtype=int), (nSweeps,))[:,None]
+    if starts.size==0:
+        return np.zeros(starts.shape, dtype=int)
+    # Onsets are ordered by sweep and time, so keys are sorted
+    length = max(onsets.max()+1 if len(onsets) else 0, (starts+window).max()+1)
+    keys = sweepIndex*length + onsets
+    windows = np.arange(nSweeps)[:,None]*length + starts
+    return np.searchsorted(keys, windows+window, 'left') - np.searchsorted(keys, windows, 'right')
+
+def biexp_template(tauRise, tauDecay, length, baseline=0, direction='negative'):
+    """ Biexponential template of 'length' samples, flat for the first
+    'baseline' samples, with a peak of 1 (-1 for 'negative' direction).
+    Time constants are in samples, an alpha function if they are equal.
+    """
+    t = np.arange(length-int(baseline), dtype=float)
+    if tauRise==tauDecay:
+        wave = t*np.exp(-t/tauDecay)
+    else:
+        wave = np.exp(-t/tauDecay) - np.exp(-t/tauRise)
+    wave = np.abs(wave)
+    wave /= wave.max()
+    template = np.zeros(length)
+    template[int(baseline):] = -wave if direction=='negative' else wave
+    return template
+
+def match_chunks(data, template, chunk=TEMPLATE_CHUNK):
+    """ Fit template*scale+offset to data at each position, chunk
+    positions at a time. Yields (start, scale, criterion) for the fits
+    at positions start:start+len(scale), that is to data[p:p+len(template)]
+    for each position p. Criterion is scale over the standard error of
+    the fit, 0 where the data are flat.
+    """
+    template = np.asarray(template, dtype=np.float64)
+    n = len(template)
+    sumT = template.sum()
+    normT = np.sum(template**2) - sumT**2/n
+    reverse = template[::-1]
+    for start in range(0, len(data)-n+1, chunk):
+        stop = min(start+chunk, len(data)-n+1)
+        # The fit does not depend on a constant added to the data, which
+        # are centred to limit rounding errors in the sums
+        segment = np.asarray(data[start:stop+n-1], dtype=np.float64)
+        segment = segment - segment.mean()
+        sumTD = signal.oaconvolve(segment, reverse, mode='valid')
+        sums = np.concatenate([[0.], np.cumsum(segment)])
+        sumD = sums[n:] - sums[:-n]
+        sums = np.concatenate([[0.], np.cumsum(segment**2)])
+        sumD2 = sums[n:] - sums[:-n]
+        del sums
+        sumTD -= sumT*sumD/n        # Centred sums of template x data
+        sumD2 -= sumD**2/n          # and of data squared
+        scale = sumTD/normT
+        sse = np.maximum(sumD2 - scale*sumTD, 0.)
+        error = np.sqrt(sse/(n-1))
+        criterion = np.zeros(len(scale))
+        np.divide(scale, error, out=criterion, where=error>0)
+        yield start, scale, criterion
+
+def detect_template(data, template, threshold, chunk=TEMPLATE_CHUNK):
+    """ Events in data matching template: one event for each run of
+    positions where the detection criterion is above threshold, at the
+    position of the largest criterion in the run. Returns the positions
+    (start of the template, in samples), the template scale and the
+    criterion of the events.
+    """
+    positions, scales, criteria = [], [], []
+    carry = None   # Peak of a run still open at the end of the last chunk
+    for start, scale, criterion in match_chunks(data, template, chunk):
+        runStarts, runEnds = get_runs(criterion>threshold)
+        peaks = run_peaks(criterion, runStarts, runEnds)
+        if carry is not None:
+            if len(peaks) and runStarts[0]==0:
+                # Run goes on from the last chunk, keep its larger peak
+                if criterion[peaks[0]]>carry[2]:
+                    carry = (start+peaks[0], scale[peaks[0]], criterion[peaks[0]])
+                peaks = peaks[1:]
+                if len(peaks)==0 and runEnds[0]==len(criterion):
+                    continue
+            for events, value in zip([positions, scales, criteria], carry):
+                events.append(np.array([value]))
+            carry = None
+        if len(peaks) and runEnds[-1]==len(criterion):
+            last = peaks[-1]
+            carry = (start+last, scale[last], criterion[last])
+            peaks = peaks[:-1]
+        positions.append(start+peaks)
+        scales.append(scale[peaks])
+        criteria.append(criterion[peaks])
+    if carry is not None:
+        for events, value in zip([positions, scales, criteria], carry):
+            events.append(np.array([value]))
+    return (np.concatenate(positions+[np.zeros(0, dtype=int)]).astype(int),
+            np.concatenate(scales+[np.zeros(0)]), np.concatenate(criteria+[np.zeros(0)]))
+
+def template_sweeps(sweeps, template, threshold, chunk=TEMPLATE_CHUNK):
+    """ detect_template for each of a list of sweeps, or the rows of a 2D
+    array. Returns the sweep index, position, scale and criterion of the
+    events, ordered by sweep and position.
+    """
+    events = map_sweeps(lambda sweep: detect_template(sweep, template, threshold, chunk), sweeps)
+    sweepIndex = np.repeat(np.arange(len(events)), [len(e[0]) for e in events])
+    positions = np.concatenate([e[0] for e in events]+[np.zeros(0, dtype=int)])
+    scales = np.concatenate([e[1] for e in events]+[np.zeros(0)])
+    criteria = np.concatenate([e[2] for e in events]+[np.zeros(0)])
+    return sweepIndex, positions, scales, criteria
+
+def run_peaks(values, starts, ends):
+    """ Position of the largest value in each run starts:ends, the first
+    one if there are ties
+    """
+    if len(starts)==0:
+        return np.zeros(0, dtype=int)
+    lengths = ends-starts
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    inRuns = np.repeat(starts-offsets, lengths) + np.arange(lengths.sum())
+    runMax = np.maximum.reduceat(values[inRuns], offsets)
+    runIndex = np.repeat(np.arange(len(starts)), lengths)
+    atMax = np.flatnonzero(values[inRuns]==runMax[runIndex])
+    first = np.unique(runIndex[atMax], return_index=True)[1]
+    return inRuns[atMax[first]]
+
+def next_onsets(starts, runs):
+    """ First sample past threshold from each of starts on, -1 if there
+    is none, and whether it is within a run rather than at its start
+    """
+    runStarts, runEnds = runs
+    r = np.searchsorted(runEnds, starts, 'right')
+    valid = r<len(runEnds)
+    onsets = np.full(len(starts), -1, dtype=int)
+    onsets[valid] = np.maximum(starts[valid], runStarts[r[valid]])
+    within = np.zeros(len(starts), dtype=bool)
+    within[valid] = onsets[valid]>runStarts[r[valid]]
+    return onsets, within
+
+def event_ends(onsets, holds):
+    """ End of events starting at onsets: the end of the run past
+    threshold-noiseSafety that holds the onset, or the onset itself if
+    it is not in such a run
+    """
+    holdStarts, holdEnds = holds
+    h = np.searchsorted(holdEnds, onsets, 'right')
+    inRun = h<len(holdEnds)
+    inRun[inRun] = holdStarts[h[inRun]]<=onsets[inRun]
+    ends = np.array(onsets)
+    ends[inRun] = holdEnds[h[inRun]]
+    return ends
@@ -6,9 +6,11 @@ import scipy.signal as signal
 from PyQt5 import QtGui, QtCore, QtWidgets
 import pyqtgraph as pg
 from widgets import h5Item
-from ...util import pgplot
-import auxfuncs as aux
-import smooth
+from util import pgplot
+from analysis import auxfuncs as aux
+from analysis import smooth
+from analysis import detection
+from analysis import parallel
 
 # TO DO:
 # manually add and remove events from plot by clicking
@@ -31,47 +33,40 @@ def event_detect(browser):
     # Ensure that noise safety has the same sign as the threshold
     noiseSafety = np.sign(threshold) * abs(noiseSafety)
 
-    # Get dt list and attrs for use in concatenated data
+    # Get dt list
     dtList = aux.get_attr(browser.ui.dataPlotsWidget.plotDataItems, 'dt')
     dt = dtList[0]
-    item = browser.ui.dataPlotsWidget.plotDataItems[0]
-    attrs = item.attrs
 
-    # Get data currently plotted within the cursors and concatenate in a single sweep
-    data = aux.get_data(browser)
-    if browser.ui.dataPlotsWidget.cursor1Pos: data = data[:,c1/dt:c2/dt]
-    data = data.ravel()
+    # Get data currently plotted within the cursors, one sweep at a time
+    traces, attrs = [], []
+    for item in browser.ui.dataPlotsWidget.plotDataItems:
+        trace = item.data
+        if browser.ui.dataPlotsWidget.cursor1Pos: trace = trace[int(c1/dt):int(c2/dt)]
+        traces.append(trace)
+        attrs.append(item.attrs)
 
     # Smooth
-    original_data = data
     if smoothFactor > 1:
-        data = smooth.smooth(data, window_len=smoothFactor, window='hanning')
-
-    # Run detection  
-    if direction=='negative':
-        comp = lambda a, b: a < b
-    elif direction=='positive':
-        comp = lambda a, b: a > b
-    eventCounter,i = 0,0
-    xOnsets, yOnsets = [], []
-    while i<len(data):
-        if comp(data[i],threshold):
-            xOnsets.append(i)
-            yOnsets.append(data[i])
-            eventCounter +=1
-            while i<len(data) and comp(data[i],(threshold-noiseSafety)):
-                i+=1 # skip values if index in bounds AND until the value is below/above threshold again
-        else:
-            i+=1
-
-    frequency = eventCounter/(len(data)*dt)*1000   # in Hz
+        data = parallel.map_sweeps(lambda trace: smooth.smooth(trace, window_len=int(smoothFactor),
+                                                               window='hanning'), traces)
+    else:
+        data = traces
+
+    # Run detection on each sweep, onsets are (sweep, sample) pairs
+    sweeps, xOnsets = detection.detect_sweeps(data, threshold, noiseSafety, direction=direction)
+    yOnsets = detection.get_values(data, sweeps, xOnsets)
+    eventCounter = len(xOnsets)
+
+    frequency = eventCounter/(sum(len(trace) for trace in traces)*dt)*1000   # in Hz
     print(eventCounter, 'events detected at', frequency, 'Hz')
 
     # Store event onsets and peaks in h5 data tree
     results = []
-    results.append(['trace', np.array(original_data), attrs])
-    results.append(['onsets', np.array(xOnsets)])
-    results.append(['peaks', np.array(yOnsets)])
+    for trace, traceAttrs in zip(traces, attrs):
+        results.append(['trace', trace, traceAttrs])
+    results.append(['sweeps', sweeps])
+    results.append(['onsets', xOnsets])
+    results.append(['peaks', yOnsets])
     results.append(['number', np.array([eventCounter])])
     results.append(['frequency', np.array([frequency])])
     listIndexes = aux.save_results(browser, 'Event_Detection', results)    
@@ -85,15 +80,17 @@ def event_detect(browser):
 #    browser.ui.toolStackedWidget.eventData.append(dt)
 
     # Plot results
-    show_events(browser, data, np.array(xOnsets), np.array(yOnsets), dt)
+    show_events(browser, data, xOnsets, yOnsets, dt)
 
 def event_cut(browser):
-    # Get trace and event onsets using stored dataIndex
-    itrace = browser.ui.toolStackedWidget.eventItemsIndex[0]
-    trace = browser.ui.workingDataTree.dataItems[itrace]
-    ionsets = browser.ui.toolStackedWidget.eventItemsIndex[1]
-    onsets = browser.ui.workingDataTree.dataItems[ionsets]   
-    dt = float(trace.attrs['dt'])
+    # Get traces, sweeps and event onsets using stored dataIndex
+    # (one trace per sweep, followed by sweeps and onsets)
+    indexes = browser.ui.toolStackedWidget.eventItemsIndex
+    nTraces = len(indexes)-5
+    traces = [browser.ui.workingDataTree.dataItems[i] for i in indexes[:nTraces]]
+    sweeps = browser.ui.workingDataTree.dataItems[indexes[nTraces]]
+    onsets = browser.ui.workingDataTree.dataItems[indexes[nTraces+1]]   
+    dt = float(traces[0].attrs['dt'])
 
     # Get cutting parameters
     baseline = float(browser.ui.toolStackedWidget.eventBaseline.text())/dt
@@ -101,10 +98,10 @@ def event_cut(browser):
 
     # Cut out
     events = []
-    for onset in onsets.data:
-        eStart = onset-baseline
-        eEnd = onset+duration
-        eData = trace.data[eStart:eEnd]
+    for sweep, onset in zip(sweeps.data, onsets.data):
+        eStart = max(0, int(onset-baseline))
+        eEnd = int(onset+duration)
+        eData = traces[sweep].data[eStart:eEnd]
         events.append(eData)
 
     # Store event waveforms in h5 data tree
@@ -116,11 +113,11 @@ def event_cut(browser):
     aux.save_results(browser, 'Events', results)
 
 
-def show_events(browser, data, xOnsets, yOnsets, dt):
+def show_events(browser, traces, xOnsets, yOnsets, dt):
     plotWidget = browser.ui.dataPlotsWidget
     plotWidget.clear()
-    x = np.arange(0, len(data)*dt, dt)
-    plotWidget.plot(x, data)
+    for data in traces:
+        pgplot.plot_uniform(plotWidget, data, dt)
     plotWidget.plot(xOnsets*dt, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=7)
 
 
@@ -0,0 +1,88 @@
+""" Streaming filters
+
+Filters are applied as second-order sections (sos), which stay stable at
+high orders and low cutoffs where (b, a) coefficients do not. Data are
+filtered FILTER_CHUNK samples at a time, carrying the filter state from
+one chunk to the next, so the result is the same as filtering the whole
+trace at once, and besides the output only a few chunks are in memory.
+Traces can also be read from file a chunk at a time (filter_read), so
+that they are never loaded whole.
+
+Zero-phase (bidir) filtering runs the forward pass over the trace into
+the output, then the backward pass over the output from the end, in
+place. As in acq4's applyFilter, the trace is padded at each end with
+its first and last 'padding' samples, and each pass starts from rest.
+"""
+
+import functools
+import numpy as np
+import scipy.signal as signal
+
+FILTER_CHUNK = 2**20   # Samples filtered at a time
+
+
+@functools.lru_cache(maxsize=128)
+def design_sos(ftype, order, cutoff, dt, btype='low'):
+    """ Sections of a 'bessel' or 'butterworth' filter, for cutoff in Hz
+    and dt in s. Designs are memoized, so the arrays returned are shared
+    and should not be changed. The Bessel cutoff is normalised as in acq4 (cutoff*dt), the
+    Butterworth one to the Nyquist frequency.
+    """
+    if ftype=='bessel':
+        sos = signal.bessel(int(order), cutoff*dt, btype=btype, output='sos')
+    elif ftype=='butterworth':
+        sos = signal.butter(int(order), 2.*cutoff*dt, btype=btype, output='sos')
+    else:
+        raise ValueError('Unknown filter type '+str(ftype))
+    return sos
+
+def butterworth_sos(wPass, wStop, gPass, gStop, dt, btype='low'):
+    """ Butterworth filter sections of the lowest order that loses at
+    most gPass dB at wPass and at least gStop dB at wStop (Hz)
+    """
+    order, wn = signal.buttord(wPass*dt*2., wStop*dt*2., gPass, gStop)
+    return signal.butter(order, wn, btype=btype, output='sos')
+
+def sos_filter(data, sos, bidir=True, padding=100, chunk=FILTER_CHUNK, out=None):
+    """ Filter data along the last axis with sections sos, see the
+    module description. 'out' is an array for the result, by default a
+    new float64 array.
+    """
+    return stream_filter(lambda start, stop: data[..., start:stop], np.shape(data), sos,
+                         bidir, padding, chunk, out)
+
+def filter_read(read, length, sos, bidir=True, padding=100, chunk=FILTER_CHUNK, out=None):
+    """ sos_filter for a trace of 'length' samples read with
+    read(start, stop), e.g. item.dataRange
+    """
+    return stream_filter(read, (length,), sos, bidir, padding, chunk, out)
+
+def stream_filter(read, shape, sos, bidir, padding, chunk, out):
+    sos = np.atleast_2d(sos)
+    length = shape[-1]
+    if out is None:
+        out = np.empty(shape)
+    if length==0:
+        return out
+    padding = min(int(padding), length)
+    rest = np.zeros((len(sos),)+tuple(shape[:-1])+(2,))
+    # Forward pass, starting on the padding before the trace
+    zi = rest
+    if padding:
+        zi = signal.sosfilt(sos, read(0, padding), zi=zi)[1]
+    for start in range(0, length, chunk):
+        stop = min(start+chunk, length)
+        out[..., start:stop], zi = signal.sosfilt(sos, read(start, stop), zi=zi)
+    if not bidir:
+        return out
+    # Backward pass, starting on the forward pass of the padding after it
+    if padding:
+        tail = signal.sosfilt(sos, read(length-padding, length), zi=zi)[0]
+        zi = signal.sosfilt(sos, tail[..., ::-1], zi=rest)[1]
+    else:
+        zi = rest
+    for stop in range(length, 0, -chunk):
+        start = max(0, stop-chunk)
+        filtered, zi = signal.sosfilt(sos, out[..., start:stop][..., ::-1], zi=zi)
+        out[..., start:stop] = filtered[..., ::-1]
+    return out
@@ -44,7 +44,8 @@ class AnalysisModule():
     def func(self, browser):
         """ Subtract a baseline from the currently plotted traces.
         Baseline is the average of all datapoints between the 
-        current position of the data cursors. 
+        current position of the data cursors. The range index of a
+        trace, if it has one, is shifted with it rather than built again.
     
         Options:
         1) keep original traces intact and create processed copies
@@ -67,7 +68,10 @@ class AnalysisModule():
         for item in plotWidget.plotDataItems:                        
             bslData, c1 = aux.get_dataRange(plotWidget, item)             
             bsl = np.mean(bslData)
+            index = item.rangeIndex
             item.data = item.data - bsl
+            if index is not None:   # Shift an existing index rather than rebuild it
+                item.rangeIndex = index.offset(-bsl, item.data)
             item.analysis['baselineStart'] = c1 
             item.analysis['baselineEnd'] = c1+len(bslData)
             
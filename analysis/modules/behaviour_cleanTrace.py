@@ -91,6 +91,7 @@ class AnalysisModule():
                 if comp(dtrace[i], derivativeThs):
                     item.data[i-nPoints:i+nPoints] = (item.data[i-nPoints]+item.data[i+nPoints])/2.           
                 i+=1     
+            item.mark_changed()   # Changed in place
 
         # Replot data
         pgplot.replot(self.browser, self.plotWidget)
@@ -103,8 +104,7 @@ class AnalysisModule():
        for trace in self.plotWidget.plotDataItems:
            dt = float(trace.attrs['dt'])
            dtrace = np.diff(trace.data)
-           x = pgplot.make_xvector(dtrace, dt)
-           self.plotWidget.plot(x, dtrace,  pen=pg.mkPen('r'))
+           pgplot.plot_uniform(self.plotWidget, dtrace, dt, pen=pg.mkPen('r'))
        
     def show_derivativeCursor(self, var):
         """ Show horizontal cursor to set Derivative threshold 
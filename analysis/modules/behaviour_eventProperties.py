@@ -143,8 +143,7 @@ class AnalysisModule():
        for trace in self.plotWidget.plotDataItems:
            dt = float(trace.attrs['dt'])
            dtrace = np.diff(trace.data)
-           x = pgplot.make_xvector(dtrace, dt)
-           self.plotWidget.plot(x, dtrace,  pen=pg.mkPen('r'))
+           pgplot.plot_uniform(self.plotWidget, dtrace, dt, pen=pg.mkPen('r'))
 
     def show_nestCursor(self, var):
         """ Show horizontal cursor to set Nest threshold 
@@ -6,6 +6,7 @@ import os
 import numpy as np
 from analysis import auxfuncs as aux
 from widgets import h5Item
+from util import videofun
 from ..acq4 import filterfuncs as acq4filter
 from moviepy.editor import *
 from moviepy.video.tools.drawing import blit
@@ -118,8 +119,10 @@ class AnalysisModule():
             aux.error_box('No video stream found')
             return
 
-        # Open video        
-        self.clip = VideoFileClip(self.browser.currentFolder+'/'+self.stream.attrs['mrl'] )
+        # Open video, properties come from the cached header
+        filename = self.browser.currentFolder+'/'+self.stream.attrs['mrl']
+        self.fps = videofun.probe_video(filename)['fps']
+        self.clip = VideoFileClip(filename)
         self.start = self.stream.attrs['tstart']/1000.  # sec
         self.stop = self.stream.attrs['tstop']/1000.
         self.duration = self.stop-self.start
@@ -128,13 +131,13 @@ class AnalysisModule():
         if self.formatVal=='MPEG4':
             savename = self.browser.saveFolder+'/'+self.parentItem.text(0)+'.mp4'
             self.clipOut = VideoClip(self.make_frame, duration=self.duration)
-            self.clipOut.write_videofile(savename, fps=self.clip.fps)
+            self.clipOut.write_videofile(savename, fps=self.fps)
         elif self.formatVal=='JPEG frames':
             dirname = self.browser.saveFolder+'/'+self.parentItem.text(0)
             aux.mkdir_p(dirname)
             basename = dirname+'/''frame%03d.jpg'
             self.clipOut = VideoClip(self.make_frame, duration=self.duration)
-            self.clipOut.write_images_sequence(basename, fps=self.clip.fps)
+            self.clipOut.write_images_sequence(basename, fps=self.fps)
         ############################################  
 
     def start_imageDraw(self, frame):
@@ -151,7 +154,7 @@ class AnalysisModule():
         t: current frame time in seconds, from the start of original stream
         lag: number of frames to lag
         """
-        currentFrame = t * self.clip.fps 
+        currentFrame = t * self.fps 
         if lag-(currentFrame)>0: lag = currentFrame # for while lag is bigger than frames played
         startFrame = currentFrame-lag
         if startFrame<0: startFrame = 0
@@ -163,7 +166,7 @@ class AnalysisModule():
         t: current frame time in seconds, from the start of original stream
         lag: number of frames to lag
         """
-        currentFrame = t * self.clip.fps 
+        currentFrame = t * self.fps 
         if lag-(currentFrame)>0: lag = currentFrame # for while lag is bigger than frames played
         startFrame = currentFrame-lag
         if startFrame<0: startFrame = 0
@@ -185,7 +188,7 @@ class AnalysisModule():
         Function is called iteratively by VideoClip
         """
         frameTime = t + self.start
-        frameNumber = int(t * self.clip.fps) # for use with data which has the subclip duration
+        frameNumber = int(t * self.fps) # for use with data which has the subclip duration
         frame = self.clip.get_frame(frameTime)
         self.start_imageDraw(frame)
         
@@ -5,7 +5,7 @@ from PyQt5 import QtGui, QtCore, QtWidgets
 import os
 import numpy as np
 from analysis import auxfuncs as aux
-from util import pgplot
+from util import pgplot, videofun
 import pyqtgraph as pg
 import re
 from widgets import h5Item
@@ -115,7 +115,7 @@ class AnalysisModule():
                 sourceItem = aux.getItemFromPath(path, root, level=0)
                 dataSourceItems.append(sourceItem)
                 if ('video' in sourceItem.attrs) and (sourceItem.attrs['video']=='True'):
-                    self.clip = VideoFileClip(self.browser.currentFolder+'/'+sourceItem.attrs['mrl'])
+                    self.videoInfo = videofun.probe_video(self.browser.currentFolder+'/'+sourceItem.attrs['mrl'])
 
         # Additional runs
         protocolsItem = aux.getChild(self.parentItem, 'protocols_data')
@@ -185,7 +185,7 @@ class AnalysisModule():
                 sourceItem = aux.getItemFromPath(path, root, level=0)
                 dataSourceItems.append(sourceItem)
                 if ('video' in sourceItem.attrs) and (sourceItem.attrs['video']=='True'):
-                    self.clip = VideoFileClip(self.browser.currentFolder+'/'+sourceItem.attrs['mrl'])
+                    self.videoInfo = videofun.probe_video(self.browser.currentFolder+'/'+sourceItem.attrs['mrl'])
 
 
         # Additional runs
@@ -258,8 +258,8 @@ class AnalysisModule():
             child.attrs['video'] = 'True'
             child.attrs['mrl'] = dataSourceItem.attrs['mrl']
             child.attrs['subclip'] = 'True'
-            #child.attrs['tstart'] = (triggerFrame-self.baseline)/self.clip.fps*1000.
-            #child.attrs['tstop'] = (triggerFrame+self.duration)/self.clip.fps*1000.
+            #child.attrs['tstart'] = (triggerFrame-self.baseline)/self.videoInfo['fps']*1000.
+            #child.attrs['tstop'] = (triggerFrame+self.duration)/self.videoInfo['fps']*1000.
             child.setText = 'clip_'+str(child.text(0))
         else:
             child.data = dataSourceItem.data[int(startTime/dt):int(endTime/dt)]
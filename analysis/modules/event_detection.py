@@ -10,6 +10,8 @@ from analysis import auxfuncs as aux
 from util import pgplot
 import pyqtgraph as pg
 from analysis import smooth
+from analysis import detection
+from analysis import parallel
 from widgets import h5Item
 from ..acq4 import filterfuncs as acq4filter
 ####################################
@@ -98,6 +100,10 @@ class AnalysisModule(QtWidgets.QWidget):
         threshold only. Noise safety is for when coming down from
         peak, go down an extra amount from threshold before starting
         to search for the next event.
+
+        Sweeps are not joined: events are found in each sweep, in
+        parallel (see analysis.detection.detect_sweeps), and stored as
+        the sweep index and the sample index within the sweep.
         """
         ############################################
         # ANALYSIS FUNCTION
@@ -118,8 +124,6 @@ class AnalysisModule(QtWidgets.QWidget):
             minInterval = float(self.eventMinInterval.text())
         except NameError:
             aux.error_box('Invalid detection value')
-        bslWindow = 1.0
-        slowestRise = 0.5
         #minEventInterval = 5000.0
 
         # Ensure that noise safety has the same sign as the threshold
@@ -128,88 +132,57 @@ class AnalysisModule(QtWidgets.QWidget):
         # Get widgets
         plotWidget = browser.ui.dataPlotsWidget
 
-        # Get dt list and attrs for use in concatenated data
+        # Get dt list
         dtList = aux.get_attr(self.browser.ui.dataPlotsWidget.plotDataItems, 'dt')
         dt = dtList[0]
         self.dt = dt
-        item = self.browser.ui.dataPlotsWidget.plotDataItems[0]
-        attrs = item.attrs
 
-        # Get data currently plotted and concatenate in a single sweep
-        data = []
+        # Get data currently plotted, one sweep at a time
+        self.traces, attrs = [], []
         for item in plotWidget.plotDataItems:
             trace, c1 = aux.get_dataRange(plotWidget, item)
-            data.append(trace)
-        data = np.array(data).ravel()
-
-        # Get derivative trace and filter
-        dtrace = None
-        if detectionTrace=='derivative':
-            print(threshold)
-            dtrace = np.diff(data)
-            dtrace = acq4filter.besselFilter(dtrace, 2000, 1, dt/1000, 'low', True)
+            self.traces.append(trace)
+            attrs.append(item.attrs)
 
-        # Smooth
-        self.trace = data
-        if smoothFactor > 1:
-            data = smooth.smooth(data, window_len=smoothFactor, window='hanning')
+        # Smooth and get the derivative trace if required, for each sweep
+        def prepare(trace):
+            data = trace
+            if smoothFactor > 1:
+                data = smooth.smooth(trace, window_len=int(smoothFactor), window='hanning')
+            if detectionTrace=='derivative':
+                dtrace = np.diff(trace)
+                dtrace = acq4filter.besselFilter(dtrace, 2000, 1, dt/1000, 'low', True)
+                return data, dtrace
+            return data, data
+        prepared = parallel.map_sweeps(prepare, self.traces)
+        sweeps = [p[0] for p in prepared]
 
-        # Comparison functions  
-        if direction=='negative':
-            comp = lambda a, b: a < b
-        elif direction=='positive':
-            comp = lambda a, b: a > b
-            
         # Correct times for dt    
         minEventInterval = minInterval/dt
         minDuration = minDuration/dt
-        bslWindow = bslWindow/dt
-        slowestRise = slowestRise/dt
             
-        # Run detection
-        eventCounter,i = 0,0 #+bslWindow/dt+slowestRise/dt
-        iLastDetection = 0
-        self.xOnsets, self.yOnsets = [], []
-        bsl = 0
-        if dtrace is not  None:
-            detectionData = dtrace
-        else:
-            detectionData = data
-        while i<len(detectionData):
-            # Sliding baseline
-            #bsl = np.mean(data[i-bslWindow-slowestRise:i])   
-            if comp(detectionData[i]-bsl,threshold):
-              print(i, i-iLastDetection)
-              if i-iLastDetection>minEventInterval:  # Min inter-event interval
-                self.xOnsets.append(i)
-                self.yOnsets.append(data[i])
-                eventCounter+=1
-                iLastDetection = i
-                while i<len(detectionData) and comp(detectionData[i]-bsl,(threshold-noiseSafety)):
-                    i+=1 # skip values if index in bounds AND until the value is below/above threshold again
-                if i-iLastDetection < minDuration: # Event is too brief
-                    self.xOnsets.pop()
-                    self.yOnsets.pop()
-                    eventCounter-=1
-              else:
-                i+=1   # for min event interval   
-            else:
-                i+=1
+        # Run detection on each sweep, onsets are (sweep, sample) pairs
+        self.sweeps, self.xOnsets = detection.detect_sweeps([p[1] for p in prepared], threshold,
+                                        noiseSafety, minEventInterval, minDuration, direction)
+        self.yOnsets = detection.get_values(sweeps, self.sweeps, self.xOnsets)
+        eventCounter = len(self.xOnsets)
 
-        frequency = eventCounter/(len(data)*dt)*1000   # in Hz
+        frequency = eventCounter/(sum(len(trace) for trace in self.traces)*dt)*1000   # in Hz
         print(eventCounter, 'events detected at', frequency, 'Hz')
 
-        # Store event onsets and peaks in h5 data tree
+        # Store sweeps, event onsets and peaks in h5 data tree
         results = []
-        results.append(['trace', np.array(self.trace), attrs])
-        results.append(['xOnsets', np.array(self.xOnsets)])
-        results.append(['yOnsets', np.array(self.yOnsets)])
+        for trace, traceAttrs in zip(self.traces, attrs):
+            results.append(['trace', trace, traceAttrs])
+        results.append(['sweeps', self.sweeps])
+        results.append(['xOnsets', self.xOnsets])
+        results.append(['yOnsets', self.yOnsets])
         results.append(['number', np.array([eventCounter])])
         results.append(['frequency', np.array([frequency])])
         aux.save_results(browser, 'Event_Detection', results)    
 
         # Plot results
-        self.show_events(data, np.array(self.xOnsets), np.array(self.yOnsets), dt)
+        self.show_events(sweeps, self.xOnsets, self.yOnsets, dt)
 
         # Turn cursors off (the plot has been cleared so there are no cursors displayed)    
         self.browser.ui.actionShowCursors.setChecked(False)
@@ -227,13 +200,14 @@ class AnalysisModule(QtWidgets.QWidget):
 
         # Cut out
         events, allAttrs = [], []
-        for onset in self.xOnsets:
-            eStart = onset-baseline
-            eEnd = onset+duration
-            eData = self.trace[eStart:eEnd]
+        for sweep, onset in zip(self.sweeps, self.xOnsets):
+            eStart = max(0, int(onset-baseline))
+            eEnd = int(onset+duration)
+            eData = self.traces[sweep][eStart:eEnd]
             events.append(eData)
             attrs = {}
             attrs['dt'] = self.dt
+            attrs['sweep'] = sweep
             attrs['onset'] = onset
             allAttrs.append(attrs)
 
@@ -267,10 +241,10 @@ class AnalysisModule(QtWidgets.QWidget):
         plotWidget.cursorThsPos = round(plotWidget.cursorThs.value(),4)
         self.eventThresholdDisplay.setText(str(plotWidget.cursorThsPos))
 
-    def show_events(self, data, xOnsets, yOnsets, dt):
+    def show_events(self, traces, xOnsets, yOnsets, dt):
         self.plotWidget.clear()
-        x = pgplot.make_xvector(data, dt)
-        self.plotWidget.plot(x, data)
+        for trace in traces:
+            pgplot.plot_uniform(self.plotWidget, trace, dt)
         self.plotWidget.plot(xOnsets*dt, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=7)
 
     def set_defaultValues(self):
@@ -289,8 +263,7 @@ class AnalysisModule(QtWidgets.QWidget):
            dtrace = np.diff(trace.data)
            dtrace = acq4filter.besselFilter(dtrace, 2000, 1, dt/1000, 'low', True)
            #dtrace = smooth.smooth(dtrace, window_len=5, window='hanning')
-           x = pgplot.make_xvector(dtrace, dt)
-           self.plotWidget.plot(x, dtrace,  pen=pg.mkPen('r'))
+           pgplot.plot_uniform(self.plotWidget, dtrace, dt, pen=pg.mkPen('r'))
 
     def event_check(self):
         if self.eventCheck.isChecked():
@@ -302,19 +275,22 @@ class AnalysisModule(QtWidgets.QWidget):
     def event_replot(self):
         """ Replot event onsets over original trace       
         """
-        self.trace, self.xOnsets, self.yOnsets = None, None, None
+        self.traces, self.sweeps, self.xOnsets, self.yOnsets = [], None, None, None
         item = self.browser.ui.workingDataTree.currentItem()
         for c in range(item.childCount()):
             if 'trace' in item.child(c).text(0): 
-                self.trace = item.child(c).data
+                self.traces.append(item.child(c).data)
                 self.dt = item.child(c).attrs['dt']
+            if 'sweeps' in item.child(c).text(0): self.sweeps = item.child(c).data
             if 'xOnsets' in item.child(c).text(0): self.xOnsets = item.child(c).data
             if 'yOnsets' in item.child(c).text(0): self.yOnsets = item.child(c).data
-        if (self.trace is None) or (self.xOnsets is None) or (self.yOnsets is None): 
+        if (not self.traces) or (self.xOnsets is None) or (self.yOnsets is None): 
             aux.error_box('No event data found', infoText='Please select an item with trace and event onset data') 
             return
         else:
-            self.show_events(self.trace, self.xOnsets, self.yOnsets, self.dt)
+            if self.sweeps is None:   # Results from a single trace
+                self.sweeps = np.zeros(len(self.xOnsets), dtype=int)
+            self.show_events(self.traces, self.xOnsets, self.yOnsets, self.dt)
             
     def event_highlight(self):
         e = self.plotWidget.currentEvent
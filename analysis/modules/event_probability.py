@@ -6,6 +6,7 @@ import numpy as np
 from analysis import auxfuncs as aux
 from util import pgplot
 import pyqtgraph as pg
+from analysis import detection
 from ..acq4 import filterfuncs as acq4filter
 ####################################
 
@@ -43,6 +44,10 @@ class AnalysisModule():
         self.toolOptions.append([self.eventDirection])
         self.timeBin = QtWidgets.QLineEdit()
         self.toolOptions.append([QtWidgets.QLabel('Time bin'), self.timeBin])
+        self.slidingStep = QtWidgets.QLineEdit()
+        self.toolOptions.append([QtWidgets.QLabel('Sliding step'), self.slidingStep])
+        self.psthBox = QtWidgets.QCheckBox('PSTH')
+        self.toolOptions.append([self.psthBox])
         self.apThreshold = QtWidgets.QPushButton('Set threshold')
         self.apThreshold.setCheckable(True)
         self.apThresholdDisplay = QtWidgets.QLabel('None')
@@ -58,10 +63,18 @@ class AnalysisModule():
         """ Calculate the probability of having an event per time bin
         Very simple threshold crossing event detection.    
 
+        Events of all traces are detected and binned together (see
+        analysis.detection). Onsets exactly on a bin edge are not counted.
+
         Options:
         1) Threshold for detecting spikes
         2) Time bin size (ms)
         3) Event direction
+        4) Sliding step (ms), if set the event rate is also measured in
+           windows of one time bin every step, which like the bins
+           leave out onsets exactly on their edges. Traces shorter
+           than one time bin are left out.
+        5) PSTH, mean event frequency per time bin across traces
         """
     
         ############################################
@@ -78,6 +91,11 @@ class AnalysisModule():
         except ValueError:
             aux.error_box('Invalid time bin')
             return              
+        try:
+            step = np.abs(float(self.slidingStep.text())) if self.slidingStep.text().strip() else None
+        except ValueError:
+            aux.error_box('Invalid sliding step')
+            return
         direction = str(self.eventDirection.currentText())
    
         # Get widgets
@@ -90,12 +108,6 @@ class AnalysisModule():
         except AttributeError:   # Parent = None
             parentText = 'Data'
     
-        # Detect events in each trace
-        if direction=='negative':
-            comp = lambda a, b: a < b
-        elif direction=='positive':
-            comp = lambda a, b: a > b
-  
         # Check time bin (using the first plotted item)
         item = plotWidget.plotDataItems[0]
         dt = item.attrs['dt']
@@ -105,39 +117,49 @@ class AnalysisModule():
             return  
   
         # Detect events
-        results = []        
-        plotWidget.clear()
+        traces, dts = [], []
         for item in plotWidget.plotDataItems:
-            dt = item.attrs['dt']
             data, c1 = aux.get_dataRange(plotWidget, item)
-            apCounter, i = 0, 0
-            xOnsets, yOnsets  = [], []
-            while i<len(data):
-                if comp(data[i],threshold):
-                    xOnsets.append(i)
-                    yOnsets.append(data[i])
-                    apCounter+=1
-                    while i<len(data) and comp(data[i],threshold):
-                        i+=1 # skip values if index in bounds AND until the value is below/above threshold again
-                else:
-                    i+=1
-            
-            # Get events per time bin
-            binSize = int(timeBin/dt)
-            nbins = np.ceil(len(data)/binSize)
-            eventCounter, eventFrequency = [], []
-            for b in np.arange(1, nbins+1):
-                count = np.sum((xOnsets>(b-1)*binSize) & (xOnsets<(b*binSize)))
-                eventCounter.append(count)
-                eventFrequency.append(count/timeBin*1000) # Frequency in Hz
-            bins = np.arange(0+binSize/2., nbins*binSize+binSize/2., binSize)*dt
-
-            # Store data     
-            #results.append(['event_counts', np.array(eventCounter)]) 
-            results.append(['event_frequency', np.array(eventFrequency)])
-
-            # Plot detected events
-            self.show_events(data, np.array(xOnsets), np.array(yOnsets), dt)  
+            traces.append(data)
+            dts.append(item.attrs['dt'])
+        dts = np.array(dts, dtype=float)
+        lengths = np.array([len(data) for data in traces])
+        sweeps, xOnsets = detection.detect_spikes(traces, threshold, direction=direction)
+
+        # Get events per time bin
+        binSizes = (timeBin/dts).astype(int)
+        if binSizes.min()<1:
+            aux.error_box('Invalid time bin', infoText='Make sure time bin is longer than the sampling interval')
+            return
+        nbins = np.ceil(lengths/binSizes).astype(int)
+        counts = detection.bin_counts(sweeps, xOnsets, len(traces), binSizes, nbins.max())
+        results = []
+        for n in range(len(traces)):
+            results.append(['event_frequency', counts[n,:nbins[n]]/timeBin*1000]) # Frequency in Hz
+        longest = np.argmax(nbins)
+        bins = (np.arange(nbins[longest])+0.5)*binSizes[longest]*dts[longest]
+
+        # Sliding window rate, one time bin wide, in samples of each trace
+        if step:
+            stepSizes = np.maximum(1, (step/dts).astype(int))
+            nWindows = np.maximum(0, (lengths-binSizes)//stepSizes+1)
+            starts = np.arange(nWindows.max())[None,:]*stepSizes[:,None]
+            rates = detection.window_counts(sweeps, xOnsets, len(traces), starts, binSizes)/timeBin*1000
+            for n in np.flatnonzero(nWindows):
+                results.append(['event_rate', rates[n,:nWindows[n]]])
+            longest = np.argmax(nWindows)
+            results.append(['rate_times', (starts[longest]+binSizes[longest]/2.)*dts[longest]])
+            if not nWindows.all():
+                message = str(np.sum(nWindows==0))+' traces shorter than the time bin have no event rate'
+                browser.ui.statusbar.showMessage(message, 5000)
+
+        # PSTH, mean over the traces that reach each bin
+        if self.psthBox.isChecked():
+            nTraces = np.sum(nbins[:,None]>np.arange(nbins.max())[None,:], axis=0)
+            results.append(['PSTH', counts.sum(0)/nTraces/timeBin*1000])
+
+        # Plot detected events
+        self.show_events(traces, xOnsets*dts[sweeps], detection.get_values(traces, sweeps, xOnsets), dts)
 
         # Turn cursors off (the plot has been cleared so there are no cursors displayed)    
         self.browser.ui.actionShowCursors.setChecked(False)
@@ -169,10 +191,14 @@ class AnalysisModule():
         plotWidget.cursorThsPos = round(plotWidget.cursorThs.value(),2)
         self.apThresholdDisplay.setText(str(plotWidget.cursorThsPos))
 
-    def show_events(self, data, xOnsets, yOnsets, dt):
+    def show_events(self, traces, xOnsets, yOnsets, dts):
+        """ Plot the traces and all events, as one scatter item. xOnsets
+        are in ms.
+        """
         plotWidget = self.browser.ui.dataPlotsWidget
-        x = pgplot.make_xvector(data, dt)
-        plotWidget.plot(x, data)
-        plotWidget.plot(xOnsets*dt, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=4)
+        plotWidget.clear()
+        for data, dt in zip(traces, dts):
+            pgplot.plot_uniform(plotWidget, data, dt)
+        plotWidget.plot(xOnsets, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=4)
 
 
@@ -6,6 +6,7 @@ import numpy as np
 from analysis import auxfuncs as aux
 from util import pgplot
 import pyqtgraph as pg
+from analysis import detection
 from ..acq4 import filterfuncs as acq4filter
 ####################################
 
@@ -41,6 +42,8 @@ class AnalysisModule():
         self.apThreshold.setCheckable(True)
         self.apThresholdDisplay = QtWidgets.QLabel('None')
         self.toolOptions.append([self.apThreshold, self.apThresholdDisplay])   
+        self.apRefractory = QtWidgets.QLineEdit('0')
+        self.toolOptions.append([QtWidgets.QLabel('Refractory (ms)'), self.apRefractory])
 
         # Connect buttons to functions
         self.apThreshold.toggled.connect(self.show_thresholdCursor)             
@@ -51,8 +54,15 @@ class AnalysisModule():
     def func(self, browser):
         """ Generate a FI curve from current steps
     
+        APs of all traces are detected together (see
+        analysis.detection.detect_spikes), and for each trace the number
+        of APs, first AP latency, mean frequency (1/mean ISI), initial
+        frequency (1/first ISI) and adaptation index are stored.
+    
         Options:
         1) Threshold for detecting spikes
+        2) Refractory period, crossings of the threshold closer than this
+           to the previous AP are not counted
         """
     
         ############################################
@@ -75,46 +85,36 @@ class AnalysisModule():
         except AttributeError:   # Parent = None
             parentText = 'Data'
     
-        # Detect APs in each trace
-        comp = lambda a, b: a > b
-        apNumber, apFrequency, results = [], [], []
-        plotWidget.clear()        
+        # Detect APs in all traces
+        try:
+            refractory = float(self.apRefractory.text())
+        except ValueError:
+            aux.error_box('Invalid refractory period')
+            return
+        traces, dts = [], []
         for item in plotWidget.plotDataItems:
-            dt = item.attrs['dt']
-            data, c1 = aux.get_dataRange(plotWidget, item)           
-            apCounter, i = 0, 0
-            xOnsets, yOnsets  = [], []
-            while i<len(data):
-                if comp(data[i],threshold):
-                    xOnsets.append(i)
-                    yOnsets.append(data[i])
-                    apCounter+=1
-                    while i<len(data) and comp(data[i],threshold):
-                        i+=1 # skip values if index in bounds AND until the value is below/above threshold again
-                else:
-                    i+=1
-            
-            # Calculate AP frequency as 1/mean(ISI)
-            isi = np.mean(np.diff(xOnsets))*dt # in ms
-            if isi>0:
-                freq = 1/(isi/1000.)
-            else:
-                freq = 0.0
+            data, c1 = aux.get_dataRange(plotWidget, item)
+            traces.append(data)
+            dts.append(item.attrs['dt'])
+        dts = np.array(dts, dtype=float)
+        sweeps, xOnsets = detection.detect_spikes(traces, threshold, refractory/dts)   # In samples of each trace
+        apNumber, apLatency, apFrequency, apInitialFrequency, apAdaptation = \
+            detection.spike_stats(sweeps, xOnsets, len(traces), dts)
 
-            # Store number of APs and mean frequency
-            apNumber.append(apCounter)
-            apFrequency.append(freq)         
+        # Plot traces and detected APs
+        self.show_events(traces, xOnsets*dts[sweeps], detection.get_values(traces, sweeps, xOnsets), dts)
 
-            # Plot detected APs
-            self.show_events(data, np.array(xOnsets), np.array(yOnsets), dt)  
-            
         # Turn cursors off (the plot has been cleared so there are no cursors displayed)    
         self.browser.ui.actionShowCursors.setChecked(False)
         plotWidget.cursor = False       
 
         # Store results
-        results.append(['AP_number', np.array(apNumber)])
-        results.append(['AP_frequency', np.array(apFrequency)]) 
+        results = []
+        results.append(['AP_number', apNumber])
+        results.append(['AP_frequency', apFrequency]) 
+        results.append(['AP_initialFrequency', apInitialFrequency])
+        results.append(['AP_latency', apLatency])
+        results.append(['AP_adaptation', apAdaptation])
         aux.save_results(browser, parentText+'_FI', results)     
          
         ############################################  
@@ -140,10 +140,14 @@ class AnalysisModule():
         plotWidget.cursorThsPos = round(plotWidget.cursorThs.value(),2)
         self.apThresholdDisplay.setText(str(plotWidget.cursorThsPos))
 
-    def show_events(self, data, xOnsets, yOnsets, dt):
+    def show_events(self, traces, xOnsets, yOnsets, dts):
+        """ Plot the traces and all APs, as one scatter item. xOnsets
+        are in ms.
+        """
         plotWidget = self.browser.ui.dataPlotsWidget
-        x = pgplot.make_xvector(data, dt)
-        plotWidget.plot(x, data)
-        plotWidget.plot(xOnsets*dt, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=4)
+        plotWidget.clear()
+        for data, dt in zip(traces, dts):
+            pgplot.plot_uniform(plotWidget, data, dt)
+        plotWidget.plot(xOnsets, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=4)
 
 
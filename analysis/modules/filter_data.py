@@ -6,7 +6,8 @@ import numpy as np
 from analysis import auxfuncs as aux
 from util import pgplot
 import pyqtgraph as pg
-from ..acq4 import filterfuncs as acq4filter
+from analysis import filtering
+from analysis import parallel
 ####################################
 
 class AnalysisModule():    
@@ -63,6 +64,9 @@ class AnalysisModule():
         1) Filter type (currently Bessel only)
         2) Filter parameters
         
+        Traces with the same dt and length are filtered in one go, and
+        filter designs are reused (see analysis.filtering.design_sos).
+
         Note: filter frequencies are in Hz, make sure dt is in seconds
         """
     
@@ -93,21 +97,41 @@ class AnalysisModule():
         except AttributeError:   # Parent = None
             parentText = 'Data'
     
-        # Filter data
-        results, itemsToPlot = [], [] 
-        for item in plotWidget.plotDataItems:  
+        # Filter data. Loaded traces with the same dt and length are
+        # filtered together, as the rows of a 2D array, with groups in
+        # parallel threads. Traces that are not loaded or are long are
+        # filtered on their own, a chunk at a time.
+        items = plotWidget.plotDataItems
+        groups, single = {}, []
+        for n, item in enumerate(items):
+            if item.isLoaded() and (np.ndim(item.data)==1) and (len(item.data)<=filtering.FILTER_CHUNK):
+                groups.setdefault((float(item.attrs['dt']), len(item.data)), []).append(n)
+            else:
+                single.append(n)
+
+        def filter_group(key):
+            sos = filtering.design_sos('bessel', order, cutoff, key[0]/1000, btype)
+            return filtering.sos_filter(np.vstack([items[n].data for n in groups[key]]), sos, bidir)
+
+        filtered = [None]*len(items)
+        for key, data in zip(groups, parallel.map_sweeps(filter_group, groups)):
+            for n, trace in zip(groups[key], data):
+                filtered[n] = trace
+        for n in single:
+            sos = filtering.design_sos('bessel', order, cutoff, float(items[n].attrs['dt'])/1000, btype)
+            filtered[n] = filtering.filter_read(items[n].dataRange, items[n].dataLength(), sos, bidir)
+
+        results, itemsToPlot = [], []
+        for item, traceFilter in zip(items, filtered):
             # Copy attributes and add some new ones
-            attrs = item.attrs
+            attrs = dict(item.attrs)
             attrs['filter_type'] = btype
             attrs['filter_cutoff'] = cutoff
             attrs['filter_order'] = order
-        
-            # Filter
-            traceFilter = acq4filter.besselFilter(item.data, cutoff, order, float(item.attrs['dt'])/1000, btype, bidir)
             results.append([item.text(0), traceFilter, attrs])
-        
-            # Store filtered traces            
-            filterItem = aux.make_h5item('filter', traceFilter, item.attrs)
+
+            # Store filtered traces
+            filterItem = aux.make_h5item('filter', traceFilter, attrs)
             itemsToPlot.append(filterItem)
 
         # Plot results
@@ -133,7 +133,7 @@ class AnalysisModule():
             dt = item.attrs['dt']
             fitTracesAttrs.append(item.attrs)
             yData, c1, cx1, cx2 = aux.get_dataRange(plotWidget, item, cursors=True)
-            xRange = pgplot.make_xvector(yData, dt)+cx1
+            xRange = pgplot.get_timeBase(len(yData), dt, cx1)
             self.dataFit.c1 = cx1   
 
             # Fit
@@ -144,7 +144,7 @@ class AnalysisModule():
         
             # Plot fitted function over trace
             if self.extendBox.isChecked():
-                xRange = pgplot.make_xvector(item.data, dt)
+                xRange = pgplot.get_timeBase(len(item.data), dt)
                 #xRange = np.arange(plotWidget.viewBox.viewRange()[0][0], plotWidget.viewBox.viewRange()[0][1], dt)
             fittedTrace = func(xRange, *fitParams)
             plotWidget.plot(xRange, fittedTrace, pen=pg.mkPen('r', width=1))
@@ -5,6 +5,7 @@ from PyQt5 import QtGui, QtCore, QtWidgets
 import numpy as np
 from analysis import auxfuncs as aux
 from util import pgplot
+from util import rangefun
 import pyqtgraph as pg
 ####################################
 
@@ -85,6 +86,12 @@ class AnalysisModule():
         UPDATE: make onset limit X% of peak for events that are not aligned
         and therefore cannot be baselined properly
 
+        Minimum, maximum, area, mean and SEM come from the range index of
+        traces that already have one (see util.rangefuncs), and are
+        otherwise measured over the window directly, which is faster for
+        a single measurement. Traces that are not loaded are measured
+        from the window only.
+
         Options:
         1) create new entries in Working Data tree with the results
         """
@@ -108,34 +115,38 @@ class AnalysisModule():
             # Get dt and data range
             dt = item.attrs['dt']
             data, c1, cx1, cx2 = aux.get_dataRange(plotWidget, item, cursors=True)
+            c2 = c1+len(data)
+            # Window c1:c2 is w1:w2 in the index (just the window for data not loaded)
+            index, offset = rangefun.get_windowRange(item, c1, c2, data, build=False)
+            w1, w2 = c1-offset, c2-offset
 
             # Check baseline
             if 'baselineStart' in item.analysis:
                 bsl = 0  # the mean of the baseline will always be 0
             else:
-                bsl = np.mean(data[0:round(1./dt)])
+                bsl = index.mean(w1, min(w2, w1+round(1./dt)))
 
             # Measure selected parameters
             if self.minBox.isChecked():
-                y = np.min(data)
-                x = np.argmin(data)
+                y, x = index.min(w1, w2)
+                x = x-w1
                 dataMin.append(y)
                 dataMinX.append(x*dt)
                 aux.plot_point(plotWidget, c1, x, y, dt)
 
             if self.maxBox.isChecked():
-                y = np.max(data)
-                x = np.argmax(data)
+                y, x = index.max(w1, w2)
+                x = x-w1
                 dataMax.append(y)
                 dataMaxX.append(x*dt)
                 aux.plot_point(plotWidget, c1, x, y, dt)
 
             if self.areaBox.isChecked():
-                y = np.trapz(data, dx=dt)
+                y = index.area(w1, w2, dt)
                 dataArea.append(y)
 
             if self.meanBox.isChecked():
-                y = np.mean(data)
+                y = index.mean(w1, w2)
                 dataMean.append(y)
                 plotWidget.plot([cx1,cx2], [y,y], pen=pg.mkPen('#CF1C04', width=1))
 
@@ -145,7 +156,7 @@ class AnalysisModule():
                 plotWidget.plot([cx1,cx2], [y,y], pen=pg.mkPen('#CF1C04', width=1))
 
             if self.semBox.isChecked():
-                y = np.std(data)/np.sqrt(len(data))
+                y = index.sem(w1, w2)
                 dataSEM.append(y)
                 plotWidget.plot([cx1,cx2], [y,y], pen=pg.mkPen('#CF1C04', width=1))
 
@@ -51,7 +51,8 @@ class AnalysisModule():
         stackWidget.add_options(self.toolOptions, self.toolGroupBox, self.entryName)
 
     def func(self, browser):
-        """ Smooth traces
+        """ Smooth traces, those of the same length in one go (see
+        analysis.smooth.smooth)
     
         Options:
         1) Window type
@@ -79,18 +80,34 @@ class AnalysisModule():
         except AttributeError:   # Parent = None
             parentText = 'Data'
     
-        # Smooth data
-        results, itemsToPlot = [], [] 
-        for item in plotWidget.plotDataItems:  
+        # Smooth data, traces of the same length together as the rows
+        # of a 2D array
+        items = plotWidget.plotDataItems
+        groups = {}
+        for n, item in enumerate(items):
+            groups.setdefault(np.shape(item.data), []).append(n)
+        smoothed = [None]*len(items)
+        try:
+            for shape, group in groups.items():
+                if len(shape)==1:
+                    data = smooth.smooth(np.vstack([items[n].data for n in group]), window_len=window_len,
+                                         window=window)
+                else:
+                    data = [smooth.smooth(items[n].data, window_len=window_len, window=window) for n in group]
+                for n, trace in zip(group, data):
+                    smoothed[n] = trace
+        except ValueError as e:
+            aux.error_box('Invalid Window Length', infoText=str(e))
+            return
+
+        results, itemsToPlot = [], []
+        for item, traceSmooth in zip(items, smoothed):
             # Copy attributes and add some new ones
-            attrs = item.attrs
+            attrs = dict(item.attrs)
             attrs['smooth_window_type'] = window
             attrs['smooth_window_length'] = window_len
-        
-            # Smooth
-            traceSmooth = smooth.smooth(item.data, window_len=window_len, window=window)
             results.append([item.text(0), traceSmooth, attrs])
-        
+
             # Store smoothed item
             smoothItem = aux.make_h5item('smooth', traceSmooth, item.attrs)
             itemsToPlot.append(smoothItem)
@@ -0,0 +1,200 @@
+from PyQt5 import QtGui, QtCore, QtWidgets
+
+####################################
+# ADD ADDITIONAL IMPORT MODULES HERE
+import numpy as np
+from analysis import auxfuncs as aux
+from util import pgplot
+from analysis import detection
+####################################
+
+class AnalysisModule():
+
+    def __init__(self, browser):
+
+        ############################################
+        # NAME THAT IS LISTED IN THE TAB
+        self.entryName = 'Template Matching'
+        ############################################
+
+        # Get main browser
+        self.browser = browser
+        # Add entry to AnalysisSelectWidget
+        selectItem = QtGui.QStandardItem(self.entryName)
+        selectWidget = self.browser.ui.oneDimToolSelect
+        selectWidget.model.appendRow(selectItem)
+        # Add entry to tool selector
+        browser.customToolSelector.add_tool(self.entryName, self.func)
+        # Add option widgets
+        self.make_option_widgets()
+        # Template made from events, None until made
+        self.eventTemplate = None
+
+
+    def make_option_widgets(self):
+        stackWidget = self.browser.ui.oneDimToolStackedWidget
+        self.toolGroupBox = QtWidgets.QGroupBox('Options')
+        self.toolOptions = []
+
+        ############################################
+        # WIDGETS FOR USER DEFINED OPTIONS
+        self.eventDirection = QtWidgets.QComboBox()
+        self.eventDirection.addItem('negative')
+        self.eventDirection.addItem('positive')
+        self.toolOptions.append([self.eventDirection])
+        self.templateSource = QtWidgets.QComboBox()
+        self.templateSource.addItem('biexponential')
+        self.templateSource.addItem('events')
+        self.toolOptions.append([self.templateSource])
+        self.templateRise = QtWidgets.QLineEdit('0.5')
+        self.toolOptions.append([QtWidgets.QLabel('Rise (ms)'), self.templateRise])
+        self.templateDecay = QtWidgets.QLineEdit('3')
+        self.toolOptions.append([QtWidgets.QLabel('Decay (ms)'), self.templateDecay])
+        self.templateLength = QtWidgets.QLineEdit('20')
+        self.toolOptions.append([QtWidgets.QLabel('Length (ms)'), self.templateLength])
+        self.templateBaseline = QtWidgets.QLineEdit('2')
+        self.toolOptions.append([QtWidgets.QLabel('Baseline (ms)'), self.templateBaseline])
+        self.templateMake = QtWidgets.QPushButton('Make template')
+        self.templateDisplay = QtWidgets.QLabel('None')
+        self.toolOptions.append([self.templateMake, self.templateDisplay])
+        self.criterionThreshold = QtWidgets.QLineEdit('4')
+        self.toolOptions.append([QtWidgets.QLabel('Criterion'), self.criterionThreshold])
+
+        # Connect buttons to functions
+        self.templateMake.clicked.connect(self.make_template)
+        ############################################
+
+        stackWidget.add_options(self.toolOptions, self.toolGroupBox, self.entryName)
+
+    def func(self, browser):
+        """ Detect events by template matching (Clements & Bekkers, 1997)
+
+        A template scaled to the data plus an offset is fitted at each
+        position of each plotted trace (see analysis.detection), and
+        events are detected where the fitted scale over the standard
+        error of the fit goes above the criterion threshold. Sweeps are
+        matched in parallel, each in chunks, so recordings of any length
+        can be used.
+
+        Options:
+        1) Template, a biexponential with the given rise and decay, or
+           made from events (cut with Event Detection) with 'Make template'
+        2) Baseline, time before the event onset in the template
+        3) Criterion threshold, typically 3 to 5
+
+        Onsets are stored as the sweep index and the sample index within
+        the sweep, as in Event Detection, with the amplitude of the
+        fitted template and the criterion of each event.
+        """
+        ############################################
+        # ANALYSIS FUNCTION
+
+        # Get widgets
+        plotWidget = browser.ui.dataPlotsWidget
+        if not plotWidget.plotDataItems:
+            aux.error_box('No data plotted')
+            return
+
+        # Read detection options
+        try:
+            threshold = float(self.criterionThreshold.text())
+            baselineTime = float(self.templateBaseline.text())
+        except ValueError:
+            aux.error_box('Invalid detection value')
+            return
+        direction = str(self.eventDirection.currentText())
+        dt = aux.get_attr(plotWidget.plotDataItems, 'dt')[0]
+        baseline = int(round(baselineTime/dt))
+
+        # Get template, scaled to a peak of 1 so that scales are amplitudes
+        if str(self.templateSource.currentText())=='events':
+            if self.eventTemplate is None:
+                aux.error_box('No template', infoText='Plot cut events and press Make template')
+                return
+            template = self.eventTemplate
+        else:
+            try:
+                tauRise = float(self.templateRise.text())/dt
+                tauDecay = float(self.templateDecay.text())/dt
+                length = int(round(float(self.templateLength.text())/dt))
+            except ValueError:
+                aux.error_box('Invalid template value')
+                return
+            if (tauRise<=0) or (tauDecay<=0) or (length<=baseline+1):
+                aux.error_box('Invalid template value')
+                return
+            template = detection.biexp_template(tauRise, tauDecay, length, baseline, direction)
+
+        # Get data currently plotted, one sweep at a time
+        traces, attrs = [], []
+        for item in plotWidget.plotDataItems:
+            trace, c1 = aux.get_dataRange(plotWidget, item)
+            traces.append(trace)
+            attrs.append(item.attrs)
+
+        # Match template, onsets are (sweep, sample) pairs
+        sweeps, positions, scales, criteria = detection.template_sweeps(traces, template, threshold)
+        xOnsets = positions + baseline
+        yOnsets = detection.get_values(traces, sweeps, xOnsets)
+        amplitudes = scales*template[np.argmax(np.abs(template))]
+        eventCounter = len(xOnsets)
+
+        frequency = eventCounter/(sum(len(trace) for trace in traces)*dt)*1000   # in Hz
+        browser.ui.statusbar.showMessage('%d events detected at %.3g Hz' % (eventCounter, frequency))
+
+        # Store sweeps, event onsets, amplitudes and template in h5 data tree
+        results = []
+        for trace, traceAttrs in zip(traces, attrs):
+            results.append(['trace', trace, traceAttrs])
+        results.append(['sweeps', sweeps])
+        results.append(['xOnsets', xOnsets])
+        results.append(['yOnsets', yOnsets])
+        results.append(['amplitudes', amplitudes])
+        results.append(['criterion', criteria])
+        results.append(['template', template, {'dt': dt, 'baseline': baselineTime}])
+        results.append(['number', np.array([eventCounter])])
+        results.append(['frequency', np.array([frequency])])
+        aux.save_results(browser, 'Template_Matching', results)
+
+        # Plot results
+        self.show_events(traces, xOnsets, yOnsets, dt)
+
+        # Turn cursors off (the plot has been cleared so there are no cursors displayed)
+        self.browser.ui.actionShowCursors.setChecked(False)
+        plotWidget.cursor = False
+        ############################################
+
+    def make_template(self):
+        """ Average the plotted events into a template. Events cut at the
+        start of a trace are shorter than the others and are left out.
+        """
+        plotWidget = self.browser.ui.dataPlotsWidget
+        events = [np.asarray(item.data, dtype=float) for item in plotWidget.plotDataItems]
+        if not events:
+            aux.error_box('No events plotted')
+            return
+        length = max(len(event) for event in events)
+        events = [event for event in events if len(event)==length]
+        average = np.mean(events, axis=0)
+        # Subtract the template baseline
+        dt = plotWidget.plotDataItems[0].attrs['dt']
+        try:
+            baseline = max(1, int(round(float(self.templateBaseline.text())/dt)))
+        except ValueError:
+            baseline = 1
+        template = average - np.mean(average[:baseline])
+        if not np.any(template):
+            aux.error_box('Flat template')
+            return
+        self.eventTemplate = template/np.abs(template).max()
+        self.templateDisplay.setText(str(len(events))+' events')
+        pgplot.plot_uniform(plotWidget, average, dt, pen='r')
+
+    def show_events(self, traces, xOnsets, yOnsets, dt):
+        """ Plot the traces and all events, as one scatter item
+        """
+        plotWidget = self.browser.ui.dataPlotsWidget
+        plotWidget.clear()
+        for trace in traces:
+            pgplot.plot_uniform(plotWidget, trace, dt)
+        plotWidget.plot(xOnsets*dt, yOnsets, pen=None, symbol='o', symbolPen='r', symbolBrush=None, symbolSize=7)
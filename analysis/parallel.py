@@ -0,0 +1,17 @@
+""" Running the same analysis over many sweeps in parallel
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+
+def map_sweeps(func, sweeps):
+    """ [func(sweep) for sweep in sweeps], with sweeps processed in
+    parallel threads. NumPy releases the GIL for work on whole arrays,
+    and threads share the data rather than copying them.
+    """
+    sweeps = list(sweeps)
+    if len(sweeps)<2:
+        return [func(sweep) for sweep in sweeps]
+    with ThreadPoolExecutor(min(len(sweeps), os.cpu_count() or 1)) as pool:
+        return list(pool.map(func, sweeps))
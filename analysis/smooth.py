@@ -1,8 +1,11 @@
 import numpy
+import scipy.signal as signal
 
+WINDOWS = {'flat': numpy.ones, 'hanning': numpy.hanning, 'hamming': numpy.hamming,
+           'bartlett': numpy.bartlett, 'blackman': numpy.blackman}
 
 
-def smooth(x,window_len=11,window='hanning'):
+def smooth(x,window_len=11,window='hanning',axis=-1):
 
     """smooth the data using a window with requested size.
     
@@ -16,9 +19,14 @@ def smooth(x,window_len=11,window='hanning'):
         window_len: the dimension of the smoothing window; should be an odd integer
         window: the type of window from 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'
             flat window will produce a moving average smoothing.
+        axis: the axis to smooth along, e.g. for traces as the rows of a 2D array
 
     output:
-        the smoothed signal
+        the smoothed signal, float32 for float32 input
+
+    The convolution is done directly or by FFT (overlap-add), whichever
+    scipy.signal.choose_conv_method expects to be faster, with long moving
+    averages from cumulative sums instead of FFT.
         
     example:
 
@@ -35,40 +43,60 @@ def smooth(x,window_len=11,window='hanning'):
 
     """
 
-    if x.ndim != 1:
-        raise ValueError("smooth only accepts 1 dimension arrays.")
+    x = numpy.asarray(x)
+    window_len = int(window_len)
+    if x.ndim == 0:
+        raise ValueError("smooth only accepts arrays.")
 
-    if x.size < window_len:
+    if x.shape[axis] < window_len:
         raise ValueError("Input vector needs to be bigger than window size.")
 
     if window_len<3:
         return x
 
-    if not window in ['flat', 'hanning', 'hamming', 'bartlett', 'blackman']:
+    if not window in WINDOWS:
         raise ValueError("Window is one of 'flat', 'hanning', 'hamming', 'bartlett', 'blackman'")
 
-
-    s=numpy.r_[2*x[0]-x[window_len:1:-1],x,2*x[-1]-x[-1:-window_len:-1]]
-
-    #print(len(s))
-    if window == 'flat': #moving average
-        w=ones(window_len,'d')
+    # Work on the last axis, in float32 for float32 data
+    x = numpy.moveaxis(x, axis, -1)
+    dtype = numpy.float32 if x.dtype==numpy.float32 else numpy.float64
+    n = x.shape[-1]
+
+    # Reflected copies at the ends, as in the original smooth, keeping only
+    # the part used for the n outputs: each output is the window over
+    # s[k:k+window_len], starting from half a window before the signal
+    first, last = x[...,:1], x[...,-1:]
+    s = numpy.concatenate([2*first-x[...,window_len:1:-1], x, 2*last-x[...,-1:-window_len:-1]], axis=-1)
+    start = (window_len-1)//2
+    s = s[...,start:start+n+window_len-1].astype(dtype, copy=False)
+
+    w = WINDOWS[window](window_len).astype(dtype)
+    w = (w/w.sum()).reshape((1,)*(s.ndim-1) + (window_len,))
+    if signal.choose_conv_method(s, w, mode='valid')=='direct':
+        y = signal.convolve(s, w, mode='valid', method='direct')
+    elif window == 'flat': #moving average, from cumulative sums
+        y = boxcar(s, window_len).astype(dtype, copy=False)
     else:
-        w=eval('numpy.'+window+'(window_len)')
-
-    y=numpy.convolve(w/w.sum(),s,mode='same')
-
-    return y[window_len-1:-window_len+1]
-
-
+        y = signal.oaconvolve(s, w, mode='valid', axes=-1)
 
+    return numpy.moveaxis(y, -1, axis)
 
 
+def boxcar(s, window_len):
+    """ Mean of each window_len samples of s along the last axis
+    ('valid' positions). Sums are taken relative to the mean of s, in
+    float64, to limit rounding errors.
+    """
+    ref = s.mean(axis=-1, keepdims=True, dtype=numpy.float64)
+    sums = numpy.zeros(s.shape[:-1]+(s.shape[-1]+1,))
+    numpy.cumsum(s-ref, axis=-1, out=sums[...,1:])
+    return (sums[...,window_len:]-sums[...,:-window_len])/window_len + ref
 
-from numpy import *
-from pylab import *
 
 def smooth_demo():
+    from numpy import linspace, sin, ones
+    from numpy.random import randn
+    from pylab import subplot, plot, axis, legend, title, show
 
     t=linspace(-4,4,100)
     x=sin(t)
@@ -81,9 +109,8 @@ def smooth_demo():
 
     windows=['flat', 'hanning', 'hamming', 'bartlett', 'blackman']
 
-    hold(True)
     for w in windows[1:]:
-        eval('plot('+w+'(ws) )')
+        plot(WINDOWS[w](ws))
 
     axis([0,30,0,1.1])
 
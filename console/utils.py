@@ -7,6 +7,7 @@ import pyqtgraph as pg
 from widgets import h5Item
 #from ..util import pgplot
 from analysis import auxfuncs as aux
+from util import h5funcs as h5
 
 
 # Get browser instance
@@ -102,6 +103,41 @@ def store_data(data, array2D=False, name='data', attrs={'dt':1}):
             browser.ui.workingDataTree.dataItems.append(child)
             item.addChild(child)
             
+
+def set_saveOptions(**options):
+    """ Set how datasets are written when saving, e.g.
+
+    set_saveOptions(compression='lzf', shuffle=True, int16=False)
+
+    Options are listed in util.h5funcs.SAVE_OPTIONS. Returns the
+    current options.
+    """
+    for key in options:
+        if key not in h5.SAVE_OPTIONS:
+            raise KeyError(key+' is not a save option, use one of '+str(list(h5.SAVE_OPTIONS)))
+    browser.saveOptions.update(options)
+    return browser.saveOptions
+
+def get_protocol(channel=None):
+    """ Return all sweeps of a channel of the .abf file selected in
+    the file browser as one 2D array (sweeps x samples), e.g.
+
+    data = get_protocol('current')
+    average = data.mean(0)
+
+    'channel' is a group name in the File Data tree, defaults to the
+    first channel.
+    """
+    if browser.dbType!='abf':
+        raise TypeError('Select an .abf file in the file browser first')
+    channels = h5.get_abfChannels(browser.db)
+    names = [c[0] for c in channels]
+    if channel is None: channel = names[0]
+    if channel not in names:
+        raise KeyError(str(channel)+' is not a channel, use one of '+str(names))
+    name, stream, c = channels[names.index(channel)]
+    return h5.read_abfProtocol(browser.db, stream, c)
+
             
 # Ploting functions
 def plot_data(*args, **kwargs): #color='#3790CC', clear=False):
@@ -0,0 +1,107 @@
+""" Metadata of data files, for the file catalogue (util.indexfuncs)
+
+These functions run in the worker processes of index_folder, which are
+spawned and import this module on their own. It must not import Qt,
+and it is kept at the top level rather than in util next to indexfuncs
+and videofuncs because util/__init__ imports all of util, Qt and the
+widgets: importing it from there would load the whole GUI in each
+worker, and fail on circular imports. For the same reason start.py
+only imports the main window when run as a script.
+"""
+
+import os
+import numpy as np
+import h5py
+import imageio_ffmpeg
+from nptdms import TdmsFile
+from neo.rawio import AxonRawIO
+
+FILE_TYPES = {'.hdf5': 'hdf5', '.h5': 'hdf5', '.tdms': 'tdms', '.abf': 'abf',
+              '.mp4': 'video', '.avi': 'video'}
+
+
+def read_fileMetadata(path):
+    """ Read the metadata of a data file. Runs in the indexing processes,
+    so only plain Python objects are returned.
+    """
+    stat = os.stat(path)
+    meta = {'path': path, 'folder': os.path.dirname(path), 'name': os.path.basename(path),
+            'type': FILE_TYPES[os.path.splitext(path)[1].lower()],
+            'mtime': stat.st_mtime, 'size': stat.st_size, 'notes': '', 'description': '',
+            'sampling_rate': None, 'duration': None, 'error': None, 'datasets': []}
+    try:
+        if meta['type']=='hdf5':
+            read_h5Metadata(path, meta)
+        elif meta['type']=='tdms':
+            read_tdmsMetadata(path, meta)
+        elif meta['type']=='abf':
+            read_abfMetadata(path, meta)
+        elif meta['type']=='video':
+            info = read_videoHeader(path)
+            meta['duration'] = info['duration']
+            meta['datasets'].append(['video', str(info['size']), info['codec'], 1000./info['fps']])
+    except Exception as e:   # Keep indexing, the error is stored in the catalogue
+        meta['error'] = repr(e)
+    return meta
+
+def read_h5Metadata(path, meta):
+    with h5py.File(path, 'r') as f:
+        meta['notes'] = attr_text(f.attrs.get('Notes', ''))
+        meta['description'] = attr_text(f.attrs.get('description', ''))
+        for attr, value in f.attrs.items():
+            if 'kHz' in attr:
+                meta['sampling_rate'] = float(value)
+        def add_dataset(name, h5object):
+            if isinstance(h5object, h5py.Dataset):
+                dt = h5object.attrs.get('dt')
+                dt = float(dt) if (dt is not None) and np.isscalar(dt) else None
+                meta['datasets'].append(['/'+name, str(h5object.shape), str(h5object.dtype), dt])
+        f.visititems(add_dataset)
+    if meta['sampling_rate'] is None:
+        dts = [d[3] for d in meta['datasets'] if d[3]]
+        if dts: meta['sampling_rate'] = 1./dts[0]
+
+def read_tdmsMetadata(path, meta):
+    tdms = TdmsFile.read_metadata(path)
+    dt = None
+    for attr, value in tdms.properties.items():
+        if 'kHz' in attr:
+            meta['sampling_rate'] = float(value)
+            dt = 1./float(value)
+    for group in tdms.groups():
+        for channel in group.channels():
+            meta['datasets'].append(['/'+group.name+'/'+channel.name, str((len(channel),)),
+                                     str(channel.dtype), dt])
+
+def read_abfMetadata(path, meta):
+    reader = AxonRawIO(filename=path)
+    reader.parse_header()
+    nSweeps = reader.segment_count(0)
+    for stream in range(reader.signal_streams_count()):
+        rate = reader.get_signal_sampling_rate(stream)/1000.   # kHz
+        meta['sampling_rate'] = rate
+        streamId = reader.header['signal_streams'][stream]['id']
+        channels = reader.header['signal_channels']
+        channels = channels[channels['stream_id']==streamId]
+        n = reader.get_signal_size(0, 0, stream)
+        for channel in channels:
+            meta['datasets'].append(['/'+(channel['name'] or channel['id'])+' ('+channel['units']+')',
+                                     str((nSweeps, n)), 'float64', 1./rate])
+
+def attr_text(value):
+    if isinstance(value, bytes):
+        value = value.decode(errors='replace')
+    return str(value)
+
+def read_videoHeader(filename):
+    """ Get video properties from the ffmpeg header output
+    """
+    reader = imageio_ffmpeg.read_frames(filename)
+    meta = next(reader)   # First item is the metadata, no frames are read
+    reader.close()
+    info = {'size': list(meta['size']),
+            'fps': meta['fps'],
+            'duration': meta['duration'],
+            'nframes': int(round(meta['fps']*meta['duration'])),
+            'codec': meta['codec']}
+    return info
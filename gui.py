@@ -100,6 +100,15 @@ class Ui_MainWindow(object):
         self.saveFolderButton = QtWidgets.QPushButton('Save Folder')
         self.folderLayout.addWidget(self.saveFolderInput, 1, 0)
         self.folderLayout.addWidget(self.saveFolderButton, 1, 1)
+        self.fileSearchInput = QtWidgets.QLineEdit()
+        self.fileSearchInput.setPlaceholderText('Search indexed files, e.g. loom rate:10 type:hdf5')
+        self.indexFolderButton = QtWidgets.QPushButton('Index Folder')
+        self.folderLayout.addWidget(self.fileSearchInput, 2, 0)
+        self.folderLayout.addWidget(self.indexFolderButton, 2, 1)
+
+        # TAB 1 content > Search results
+        self.fileSearchList = QtWidgets.QListWidget(self.verticalsplitter_dataTab)
+        self.fileSearchList.hide()
 
 
         # TAB 1 content > DirTree
@@ -124,7 +133,7 @@ class Ui_MainWindow(object):
         self.fileDataTree.setSortingEnabled(True)
         self.fileDataTree.headerItem().setText(0, _fromUtf8("Data"))
 
-        self.verticalsplitter_dataTab.setSizes([1,500])
+        self.verticalsplitter_dataTab.setSizes([1,150,500])
 
         # -----
         # TAB 2   (oneDimAnalysisTab) -> toolSelect and toolStackedWidget
@@ -482,10 +491,22 @@ class Ui_MainWindow(object):
         self.actionNewFile = QtWidgets.QAction('New', MainWindow)
         self.actionSaveFile = QtWidgets.QAction('Save', MainWindow)
         self.actionSaveFileAs = QtWidgets.QAction('Save As', MainWindow)
+        self.actionRepackFile = QtWidgets.QAction('Repack', MainWindow)
+        self.actionRepackFile.setToolTip('Save by rewriting the whole file')
+        self.actionLazyLoad = QtWidgets.QAction('Lazy load', MainWindow)
+        self.actionLazyLoad.setCheckable(True)
+        self.actionLazyLoad.setChecked(True)
+        self.actionOpenGL = QtWidgets.QAction('OpenGL', MainWindow)
+        self.actionOpenGL.setCheckable(True)
+        self.actionOpenGL.setToolTip('Draw data and video plots with OpenGL')
         self.toolBar.addAction(self.actionNewFile)
         self.toolBar.addAction(self.actionLoadData)
         self.toolBar.addAction(self.actionSaveFile)
         self.toolBar.addAction(self.actionSaveFileAs)
+        self.toolBar.addAction(self.actionRepackFile)
+        self.toolBar.addSeparator()
+        self.toolBar.addAction(self.actionLazyLoad)
+        self.toolBar.addAction(self.actionOpenGL)
 
         # Plot Toolbar
         self.actionPlotData = QtWidgets.QAction('Plot', MainWindow)
@@ -18,8 +18,8 @@ import numpy as np
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtCore import pyqtSignal
 from gui import Ui_MainWindow
-from widgets import h5Item, tableItem
-from util import h5, mplplot, treefun, table, pgplot, imagefun
+from widgets import h5Item, tableItem, h5SaveDialog, h5LoadProgress
+from util import h5, mplplot, treefun, table, pgplot, imagefun, indexfun
 from analysis import toolselector, auxfuncs, template
 from console import utils as utilsconsole
 
@@ -57,10 +57,14 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         
         # Lists for storing data
         self.db = None
+        self.dbFile = None
         self.wdb = None
+        self.loader = None
+        self.tdmsReaders = {}   # Open .tdms files, by file name
         
         # Current working file and folder for saving
         self.currentSaveFile = []
+        self.saveOptions = dict(h5.SAVE_OPTIONS)
         self.currentFolder = self.ui.dirTree.homeFolder
         self.saveFolder = self.currentFolder
 
@@ -91,6 +95,10 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         self.ui.loadFolderButton.clicked.connect(self.select_loadFolder)
         self.ui.saveFolderInput.setText(self.currentFolder)
         self.ui.saveFolderButton.clicked.connect(self.select_saveFolder)
+        self.indexer = None
+        self.ui.indexFolderButton.clicked.connect(self.index_folderOnPush)
+        self.ui.fileSearchInput.textChanged.connect(self.search_filesOnTextChanged)
+        self.ui.fileSearchList.itemClicked.connect(self.select_fileOnSearchClick)
 
         # File data tree
         # -----------------------------------------------------------------------------
@@ -98,6 +106,7 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         self.ui.fileDataTree.root = self.ui.fileDataTree.invisibleRootItem()
         self.ui.fileDataTree.root.attrs = {}        
         self.ui.fileDataTree.currentItemChanged.connect(self.plot_OnSelectionChanged)
+        self.ui.fileDataTree.itemExpanded.connect(self.expand_h5OnItemExpanded)
         self.ui.fileDataTree.itemSelectionChanged.connect(lambda: self.store_Selection(1))
         self.ui.workingDataTree.itemSelectionChanged.connect(lambda: self.store_Selection(2))
         self.ui.loadFolderInput.returnPressed.connect(self.update_loadDir)
@@ -127,12 +136,17 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         # -----------------------------------------------------------------------------
         self.ui.workingDataTree.data = []
         self.ui.workingDataTree.dataItems = []
+        self.ui.workingDataTree.savedFile = None
         self.ui.workingDataTree.root = self.ui.workingDataTree.invisibleRootItem()
         self.ui.workingDataTree.root.attrs = {}
         self.ui.actionLoadData.triggered.connect(self.load_h5OnLoadPush)
         self.ui.actionNewFile.triggered.connect(self.create_h5OnNewPush)
         self.ui.actionSaveFile.triggered.connect(self.save_h5OnSavePush)
         self.ui.actionSaveFileAs.triggered.connect(self.save_h5OnSaveAsPush)
+        self.ui.actionRepackFile.triggered.connect(self.save_h5OnRepackPush)
+        self.loadProgress = h5LoadProgress()
+        self.loadProgress.cancelled.connect(self.cancel_loadOnPush)
+        self.ui.statusbar.addPermanentWidget(self.loadProgress)
         
         self.ui.workingDataTree.dropped.connect(self.move_itemsAcross)
         self.ui.workingDataTree.targetPosition.connect(self.set_targetPosition)
@@ -189,6 +203,8 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         self.ui.actionPlotData.triggered.connect(self.plot_selected)
         self.ui.actionShowCursors.triggered.connect(self.show_cursors)
         self.ui.actionAnalyseData.triggered.connect(self.analyse_data)
+        self.ui.dataPlotsWidget.sweepPicked.connect(self.show_pickedSweep)
+        self.ui.actionOpenGL.toggled.connect(self.set_openGLOnToggle)
         
 
         # Video tab
@@ -206,33 +222,50 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         """ Load hdf5 file
         """
         if self.db: 
-            if self.dbType=='hdf5':
+            if self.dbType in ['hdf5', 'tdms']:
                 self.db.close()
             self.db = None
         h5.load_h5(self, self.ui.fileDataTree, push=False)
 
+    def expand_h5OnItemExpanded(self, item):
+        h5.populate_h5branch(self, item)
+
     def load_h5OnLoadPush(self):
-        h5.load_h5(self, self.ui.workingDataTree, push=True)
+        h5.load_h5(self, self.ui.workingDataTree, push=True, background=True)
+
+    def cancel_loadOnPush(self):
+        if self.loader: self.loader.cancel()
         
     def create_h5OnNewPush(self):
         h5.create_h5(self, self.ui.workingDataTree)
 
     def save_h5OnSavePush(self):
+        self.save_h5File(full=False)
+
+    def save_h5OnRepackPush(self):
+        """ Save rewriting the whole file instead of only the changes
+        """
+        self.save_h5File(full=True)
+
+    def save_h5File(self, full=False):
         if self.currentSaveFile:
             fname = os.path.split(self.currentSaveFile)[1] # update save folder to user selected if necessary
             self.currentSaveFile = str(self.saveFolder) + '/' + fname
-            h5.save_h5(self, self.ui.workingDataTree)
+            h5.save_h5(self, self.ui.workingDataTree, full=full)
         else: 
             fname, ok = QtWidgets.QInputDialog.getText(self, 'New file', 'Enter file name:')
             if ok:
                 self.currentSaveFile = str(self.saveFolder) + '/' + fname + '.hdf5'
-                h5.save_h5(self, self.ui.workingDataTree)
+                h5.save_h5(self, self.ui.workingDataTree, full=full)
         h5.load_h5(self, self.ui.fileDataTree, push=False) # Re-open currently selected file
         
     def save_h5OnSaveAsPush(self):
-        fname, ok = QtWidgets.QInputDialog.getText(self, 'New file', 'Enter file name:')
+        dialog = h5SaveDialog(self.saveOptions, parent=self)
+        ok = dialog.exec()
+        fname = str(dialog.nameInput.text())
         if self.ui.saveFolderInput.text()!='': self.update_saveDir()
         if ok:
+            self.saveOptions.update(dialog.getOptions())
             self.currentSaveFile = self.saveFolder + '/' + fname + '.hdf5'      
             h5.save_h5(self, self.ui.workingDataTree)        
         h5.load_h5(self, self.ui.fileDataTree, push=False) # Re-open currently selected file
@@ -245,6 +278,53 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
         except OSError:
             return
 
+    # -----------------------------------------------------------------------------
+    # File index Methods
+    # -----------------------------------------------------------------------------
+    def index_folderOnPush(self):
+        """ Index the folder shown in the file browser in the background,
+        or cancel indexing if it is running
+        """
+        if self.indexer:
+            self.indexer.cancel()
+            return
+        folder = str(self.ui.dirTree.model.rootPath())
+        self.indexer = indexfun.indexThread(folder)
+        self.indexer.progress.connect(lambda done, total:
+            self.ui.statusbar.showMessage('Indexing '+folder+': '+str(done)+' of '+str(total)+' files'))
+        self.indexer.finished.connect(self.index_folderFinished)
+        self.ui.indexFolderButton.setText('Cancel Indexing')
+        self.indexer.start()
+
+    def index_folderFinished(self):
+        self.ui.statusbar.showMessage('Indexed '+str(self.indexer.nFiles)+' new or changed files', 5000)
+        self.ui.indexFolderButton.setText('Index Folder')
+        self.indexer = None
+        self.search_filesOnTextChanged(self.ui.fileSearchInput.text())
+
+    def search_filesOnTextChanged(self, text):
+        """ List the indexed files in the browser folder that match the search
+        """
+        self.ui.fileSearchList.clear()
+        if not str(text).strip():
+            self.ui.fileSearchList.hide()
+            return
+        folder = str(self.ui.dirTree.model.rootPath())
+        try:
+            paths = indexfun.search_catalogue(str(text), folder)
+        except ValueError:   # Incomplete filter, e.g. 'rate:'
+            return
+        for path in paths:
+            item = QtWidgets.QListWidgetItem(os.path.relpath(path, folder))
+            item.setData(QtCore.Qt.UserRole, path)
+            self.ui.fileSearchList.addItem(item)
+        self.ui.fileSearchList.show()
+
+    def select_fileOnSearchClick(self, item):
+        index = self.ui.dirTree.model.index(item.data(QtCore.Qt.UserRole))
+        self.ui.dirTree.scrollTo(index)
+        self.ui.dirTree.selectionModel().select(index, QtCore.QItemSelectionModel.ClearAndSelect)
+
     # -----------------------------------------------------------------------------
     # Tree Methods
     # -----------------------------------------------------------------------------    
@@ -294,7 +374,7 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
           targetItems = []
           for item in self.copyItems:
             i = h5Item([str(item.text(0))])
-            i.data = item.data
+            h5.copy_data(item, i)
             targetItems.append(i)             
           parentIndex = self.ui.workingDataTree.indexFromItem(self.dragTargetParent)
           for row in np.arange(0, len(self.copyItems)):
@@ -517,9 +597,13 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
     # -----------------------------------------------------------------------------
     def plot_OnSelectionChanged(self, current, previous):
         if current:
-            data = h5.get_dataFromFile(self, current)
-            if data is not None:
-                pgplot.plot_singleData(self, self.ui.singlePlotWidget, data)    
+            preview = h5.get_previewFromFile(self, current)
+            if preview is not None:
+                x, data, fraction = preview
+                pgplot.plot_singleData(self, self.ui.singlePlotWidget, data, x)    
+                if fraction<1:
+                    self.ui.statusbar.showMessage('Preview sampled from %.2g%% of the trace, load it to see all the data'
+                                                  % (fraction*100), 5000)
 
     def browse_OnSelectionChanged(self, current, previous):
       if current is not None:
@@ -552,6 +636,28 @@ class NeuroDaqWindow(QtWidgets.QMainWindow):
             #tableItem.itemChanged = ''
             #self.ui.propsTableWidget.setItem(0,0, tableItem)
 
+    def set_openGLOnToggle(self, on):
+        """ Switch the data and video plots to OpenGL and back, falling
+        back to the default painter if OpenGL is not available
+        """
+        available = True
+        for plotWidget in [self.ui.dataPlotsWidget, self.ui.dataVideoWidget.plotsWidget]:
+            available = plotWidget.set_openGL(on)
+        if on and not available:
+            self.ui.actionOpenGL.blockSignals(True)
+            self.ui.actionOpenGL.setChecked(False)
+            self.ui.actionOpenGL.blockSignals(False)
+            self.ui.statusbar.showMessage('OpenGL is not available, using the default painter', 5000)
+
+    def show_pickedSweep(self, item):
+        """ Show which item a sweep clicked in an overlay plot comes from
+        """
+        path, parent = item.text(0), item.parent()
+        while parent is not None:
+            path, parent = parent.text(0)+'/'+path, parent.parent()
+        self.ui.statusbar.showMessage('Sweep: /'+path)
+        self.ui.workingDataTree.scrollToItem(item)
+
     def plot_selected(self):
         self.ui.actionBrowseData.setChecked(False)
         itemList = self.ui.workingDataTree.selectedItems()
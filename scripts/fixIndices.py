@@ -12,4 +12,5 @@ item = browser.ui.workingDataTree.selectedItems()[0]
 ths = 0.5
 i = item.data>ths
 item.data[i] = 2
+item.mark_changed()   # Changed in place
 
@@ -1,6 +1,7 @@
-import mainWindow as m
-
 global browser
 
 if __name__ == '__main__':
+    # Imported here so that spawned worker processes (see util.indexfuncs),
+    # which import this module, don't load the GUI
+    import mainWindow as m
     browser = m.main() 
@@ -0,0 +1,4 @@
+import os, sys
+
+# Modules are imported from the repository root, as when NeuroDAQ runs
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,178 @@
+""" Tests for analysis.detection
+
+detect_events is compared with the per-sample loop that Event Detection
+used before it was vectorized, kept here as the reference.
+
+Template matching is checked against a least squares fit at each
+position, and on a trace with biexponential events injected at known
+positions and amplitudes.
+"""
+
+import numpy as np
+import pytest
+from analysis.detection import detect_events, detect_sweeps, detect_spikes, bin_counts, window_counts, \
+                               biexp_template, match_chunks, detect_template, template_sweeps
+
+
+def loop_events(data, threshold, noiseSafety, minInterval, minDuration, direction):
+    """ Event Detection's original detection loop
+    """
+    comp = (lambda a, b: a < b) if direction=='negative' else (lambda a, b: a > b)
+    i, iLastDetection = 0, 0
+    xOnsets = []
+    while i<len(data):
+        if comp(data[i], threshold):
+            if i-iLastDetection>minInterval:   # Min inter-event interval
+                xOnsets.append(i)
+                iLastDetection = i
+                while i<len(data) and comp(data[i], threshold-noiseSafety):
+                    i+=1
+                if i-iLastDetection<minDuration:   # Event is too brief
+                    xOnsets.pop()
+            else:
+                i+=1
+        else:
+            i+=1
+    return np.array(xOnsets, dtype=int)
+
+def random_trace(rng):
+    """ Noise, or a random walk rounded so that values repeat and land
+    exactly on the thresholds
+    """
+    n = rng.integers(1, 2000)
+    if rng.random()<0.5:
+        return rng.standard_normal(n)
+    return np.round(rng.standard_normal(n).cumsum()*rng.uniform(0.2, 2), 1)
+
+def random_options(rng):
+    threshold = rng.choice([-3., -1.5, -0.5, 0., 0.5, 1.5, 2.])
+    noiseSafety = rng.choice([0., 0.5, 1., 3., -0.5, -1.])
+    minInterval = rng.choice([0., 0.4, 1., 3., 10.5, 50., 400.])
+    minDuration = rng.choice([0., 0.5, 1., 2.5, 10., 40.])
+    direction = rng.choice(['negative', 'positive'])
+    return threshold, noiseSafety, minInterval, minDuration, str(direction)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_detect_events_matches_loop(seed):
+    rng = np.random.default_rng(seed)
+    for case in range(100):
+        data = random_trace(rng)
+        options = random_options(rng)
+        expected = loop_events(data, *options)
+        np.testing.assert_array_equal(detect_events(data, *options), expected,
+                                      err_msg='case %d, options %s' % (case, options))
+
+@pytest.mark.parametrize('direction', ['negative', 'positive'])
+def test_detect_events_negative_noise_safety(direction):
+    # Negative noise safety ends events before data come back to threshold
+    rng = np.random.default_rng(1)
+    sign = -1 if direction=='negative' else 1
+    for noiseSafety in [-0.2, -1., -5.]:
+        data = sign*rng.standard_normal(5000).cumsum()/10.
+        options = (sign*1., sign*noiseSafety, 2.5, 1.5, direction)
+        np.testing.assert_array_equal(detect_events(data, *options), loop_events(data, *options))
+
+def test_detect_events_fractional_times():
+    # Interval and duration in samples need not be whole numbers
+    rng = np.random.default_rng(2)
+    data = rng.standard_normal(20000)
+    for minInterval in [0.5, 1.5, 2.99, 7.25]:
+        for minDuration in [0.5, 1.01, 2.5]:
+            options = (-1., -0.3, minInterval, minDuration, 'negative')
+            np.testing.assert_array_equal(detect_events(data, *options), loop_events(data, *options))
+
+def test_detect_events_empty():
+    assert len(detect_events(np.zeros(0), -1.)) == 0
+    assert len(detect_events(np.zeros(100), -1.)) == 0
+
+def test_detect_sweeps_matches_each_sweep():
+    rng = np.random.default_rng(3)
+    sweeps = [rng.standard_normal(rng.integers(100, 3000)) for n in range(6)]
+    options = (-1., -0.5, 3., 2., 'negative')
+    sweepIndex, onsets = detect_sweeps(sweeps, *options)
+    for n, sweep in enumerate(sweeps):
+        np.testing.assert_array_equal(onsets[sweepIndex==n], loop_events(sweep, *options))
+
+def test_detect_spikes_refractory_per_sweep():
+    # Same spikes, 10 samples apart, in sweeps sampled at different rates
+    sweeps = np.zeros((2, 100))
+    sweeps[:, [10, 11, 20, 21, 30, 31]] = 1
+    sweepIndex, spikes = detect_spikes(sweeps, 0.5, np.array([5, 15]))
+    assert spikes[sweepIndex==0].tolist()==[10, 20, 30]
+    assert spikes[sweepIndex==1].tolist()==[10, 30]
+    sweepIndex, spikes = detect_spikes(list(sweeps), 0.5, 15)
+    assert spikes.tolist()==[10, 30, 10, 30]
+
+def test_window_counts_match_bins():
+    # Windows one bin wide, one bin apart, are the bins, edges included
+    rng = np.random.default_rng(0)
+    nSweeps, length, binSize = 3, 1000, 50
+    onsets = [rng.choice(np.arange(1, length), 40, replace=False) for n in range(nSweeps)]
+    onsets[0][:2] = [0, 100]   # on bin edges
+    sweepIndex = np.repeat(np.arange(nSweeps), 40)
+    onsets = np.concatenate([np.sort(o) for o in onsets])
+    bins = bin_counts(sweepIndex, onsets, nSweeps, binSize, length//binSize)
+    starts = np.arange(0, length, binSize)
+    assert np.array_equal(window_counts(sweepIndex, onsets, nSweeps, starts, binSize), bins)
+    # One row of starts and one window per sweep
+    starts = np.array([starts, starts*2])
+    counts = window_counts(sweepIndex[:80], onsets[:80], 2, starts[:, :10], [binSize, binSize*2])
+    assert np.array_equal(counts[0], bins[0, :10])
+    assert np.array_equal(counts[1], bin_counts(sweepIndex[40:80]-1, onsets[40:80], 1, binSize*2, 10)[0])
+
+def fit_template(data, template):
+    """ Scale and criterion of the least squares fit of template*scale+offset
+    at each position, one position at a time
+    """
+    n = len(template)
+    design = np.column_stack([template, np.ones(n)])
+    scales, criteria = [], []
+    for p in range(len(data)-n+1):
+        (scale, offset), sse = np.linalg.lstsq(design, data[p:p+n], rcond=None)[:2]
+        error = np.sqrt(sse[0]/(n-1)) if len(sse) else 0.
+        scales.append(scale)
+        criteria.append(scale/error if error>0 else 0.)
+    return np.array(scales), np.array(criteria)
+
+def inject_events(rng, template, length, positions, amplitudes, noise=0.05):
+    data = rng.standard_normal(length)*noise + 3.
+    for position, amplitude in zip(positions, amplitudes):
+        data[position:position+len(template)] += amplitude*template
+    return data
+
+def test_match_chunks_matches_fit():
+    rng = np.random.default_rng(1)
+    template = biexp_template(2., 8., 40, 5, 'negative')
+    data = inject_events(rng, template, 600, [50, 300], [1., 2.], noise=0.3)
+    scales, criteria = fit_template(data, template)
+    for chunk in [1000, 64, 1]:
+        chunks = list(match_chunks(data, template, chunk))
+        assert [c[0] for c in chunks]==list(range(0, len(scales), chunk))
+        np.testing.assert_allclose(np.concatenate([c[1] for c in chunks]), scales, atol=1e-9)
+        np.testing.assert_allclose(np.concatenate([c[2] for c in chunks]), criteria, rtol=1e-6, atol=1e-6)
+
+def test_detect_template_finds_injected_events():
+    rng = np.random.default_rng(2)
+    template = biexp_template(3., 15., 100, 10, 'negative')
+    positions = np.array([200, 900, 1500, 2990, 4000])
+    amplitudes = np.array([0.5, 1., 2., 1.5, 0.8])
+    data = inject_events(rng, template, 5000, positions, amplitudes)
+    for chunk in [2**20, 1000, 37]:   # events across chunk edges too
+        found, scales, criteria = detect_template(data, template, 4., chunk)
+        np.testing.assert_array_equal(found, positions)
+        np.testing.assert_allclose(scales, amplitudes, atol=0.05)
+        assert np.all(criteria>4.)
+
+def test_template_sweeps_matches_each_sweep():
+    rng = np.random.default_rng(4)
+    template = biexp_template(1., 5., 30, 3, 'positive')
+    sweeps = [inject_events(rng, template, n, [50, 200, 400], [1., 2., 3.], noise=0.2)
+              for n in [500, 800, 1200]]
+    sweeps.insert(2, rng.standard_normal(20))   # shorter than the template
+    sweepIndex, positions, scales, criteria = template_sweeps(sweeps, template, 4.)
+    assert np.all(np.diff(sweepIndex)>=0)
+    for n, sweep in enumerate(sweeps):
+        expected = detect_template(sweep, template, 4.)
+        np.testing.assert_array_equal(positions[sweepIndex==n], expected[0])
+        np.testing.assert_array_equal(scales[sweepIndex==n], expected[1])
@@ -0,0 +1,53 @@
+""" Tests for the OpenGL switch of widgets.plotWidgets
+
+Runs headless on the offscreen platform. With Mesa (or any driver that
+gives an OpenGL context) the plot is rendered through the OpenGL
+viewport, otherwise that test is skipped and only the fallback to the
+default painter is checked.
+"""
+
+import os
+import numpy as np
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+QtWidgets = pytest.importorskip('PyQt5.QtWidgets')
+plotWidgets = pytest.importorskip('widgets.plotWidgets', exc_type=ImportError)
+
+
+@pytest.fixture(scope='module')
+def app():
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+@pytest.fixture
+def plot(app):
+    widget = plotWidgets.plotWidget()
+    widget.resize(400, 300)
+    widget.plot(np.sin(np.linspace(0, 100, 10**5)))
+    yield widget
+    widget.close()
+
+
+def render(widget):
+    widget.show()
+    QtWidgets.QApplication.processEvents()
+    return widget.grab()
+
+
+def test_set_openGL_falls_back(plot, monkeypatch):
+    monkeypatch.setattr(plotWidgets, 'openGL', False)
+    assert plot.set_openGL(True) is False
+    assert not isinstance(plot.viewport(), QtWidgets.QOpenGLWidget)
+    assert not render(plot).isNull()
+
+
+def test_set_openGL_renders(plot):
+    if not plotWidgets.openGL_available():
+        pytest.skip('no OpenGL context on this platform')
+    assert plot.set_openGL(True)
+    assert isinstance(plot.viewport(), QtWidgets.QOpenGLWidget)
+    assert not render(plot).isNull()
+    plot.set_openGL(False)
+    assert not isinstance(plot.viewport(), QtWidgets.QOpenGLWidget)
+    assert not render(plot).isNull()
@@ -7,3 +7,7 @@ from . import treefuncs as treefun
 from . import tablefuncs as table
 from . import pgfuncs as pgplot
 from . import imagefuncs as imagefun
+from . import videofuncs as videofun
+from . import indexfuncs as indexfun
+from . import pyramidfuncs as pyramidfun
+from . import rangefuncs as rangefun
@@ -4,34 +4,250 @@ and into H5 trees
 Save overwrites the current file, New File and Save As are 
 saved to the folder selected in the Save text input.
 
+When the Working Data tree was loaded from (or last saved to) the
+current file, Save only writes what changed since then: new or
+modified datasets, attributes, renames and deletions. Repack rewrites
+the whole file, which also reclaims the space left by deleted data.
+
 Attributes are attached to datasets only, not to groups (yet).
 """
 
-import sys, os, re, copy
+import sys, os, re, copy, time, threading
 import h5py
 from PyQt5 import QtGui, QtCore, QtWidgets
 import sip
 import numpy as np
 from widgets import h5Item
+from widgets.h5Widgets import data_checksum
 from nptdms import TdmsFile
 from . import tablefuncs as table
 #import tablefuncs as table
 from . import imagefuncs as imagefun
+from . import videofuncs as videofun
 from neo import io
-from moviepy.editor import *
 
-def load_h5(browser, tree, push):
+
+# Default options for writing datasets. Can be changed from the Save As
+# dialog or the console with ndaq.set_saveOptions().
+#   compression: None, 'gzip' or 'lzf'
+#   compression_opts: gzip level (0-9)
+#   shuffle: byte shuffle filter, helps compression of numeric data
+#   chunkBytes: target chunk size; chunks hold consecutive samples
+#   int16: store floating point data as int16 plus scale and offset
+#          attributes (lossy, meant for data from 16 bit ADCs)
+SAVE_OPTIONS = {'compression': 'gzip', 'compression_opts': 4, 'shuffle': True,
+                'chunkBytes': 256*1024, 'int16': False}
+
+# Attributes used to restore int16 datasets, not shown in the trees
+SCALE_ATTRS = ['int16_scale', 'int16_offset']
+
+# File Data tree previews: points per trace, and samples read at most.
+# Longer traces are previewed from one window of whole chunks per point
+# pair, so the preview is sampled.
+PREVIEW_POINTS = 10000
+PREVIEW_MAX_READ = 2*1024**2
+
+
+class h5DataProxy():
+    """ Lightweight stand-in for a dataset in a .hdf5 file.
+
+    Only the file name, dataset path, shape and dtype are kept. The file
+    is opened read-only when the data are requested and closed again
+    straight away, so the proxy stays valid when browser.db is closed
+    or pointed at another file.
+    """
+
+    def __init__(self, filename, path, shape=None, dtype=None):
+        self.filename = filename
+        self.path = path
+        self.shape = shape
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, start=None, stop=None):
+        """ Read the dataset, or samples start:stop along the first axis
+        """
+        with h5py.File(self.filename, 'r') as f:
+            return read_h5Dataset(f[self.path], start, stop)
+
+
+class tdmsReader():
+    """ Streaming handle on a .tdms file, shared by the proxies of its
+    channels so that the segment metadata are parsed once, not on every
+    read. The file is opened on the first read and closed when another
+    file is loaded (see close_tdmsReaders), then opened again if needed.
+    Reads are serialised, as the background loader reads too.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.file = None
+        self.lock = threading.Lock()
+
+    def read(self, group, channel, start=None, stop=None):
+        with self.lock:
+            if self.file is None:
+                self.file = TdmsFile.open(self.filename)
+            return self.file[group][channel][start:stop]
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class tdmsDataProxy():
+    """ Stand-in for a channel in a .tdms file, same interface as
+    h5DataProxy. Samples are read in streaming mode through the file's
+    tdmsReader, so only the requested samples are loaded into memory.
+    """
+
+    def __init__(self, reader, group, channel, shape=None, dtype=None):
+        self.reader = reader
+        self.filename = reader.filename
+        self.group = group
+        self.channel = channel
+        self.shape = shape
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, start=None, stop=None):
+        """ Read the channel, or samples start:stop
+        """
+        return self.reader.read(self.group, self.channel, start, stop)
+
+
+class abfDataProxy():
+    """ Stand-in for one sweep of one channel in an .abf file, same
+    interface as h5DataProxy. Keeps a reference to the neo reader, which
+    memory maps the file, so reads only touch the requested samples.
+    """
+
+    def __init__(self, reader, sweep, stream, channel, shape=None, dtype=None):
+        self.reader = reader
+        self.filename = reader.filename
+        self.sweep = sweep
+        self.stream = stream
+        self.channel = channel
+        self.shape = shape
+        self.dtype = dtype
+
+    def __len__(self):
+        return self.shape[0]
+
+    def read(self, start=None, stop=None):
+        """ Read the sweep, or samples start:stop
+        """
+        start, stop, step = slice(start, stop).indices(self.shape[0])
+        return read_abfChunk(self.reader, self.sweep, self.stream, self.channel, start, max(start, stop))
+
+
+class h5LoadThread(QtCore.QThread):
+    """ Reads a file off the GUI thread, see start_loader.
+
+    If filename is given the structure of that .hdf5 file is walked first
+    and sent in batches of nodes [parentPath, name, path, attrs, index],
+    where index points to the dataset's proxy in .proxies (None for
+    groups). With readData=True the proxies are then read and the data
+    sent in batches of (index, data, checksum), the checksum being taken
+    here rather than on the GUI thread. cancel() stops at the next object.
+    """
+
+    nodesLoaded = QtCore.pyqtSignal(list)
+    treeLoaded = QtCore.pyqtSignal()
+    dataLoaded = QtCore.pyqtSignal(list)
+    progress = QtCore.pyqtSignal(float, float)   # bytes read, bytes to read
+
+    def __init__(self, filename=None, proxies=None, readData=False,
+                 batchSize=500, batchBytes=16*1024**2):
+        QtCore.QThread.__init__(self)
+        self.filename = filename
+        self.proxies = list(proxies or [])
+        self.readData = readData
+        self.batchSize = batchSize
+        self.batchBytes = batchBytes
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        if self.filename:
+            self.nodes = []
+            with h5py.File(self.filename, 'r') as f:
+                self.walk(f['/'])
+            if self.cancelled: return
+            self.nodesLoaded.emit(self.nodes)
+            self.treeLoaded.emit()
+        if not self.readData: return
+        total = float(sum(np.prod(p.shape)*np.dtype(p.dtype).itemsize for p in self.proxies))
+        done, batch, batchBytes, lastEmit = 0., [], 0, time.time()
+        self.progress.emit(done, total)
+        for index, proxy in enumerate(self.proxies):
+            if self.cancelled: return
+            data = proxy.read()
+            batch.append((index, data, data_checksum(data)))
+            batchBytes += data.nbytes
+            done += np.prod(proxy.shape)*np.dtype(proxy.dtype).itemsize
+            if (batchBytes>=self.batchBytes) or (time.time()-lastEmit>0.2):
+                self.dataLoaded.emit(batch)
+                self.progress.emit(done, total)
+                batch, batchBytes, lastEmit = [], 0, time.time()
+        self.dataLoaded.emit(batch)
+        self.progress.emit(total, total)
+
+    def walk(self, group):
+        for name, h5object in group.items():
+            if self.cancelled: return
+            attrs = dict((k, v) for k, v in h5object.attrs.items() if k not in SCALE_ATTRS)
+            index = None
+            if isinstance(h5object, h5py.Dataset):
+                if not h5object.shape:   # No data in the dataset (empty or scalar)
+                    continue
+                dtype = np.dtype('float64') if SCALE_ATTRS[0] in h5object.attrs else h5object.dtype
+                index = len(self.proxies)
+                self.proxies.append(h5DataProxy(self.filename, h5object.name, h5object.shape, dtype))
+            self.nodes.append([group.name, name, h5object.name, attrs, index])
+            if len(self.nodes)>=self.batchSize:
+                self.nodesLoaded.emit(self.nodes)
+                self.nodes = []
+            if index is None:
+                self.walk(h5object)
+
+
+def load_h5(browser, tree, push, lazy=None, background=False):
     """ Main loading function. Initially written for .hdf5 files only,
     but now also load .tdms files. 
     
     The whole thing could use with consolidating the code, there
     is redundancy and some of the functionality is not necessary.
+
+    With lazy=True, .hdf5 datasets, numeric .tdms channels and .abf
+    sweeps pushed to the Working Data tree are not read until their data
+    are used (see h5DataProxy, tdmsDataProxy and abfDataProxy). Defaults
+    to the state of the Lazy load toolbar action. .tdms files are always
+    opened in streaming mode.
+
+    With background=True (and push) the tree of .hdf5 files is built,
+    and non-lazy data are read, in a h5LoadThread (see start_loader).
     """
+    if lazy is None:
+        lazy = browser.ui.actionLazyLoad.isChecked()
+    readData = background and push and not lazy
+    if background: lazy = True   # Data not read lazily are read by the loader
+    if push: stop_loader(browser)
+    firstItem = len(browser.ui.workingDataTree.dataItems)
     browser.ui.fileDataTree.data = []
     index = browser.ui.dirTree.selectedIndexes()[0]
     currentFile = str(index.model().filePath(index))
     browser.currentFolder = os.path.dirname(currentFile)
     browser.ui.loadFolderInput.setText(browser.currentFolder)
+    close_tdmsReaders(browser, keep=currentFile)
 
     if '.hdf5' in currentFile:
         if browser.db: browser.db.close()
@@ -39,12 +255,18 @@ def load_h5(browser, tree, push):
         browser.dbType = 'hdf5'
         tree.clear()       
         # Insert groups into the tree and add data to internal data list
-        for group in browser.db:
-            item = h5Item([str(group)])
-            item.path = '/'+str(group)
-            set_attrs(browser.db[group], item)
-            tree.addTopLevelItem(item)
-            populate_h5tree(browser, browser.db['/'+str(group)], parentWidget=item, push=push) 
+        if push and background:
+            start_loader(browser, filename=currentFile, readData=readData)
+        else:
+            for group in browser.db:
+                item = h5Item([str(group)])
+                item.path = '/'+str(group)
+                set_attrs(browser.db[group], item)
+                tree.addTopLevelItem(item)
+                if push:
+                    populate_h5tree(browser, browser.db['/'+str(group)], parentWidget=item, push=push, lazy=lazy)
+                else:
+                    set_childrenPending(browser.db[group], item)
         # Select first item of loaded list
         tree.setCurrentItem(tree.itemAt(0,0))
         if push:
@@ -60,6 +282,7 @@ def load_h5(browser, tree, push):
                 #table.update_props(browser)
             browser.currentOpenFile = currentFile
             browser.currentSaveFile = currentFile
+            browser.ui.workingDataTree.savedFile = currentFile
             browser.ui.workingDataTree.setHeaderLabels([os.path.split(currentFile)[1]])
             browser.ui.workingDataTree.setSortingEnabled(False)  # Otherwise it screws up drag and drop
 
@@ -69,12 +292,18 @@ def load_h5(browser, tree, push):
         browser.dbType = 'hdf5'
         tree.clear()       
         # Insert groups into the tree and add data to internal data list
-        for group in browser.db:
-            item = h5Item([str(group)])
-            item.path = '/'+str(group)
-            set_attrs(browser.db[group], item)
-            tree.addTopLevelItem(item)
-            populate_h5tree(browser, browser.db['/'+str(group)], parentWidget=item, push=push) 
+        if push and background:
+            start_loader(browser, filename=currentFile, readData=readData)
+        else:
+            for group in browser.db:
+                item = h5Item([str(group)])
+                item.path = '/'+str(group)
+                set_attrs(browser.db[group], item)
+                tree.addTopLevelItem(item)
+                if push:
+                    populate_h5tree(browser, browser.db['/'+str(group)], parentWidget=item, push=push, lazy=lazy)
+                else:
+                    set_childrenPending(browser.db[group], item)
         # Select first item of loaded list
         tree.setCurrentItem(tree.itemAt(0,0))
         if push:
@@ -90,107 +319,105 @@ def load_h5(browser, tree, push):
                 #table.update_props(browser)
             browser.currentOpenFile = currentFile
             browser.currentSaveFile = currentFile
+            browser.ui.workingDataTree.savedFile = currentFile
             browser.ui.workingDataTree.setHeaderLabels([os.path.split(currentFile)[1]])
             browser.ui.workingDataTree.setSortingEnabled(False)  # Otherwise it screws up drag and drop
 
     elif '.abf' in currentFile:
+        # The header is parsed once; sweeps are read from the file (memory
+        # mapped by neo) when needed, see abfDataProxy
+        if browser.db and browser.dbType in ['hdf5', 'tdms']: browser.db.close()
         browser.db = io.AxonIO(filename=currentFile)
+        browser.dbFile = currentFile
         browser.dbType = 'abf'
         tree.clear()
-        # read data
-        browser.bl = browser.db.read_block(lazy=False, cascade=True) 
-        nSweeps = len(browser.bl.segments)
-        signal = browser.bl.segments[0].analogsignals
-        signalItem = signal.pop()
-        samplingRate = np.array(signalItem.sampling_rate) # Hz
-        if 'A' in str(signalItem.units):
-            groupname = 'current'
-        else:
-            groupname = 'voltage'
-        item = h5Item([groupname])
-        tree.addTopLevelItem(item)
-        browser.bl = browser.db.read_block(lazy=False, cascade=True) 
+        nSweeps = browser.db.segment_count(0)
         browser.saveFolder = browser.currentFolder      
         browser.ui.saveFolderInput.setText(browser.saveFolder)  
         browser.ui.workingDataTree.setSortingEnabled(True)
         browser.ui.notesWidget.clear()
         browser.currentOpenFile = currentFile
         browser.currentSaveFile = os.path.splitext(currentFile)[0]+'.hdf5'
+        browser.ui.workingDataTree.savedFile = None
         browser.ui.workingDataTree.setHeaderLabels([os.path.split(browser.currentSaveFile)[1]])
         browser.ui.workingDataTree.setSortingEnabled(False)  # Otherwise it screws up drag and drop
-        for sweep in np.arange(1,nSweeps):
-            datasetname = 'sweep_'+str(sweep)
-            child = h5Item([datasetname])
-            child.sweep = sweep
-            child.attrs['dt'] = 1./(samplingRate/1000.)
-            item.addChild(child)
-            if push:
-                child.data = get_dataFromFile(browser, child)
-                # Deal with strings (display in Notes and convert to ASCII)
-                text = []
-                if (isinstance(child.data[0], basestring))==True:
-                    browser.ui.notesWidget.append(str(channelname))
-                    for d in child.data:
-                        if bool(d): text.append(d)         # Get rid of empty strings
-                    child.data = np.string_(text)   # Convert to fixed length ASCII
-                    for t in text:
-                        browser.ui.notesWidget.append(t)
-                    browser.ui.notesWidget.append('\r')
-                child.listIndex = len(browser.ui.workingDataTree.dataItems)
-                browser.ui.workingDataTree.dataItems.append(child) 
+        # One group per analog channel
+        for groupname, stream, channel in get_abfChannels(browser.db):
+            samplingRate = browser.db.get_signal_sampling_rate(stream) # Hz
+            item = h5Item([groupname])
+            tree.addTopLevelItem(item)
+            for sweep in range(nSweeps):
+                datasetname = 'sweep_'+str(sweep)
+                child = h5Item([datasetname])
+                child.sweep = sweep
+                child.group = stream
+                child.channel = channel
+                child.attrs['dt'] = 1./(samplingRate/1000.)
+                item.addChild(child)
+                if push:
+                    if lazy:
+                        child.dataProxy = make_abfProxy(browser, child)
+                    else:
+                        child.data = get_dataFromFile(browser, child)
+                    child.listIndex = len(browser.ui.workingDataTree.dataItems)
+                    browser.ui.workingDataTree.dataItems.append(child) 
 
     elif '.tdms' in currentFile:
-        browser.db = TdmsFile(currentFile)
+        # Streaming mode: only the metadata are read here, channel data
+        # are read from file when needed (see tdmsDataProxy)
+        if browser.db and browser.dbType in ['hdf5', 'tdms']: browser.db.close()
+        browser.db = TdmsFile.open(currentFile)
+        browser.dbFile = currentFile
         browser.dbType = 'tdms'
         tree.clear()       
         # Deal with properties
-        for attr in browser.db.object().properties:
+        properties = browser.db.properties
+        for attr in properties:
             if 'kHz' in attr:
-                browser.ui.fileDataTree.root.attrs['sampling_rate(kHz)'] = browser.db.object().properties[attr]
+                browser.ui.fileDataTree.root.attrs['sampling_rate(kHz)'] = properties[attr]
                 if push:
-                    browser.ui.workingDataTree.root.attrs['sampling_rate(kHz)'] = browser.db.object().properties[attr]         
-            browser.ui.fileDataTree.root.attrs[attr] = browser.db.object().properties[attr]   
+                    browser.ui.workingDataTree.root.attrs['sampling_rate(kHz)'] = properties[attr]         
+            browser.ui.fileDataTree.root.attrs[attr] = properties[attr]   
             if push:
-                browser.ui.workingDataTree.root.attrs[attr] = browser.db.object().properties[attr]        
+                browser.ui.workingDataTree.root.attrs[attr] = properties[attr]        
         # Insert groups into the tree and add data to internal data list
         if push:
-            try:
-                browser.db.object().properties['imaging']
-                imaging = True
-            except KeyError:
-                imaging = False
+            imaging = 'imaging' in properties
             browser.saveFolder = browser.currentFolder      
             browser.ui.saveFolderInput.setText(browser.saveFolder)  
             browser.ui.workingDataTree.setSortingEnabled(True)
             browser.ui.notesWidget.clear()
             browser.currentOpenFile = currentFile
             browser.currentSaveFile = os.path.splitext(currentFile)[0]+'.hdf5'
+            browser.ui.workingDataTree.savedFile = None
             browser.ui.workingDataTree.setHeaderLabels([os.path.split(browser.currentSaveFile)[1]])
             browser.ui.workingDataTree.setSortingEnabled(False)  # Otherwise it screws up drag and drop
         for group in browser.db.groups():
-            item = h5Item([str(group)])
+            item = h5Item([group.name])
             tree.addTopLevelItem(item)
-            for channel in browser.db.group_channels(group):
-                channelname = re.findall(r"'(.*?)'", channel.path , re.DOTALL)[1]
-                child = h5Item([str(channelname)])
-                child.group = group
-                child.channel = channelname
+            for channel in group.channels():
+                child = h5Item([channel.name])
+                child.group = group.name
+                child.channel = channel.name
                 item.addChild(child)    
                 if 'kHz' in str(tree.root.attrs): 
                     child.attrs['dt'] = 1./tree.root.attrs['sampling_rate(kHz)']                   
                 if push:
-                    child.data = get_dataFromFile(browser, child)
+                    if lazy and (not imaging) and is_numericChannel(channel):
+                        child.dataProxy = make_tdmsProxy(browser, channel)
+                    else:
+                        child.data = get_dataFromFile(browser, child)
                     if imaging: 
-                        pixels = float(browser.db.object().properties['pixels_per_line'])
-                        lines = float(browser.db.object().properties['lines_per_frame'])
+                        pixels = float(properties['pixels_per_line'])
+                        lines = float(properties['lines_per_frame'])
                         imageArray = imagefun.array2image(child.data, (pixels,lines))
                         child.data = imageArray
                     # Deal with strings (display in Notes and convert to ASCII)
-                    text = []
-                    if (isinstance(child.data[0], basestring))==True:
-                        browser.ui.notesWidget.append(str(channelname))
+                    if not is_numericChannel(channel):
+                        text = []
+                        browser.ui.notesWidget.append(channel.name)
                         for d in child.data:
-                            if bool(d): text.append(d)         # Get rid of empty strings
+                            if bool(d): text.append(str(d))         # Get rid of empty strings
                         child.data = np.string_(text)   # Convert to fixed length ASCII
                         for t in text:
                             browser.ui.notesWidget.append(t)
@@ -209,34 +436,161 @@ def load_h5(browser, tree, push):
         item.attrs['mrl'] = os.path.split(currentFile)[1]
         item.attrs['video'] = 'True'
         tree.addTopLevelItem(item)        
-        # Read and show some properties
-        clip = VideoFileClip(currentFile)
-        resolution = h5Item(['Resolution: '+str(clip.size[0])+'x'+str(clip.size[1])])
+        # Read and show some properties (from the header, cached)
+        info = videofun.probe_video(currentFile)
+        resolution = h5Item(['Resolution: '+str(info['size'][0])+'x'+str(info['size'][1])])
         item.addChild(resolution)
-        frameRate = h5Item(['Frame rate: '+str(clip.fps)])
+        frameRate = h5Item(['Frame rate: '+str(info['fps'])])
         item.addChild(frameRate)
-        duration = h5Item(['Duration: '+str(clip.duration)+' sec'])
+        duration = h5Item(['Duration: '+str(info['duration'])+' sec'])
         item.addChild(duration)
 
-def populate_h5tree(browser, parent, parentWidget, push):   
+    # Read the data of the other file types in the background as well
+    if readData and (browser.dbType in ['tdms', 'abf']):
+        items = [i for i in browser.ui.workingDataTree.dataItems[firstItem:] if not i.isLoaded()]
+        start_loader(browser, items=items, readData=True)
+
+def start_loader(browser, filename=None, items=None, readData=False):
+    """ Load into the Working Data tree in a h5LoadThread, showing
+    progress in browser.loadProgress.
+
+    With 'filename' the tree of that .hdf5 file is built from the nodes
+    sent by the loader. 'items' are Working Data items whose proxies are
+    read when readData is True. Cancelling while the tree is built
+    clears it; cancelling while data are read leaves the rest lazy.
+    """
+    stop_loader(browser)
+    items = items or []
+    loader = h5LoadThread(filename, [item.dataProxy for item in items], readData)
+    loader.items = dict(enumerate(items))
+    loader.nodeItems = {'/': browser.ui.workingDataTree.invisibleRootItem()}
+    loader.treeComplete = filename is None
+    loader.nodesLoaded.connect(lambda nodes: add_loadedNodes(browser, loader, nodes))
+    loader.treeLoaded.connect(lambda: setattr(loader, 'treeComplete', True))
+    loader.dataLoaded.connect(lambda batch: set_loadedData(browser, loader, batch))
+    loader.progress.connect(browser.loadProgress.set_progress)
+    loader.finished.connect(lambda: finish_loader(browser, loader))
+    browser.loadProgress.start('Loading '+os.path.split(filename or browser.currentOpenFile)[1])
+    browser.loader = loader
+    loader.start()
+
+def stop_loader(browser):
+    """ Cancel the background loader, if any, and wait for it to stop.
+    Batches it already sent are ignored.
+    """
+    loader = getattr(browser, 'loader', None)
+    if loader is not None:
+        loader.cancel()
+        loader.wait()
+        browser.loader = None
+        browser.loadProgress.stop()
+
+def is_loadingTree(browser):
+    """ Check whether the Working Data tree is still being built by the
+    background loader
+    """
+    loader = getattr(browser, 'loader', None)
+    return (loader is not None) and not loader.treeComplete
+
+def add_loadedNodes(browser, loader, nodes):
+    """ Add a batch of nodes from h5LoadThread to the Working Data tree
+    """
+    if loader is not browser.loader: return
+    for parentPath, name, path, attrs, index in nodes:
+        parentWidget = loader.nodeItems.get(parentPath)
+        if (parentWidget is None) or sip.isdeleted(parentWidget):
+            continue
+        item = h5Item([str(name)])
+        item.path = path
+        item.attrs.update(attrs)
+        parentWidget.addChild(item)
+        if index is None:
+            loader.nodeItems[path] = item
+        else:
+            item.dataProxy = loader.proxies[index]
+            item.listIndex = len(browser.ui.workingDataTree.dataItems)
+            browser.ui.workingDataTree.dataItems.append(item)
+            set_saved(item, path)
+            loader.items[index] = item
+    browser.loadProgress.set_items(len(loader.items))
+
+def set_loadedData(browser, loader, batch):
+    """ Give items the data read by h5LoadThread
+    """
+    if loader is not browser.loader: return
+    for index, data, checksum in batch:
+        item = loader.items.get(index)
+        if (item is not None) and not sip.isdeleted(item):
+            item.setLoadedData(loader.proxies[index], data, checksum)
+
+def finish_loader(browser, loader):
+    if loader is not browser.loader: return
+    if not loader.treeComplete:   # Cancelled, don't leave half a file in the tree
+        tree = browser.ui.workingDataTree
+        tree.clear()
+        tree.savedFile = None
+        browser.currentSaveFile = []
+        tree.setHeaderLabels(['Working Data'])
+        browser.ui.statusbar.showMessage('Loading cancelled', 5000)
+    browser.loadProgress.stop()
+    browser.loader = None
+
+def populate_h5tree(browser, parent, parentWidget, push, lazy=False):   
     if isinstance(parent, h5py.Group):
         for child in parent:
             #print(parent[child])
             item = h5Item([child])
-            item.path = re.findall('"([^"]*)"', str(parent))[0] + '/' + str(child)
+            item.path = parent.name.rstrip('/') + '/' + str(child)
             set_attrs(parent[child], item)
             parentWidget.addChild(item)
-            populate_h5tree(browser, parent[child], item, push)
+            populate_h5tree(browser, parent[child], item, push, lazy)
     elif isinstance(parent, h5py.Dataset):
         set_attrs(parent, parentWidget)
-        if push:
+        if push and lazy:
+            if not parent.shape:   # No data in the dataset (empty or scalar)
+                sip.delete(parentWidget)
+                return
+            parentWidget.dataProxy = make_dataProxy(browser, parentWidget.path)
+            parentWidget.listIndex = len(browser.ui.workingDataTree.dataItems)
+            browser.ui.workingDataTree.dataItems.append(parentWidget)
+            set_saved(parentWidget, parentWidget.path)
+        elif push:
             try:         
                 parentWidget.data = get_dataFromFile(browser, parentWidget)
                 parentWidget.listIndex = len(browser.ui.workingDataTree.dataItems)          
                 browser.ui.workingDataTree.dataItems.append(parentWidget)
+                set_saved(parentWidget, parentWidget.path)
             except ValueError:   # No data in the dataset
                 sip.delete(parentWidget)
 
+def set_childrenPending(h5object, item):
+    """ Mark a File Data tree item for a group as expandable, without
+    reading its children (see populate_h5branch)
+    """
+    if isinstance(h5object, h5py.Group):
+        item.childrenPending = True
+        item.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.ShowIndicator)
+
+def populate_h5branch(browser, item):
+    """ Add the children of a File Data tree group item, with their
+    attributes, when the branch is expanded (or dragged). Only one level
+    is read; child groups are populated in turn when they are expanded.
+    """
+    if not getattr(item, 'childrenPending', False) or (browser.dbType!='hdf5'):
+        return
+    item.childrenPending = False
+    group = browser.db[item.path]
+    children = []
+    for name in group:
+        child = h5Item([str(name)])
+        child.path = item.path + '/' + str(name)
+        h5object = group[name]
+        set_attrs(h5object, child)
+        set_childrenPending(h5object, child)
+        children.append(child)
+    item.addChildren(children)
+    item.setChildIndicatorPolicy(QtWidgets.QTreeWidgetItem.DontShowIndicatorWhenChildless)
+
 def populate_h5File(browser, parent, parentWidget):     
     set_attrs(parentWidget, parent)
     for i in range(parentWidget.childCount()):
@@ -248,36 +602,44 @@ def populate_h5File(browser, parent, parentWidget):
             populate_h5File(browser, parent[str(item.text(0))], parentWidget=item)
         elif (item.data is not None): # and (isinstance(item.data[0], basestring)==False):
             #print(str(item.text(0)))
-            dset = parent.create_dataset(str(item.text(0)), data=item.data)
+            dset = create_h5Dataset(browser, parent, str(item.text(0)), item.data)
             set_attrs(item, dset)
         else:
             group = parent.create_group(str(item.text(0)))
             set_attrs(item, group)
 
-def populate_h5dragItems(browser, originalParentWidget, parentWidget):
+def populate_h5dragItems(browser, originalParentWidget, parentWidget, lazy=None):
+    if lazy is None:
+        lazy = browser.ui.actionLazyLoad.isChecked()
+    populate_h5branch(browser, originalParentWidget)
     if originalParentWidget.childCount()>0:
         for c in range(originalParentWidget.childCount()):
             child = originalParentWidget.child(c)
+            populate_h5branch(browser, child)
             #itemName = make_nameUnique(parentWidget, child.text(0))
             i = h5Item([str(child.text(0))])
             i.path = child.path
             i.group = child.group
             i.channel = child.channel
+            i.sweep = child.sweep
             parentWidget.addChild(i)
             if child.childCount()>0:
-                populate_h5dragItems(browser, child, i)
+                populate_h5dragItems(browser, child, i, lazy)
             else:
                 set_attrs(child, i)
                 i.listIndex = len(browser.ui.workingDataTree.dataItems)
-                i.data = get_dataFromFile(browser, i)
+                set_fileData(browser, i, lazy)
                 browser.ui.workingDataTree.dataItems.append(i)
     # For transferring datasets directly
     else:
         set_attrs(originalParentWidget, parentWidget)
         parentWidget.path = originalParentWidget.path
+        parentWidget.group = originalParentWidget.group
+        parentWidget.channel = originalParentWidget.channel
+        parentWidget.sweep = originalParentWidget.sweep
         parentWidget.listIndex = len(browser.ui.workingDataTree.dataItems)
         #browser.ui.workingDataTree.data.append(browser.db[originalParentWidget.path][:])
-        parentWidget.data = browser.db[originalParentWidget.path][:]
+        set_fileData(browser, parentWidget, lazy)
         browser.ui.workingDataTree.dataItems.append(parentWidget)
 
 def populate_h5copyItems(browser, originalParentWidget, parentWidget):
@@ -293,7 +655,7 @@ def populate_h5copyItems(browser, originalParentWidget, parentWidget):
                 set_attrs(child, i)
                 i.listIndex = len(browser.ui.workingDataTree.dataItems)
                 #browser.ui.workingDataTree.data.append(browser.db[child.path][:])
-                i.data = child.data
+                copy_data(child, i)
                 browser.ui.workingDataTree.dataItems.append(i)
     # For transferring datasets directly
     else:
@@ -301,9 +663,126 @@ def populate_h5copyItems(browser, originalParentWidget, parentWidget):
         parentWidget.path = originalParentWidget.path
         parentWidget.listIndex = len(browser.ui.workingDataTree.dataItems)
         #browser.ui.workingDataTree.data.append(browser.db[originalParentWidget.path][:])
-        parentWidget.data = originalParentWidget.data
+        copy_data(originalParentWidget, parentWidget)
         browser.ui.workingDataTree.dataItems.append(parentWidget)
 
+def set_fileData(browser, item, lazy):
+    """ Give a dragged item the data from the currently open file, as a
+    proxy if lazy and the file type supports it
+    """
+    if lazy and (browser.dbType=='hdf5'):
+        item.dataProxy = make_dataProxy(browser, item.path)
+    elif lazy and (browser.dbType=='tdms') and is_numericChannel(browser.db[item.group][item.channel]):
+        item.dataProxy = make_tdmsProxy(browser, browser.db[item.group][item.channel])
+    elif lazy and (browser.dbType=='abf'):
+        item.dataProxy = make_abfProxy(browser, item)
+    else:
+        item.data = get_dataFromFile(browser, item)
+
+def make_dataProxy(browser, path):
+    """ Make a h5DataProxy for dataset 'path' in the currently open .hdf5 file
+    """
+    dset = browser.db[path]
+    dtype = np.dtype('float64') if SCALE_ATTRS[0] in dset.attrs else dset.dtype
+    return h5DataProxy(browser.db.filename, path, dset.shape, dtype)
+
+def make_tdmsProxy(browser, channel):
+    """ Make a tdmsDataProxy for a channel of the currently open .tdms file
+    """
+    return tdmsDataProxy(get_tdmsReader(browser, browser.dbFile), channel.group_name,
+                         channel.name, (len(channel),), channel.dtype)
+
+def get_tdmsReader(browser, filename):
+    """ Get the tdmsReader shared by the proxies of a .tdms file
+    """
+    filename = os.path.abspath(filename)
+    if filename not in browser.tdmsReaders:
+        browser.tdmsReaders[filename] = tdmsReader(filename)
+    return browser.tdmsReaders[filename]
+
+def close_tdmsReaders(browser, keep=None):
+    """ Close the .tdms files held open for proxies, apart from 'keep'.
+    Proxies still in the trees open their file again when read.
+    """
+    keep = keep and os.path.abspath(keep)
+    for filename, reader in browser.tdmsReaders.items():
+        if filename!=keep:
+            reader.close()
+
+def is_numericChannel(channel):
+    """ Check whether a .tdms channel holds numbers (not strings or timestamps)
+    """
+    return np.dtype(channel.dtype).kind in 'biuf'
+
+def make_abfProxy(browser, item):
+    """ Make an abfDataProxy for a sweep of the currently open .abf file
+    """
+    n = browser.db.get_signal_size(0, item.sweep, item.group)
+    return abfDataProxy(browser.db, item.sweep, item.group, item.channel, (n,), np.dtype('float64'))
+
+def get_abfChannels(reader):
+    """ List the analog channels of an .abf file as (name, stream, channel)
+    tuples, where channel is the index within the stream. Channels are
+    named 'current' or 'voltage' from their units, with the channel name
+    appended when there is more than one of a kind.
+    """
+    channels = []
+    for stream in range(reader.signal_streams_count()):
+        streamId = reader.header['signal_streams'][stream]['id']
+        streamChannels = reader.header['signal_channels']
+        streamChannels = streamChannels[streamChannels['stream_id']==streamId]
+        for c, ch in enumerate(streamChannels):
+            kind = 'current' if 'A' in str(ch['units']) else 'voltage'
+            channels.append([kind, stream, c, ch['name'] or str(c)])
+    kinds = [c[0] for c in channels]
+    names = []
+    for kind, stream, c, chName in channels:
+        name = kind if kinds.count(kind)==1 else kind+'_'+chName
+        names.append((name, stream, c))
+    return names
+
+def read_abfChunk(reader, sweep, stream, channel, start=None, stop=None):
+    """ Read samples start:stop of a sweep and scale them to float
+    """
+    raw = reader.get_analogsignal_chunk(block_index=0, seg_index=sweep, i_start=start, i_stop=stop,
+                                        stream_index=stream, channel_indexes=[channel])
+    data = reader.rescale_signal_raw_to_float(raw, dtype='float64', stream_index=stream,
+                                              channel_indexes=[channel])
+    return data[:,0]
+
+def read_abfProtocol(reader, stream=0, channel=0, sweeps=None, start=None, stop=None):
+    """ Read sweeps of one .abf channel into a single sweep x sample
+    array. Sweeps default to all sweeps, and are cut to the shortest one.
+    """
+    if sweeps is None:
+        sweeps = range(reader.segment_count(0))
+    n = min(reader.get_signal_size(0, s, stream) for s in sweeps)
+    start, stop, step = slice(start, stop).indices(n)
+    stop = max(start, stop)
+    data = np.empty((len(sweeps), stop-start))
+    for row, sweep in enumerate(sweeps):
+        data[row] = read_abfChunk(reader, sweep, stream, channel, start, stop)
+    return data
+
+def copy_data(source, item):
+    """ Copy the data of tree item 'source' to 'item' without
+    reading it from file if it has not been loaded yet.
+    """
+    if source.isLoaded():
+        item.data = source.data
+    else:
+        item.dataProxy = source.dataProxy
+
+def load_proxyData(tree, filename):
+    """ Read into memory the data of all items in tree that are still
+    waiting to be read from 'filename'. Needed before overwriting it.
+    """
+    filename = os.path.abspath(filename)
+    for item, path in iterate_tree(tree.invisibleRootItem()):
+        proxy = item.dataProxy
+        if (proxy is not None) and (os.path.abspath(proxy.filename)==filename):
+            item.data   # triggers the read
+    
 def create_h5(browser, tree):
     fname, ok = QtWidgets.QInputDialog.getText(browser, 'New file', 'Enter file name:')
     if ok: 
@@ -314,39 +793,246 @@ def create_h5(browser, tree):
         browser.ui.workingDataTree.propsDescription = ''   
         #table.update_table(browser)
         browser.ui.workingDataTree.setHeaderLabels([fname])
+        browser.ui.workingDataTree.savedFile = None
         browser.currentSaveFile = browser.currentFolder + '/' + fname + '.hdf5'           
 
 
-def save_h5(browser, tree):
+def save_h5(browser, tree, full=False):
+  """ Save the Working Data tree to browser.currentSaveFile.
+
+  If the tree was loaded from or last saved to that same file only the
+  changes are written (see update_h5File). Set full=True to rewrite
+  (repack) the whole file.
+  """
+  if is_loadingTree(browser):
+    browser.ui.statusbar.showMessage('The file is still loading, wait or cancel before saving', 5000)
+    return
+  stop_loader(browser)   # Data not read yet stay lazy
   try:
     currentSaveFile = str(browser.currentSaveFile)
     browser.ui.workingDataTree.setHeaderLabels([os.path.split(currentSaveFile)[1]])
     if browser.db:
-      if browser.dbType=='hdf5':
+      if browser.dbType in ['hdf5', 'tdms']:
         browser.db.close()
       browser.db = None
     if browser.wdb: browser.wdb.close()
-    browser.wdb = h5py.File(currentSaveFile, 'w')
     root = tree.invisibleRootItem()
-    populate_h5File(browser, browser.wdb['/'], root) 
-    # File attributes
-    set_attrs(browser.ui.workingDataTree.root, browser.wdb)   
+    savedFile = getattr(tree, 'savedFile', None)
+    incremental = (not full) and bool(savedFile) and os.path.isfile(currentSaveFile) and \
+                  (os.path.abspath(savedFile)==os.path.abspath(currentSaveFile))
+    if incremental:
+      browser.wdb = h5py.File(currentSaveFile, 'r+')
+      update_h5File(browser, browser.wdb, root)
+      update_attrs(browser.ui.workingDataTree.root, browser.wdb)
+    else:
+      load_proxyData(tree, currentSaveFile)
+      browser.wdb = h5py.File(currentSaveFile, 'w')
+      populate_h5File(browser, browser.wdb['/'], root) 
+      # File attributes
+      set_attrs(browser.ui.workingDataTree.root, browser.wdb)   
     browser.wdb.attrs['Notes'] =  str(browser.ui.notesWidget.toPlainText())   
     browser.wdb.close()
-    print('File saved')
+    # The tree now mirrors the file
+    for item, path in iterate_tree(root):
+      set_saved(item, path)
+    tree.savedFile = currentSaveFile
+    if incremental:
+      print('File saved (changes only)')
+    else:
+      print('File saved')
   except:
     print('Unexpected error, the data might have not been saved')
     raise
 
+def iterate_tree(parentWidget, parentPath=''):
+    """ Yield (item, path) for all items below parentWidget, parents first
+    """
+    for i in range(parentWidget.childCount()):
+        item = parentWidget.child(i)
+        path = parentPath + '/' + str(item.text(0))
+        yield item, path
+        for child in iterate_tree(item, path):
+            yield child
+
+def is_dataset(item):
+    """ Check whether a tree item is saved as a dataset, without reading
+    lazily loaded data. Mirrors the logic in populate_h5File.
+    """
+    return (item.childCount()==0) and ((not item.isLoaded()) or (item.data is not None))
+
+def set_saved(item, path):
+    """ Mark item as matching the object at 'path' in the saved file.
+    Loaded data are checksummed, data still in a file are checksummed
+    when read (see h5Item.isChanged).
+    """
+    item.savedPath = path
+    item.dirty = False
+    item.savedChecksum = data_checksum(item.data) if item.isLoaded() else None
+
+def update_h5File(browser, f, root):
+    """ Write only the differences between the tree and the open file f.
+
+    Datasets whose data have not been assigned or changed in place (see
+    h5Item.isChanged) since the last load/save are kept in the file,
+    and moved if they have been renamed. New and modified datasets are
+    (re)written, objects no longer in the tree are deleted and attributes
+    are synced. Deleting does not shrink the file, use a full save
+    (Repack) for that.
+    """
+    filename = os.path.abspath(f.filename)
+    items = list(iterate_tree(root))
+    keep, moves, writes = set(['/']), [], []
+    for item, path in items:
+        if not is_dataset(item):
+            continue
+        unchanged = (not item.isChanged()) and (item.savedPath is not None) and \
+                    (item.savedPath in f) and isinstance(f[item.savedPath], h5py.Dataset)
+        if unchanged and (item.savedPath==path):
+            keep.add(path)
+        elif unchanged:
+            moves.append([item, item.savedPath, path])
+        else:
+            writes.append([item, path])
+        # Data still waiting in this file could be moved or deleted below
+        proxy = item.dataProxy
+        if (proxy is not None) and (os.path.abspath(proxy.filename)==filename) and \
+           not (unchanged and (proxy.path==item.savedPath)):
+            item.data
+            item.dirty = not unchanged
+    # Keep groups that are still in the tree, and the parents of kept datasets
+    for item, path in items:
+        if (not is_dataset(item)) and (path in f) and isinstance(f[path], h5py.Group):
+            keep.add(path)
+    for path in list(keep):
+        while path.rfind('/')>0:
+            path = path[:path.rfind('/')]
+            keep.add(path)
+    # Move renamed datasets out of the way first, in case names were swapped
+    tmp = '/.ndaq_moving'
+    if moves: f.require_group(tmp)
+    for n, (item, oldPath, path) in enumerate(moves):
+        f.move(oldPath, tmp+'/'+str(n))
+        keep.add(tmp+'/'+str(n))
+    keep.add(tmp)
+    # Delete whatever is no longer in the tree
+    delete_h5Objects(f['/'], keep)
+    # Write new and modified datasets
+    for item, path in writes:
+        parent = f.require_group(os.path.dirname(path))
+        create_h5Dataset(browser, parent, os.path.basename(path), item.data)
+    for n, (item, oldPath, path) in enumerate(moves):
+        f.require_group(os.path.dirname(path))
+        f.move(tmp+'/'+str(n), path)
+        if (item.dataProxy is not None) and (item.dataProxy.path==oldPath):
+            item.dataProxy.path = path
+    if tmp in f: del f[tmp]
+    # Groups and attributes
+    for item, path in items:
+        if not is_dataset(item):
+            f.require_group(path)
+        update_attrs(item, f[path])
+
+def delete_h5Objects(group, keep):
+    """ Delete all objects in group whose path is not in keep
+    """
+    for name in list(group.keys()):
+        path = group[name].name
+        if path not in keep:
+            del group[name]
+        elif isinstance(group[name], h5py.Group):
+            delete_h5Objects(group[name], keep)
+
+def update_attrs(source, item):
+    """ Like set_attrs, but only writes attributes that differ and
+    removes those that are no longer in source.
+    """
+    for attr in list(item.attrs):
+        if (attr not in source.attrs) and (attr not in SCALE_ATTRS):
+            del item.attrs[attr]
+    for attr in source.attrs:
+        value = source.attrs[attr]
+        if type(value) is str:
+            value = str(value)
+        if attr in item.attrs:
+            try:
+                if np.array_equal(item.attrs[attr], value): continue
+            except Exception:
+                pass
+        item.attrs[attr] = value
+
+def get_saveOptions(browser):
+    options = dict(SAVE_OPTIONS)
+    options.update(getattr(browser, 'saveOptions', {}))
+    return options
+
+def chunk_shape(shape, itemsize, chunkBytes):
+    """ Chunks for time series: runs of consecutive samples along the
+    last axis, one row (sweep) at a time for 2D data, so that reading a
+    time window only touches the chunks that overlap it.
+    """
+    n = int(max(1, min(shape[-1], chunkBytes//itemsize)))
+    return (1,)*(len(shape)-1) + (n,)
+
+def create_h5Dataset(browser, parent, name, data):
+    """ Create dataset 'name' in parent using the current save options.
+    Non-numeric and very small datasets are written as they are.
+    """
+    options = get_saveOptions(browser)
+    try:
+        array = np.asarray(data)
+    except ValueError:   # ragged lists
+        array = None
+    if (array is None) or (array.dtype.kind not in 'biufc') or (array.ndim==0) or \
+       (array.size==0) or (array.nbytes<4096):
+        return parent.create_dataset(name, data=data)
+    attrs = {}
+    if options['int16'] and (array.dtype.kind=='f') and np.all(np.isfinite(array)):
+        array, attrs[SCALE_ATTRS[0]], attrs[SCALE_ATTRS[1]] = to_int16(array)
+    kwargs = {}
+    if array.ndim<3:
+        kwargs['chunks'] = chunk_shape(array.shape, array.dtype.itemsize, options['chunkBytes'])
+    else:
+        kwargs['chunks'] = True
+    if options['compression']:
+        kwargs['compression'] = options['compression']
+        if options['compression']=='gzip':
+            kwargs['compression_opts'] = options['compression_opts']
+    if options['shuffle']:
+        kwargs['shuffle'] = True
+    dset = parent.create_dataset(name, data=array, **kwargs)
+    for attr in attrs:
+        dset.attrs[attr] = attrs[attr]
+    return dset
+
+def to_int16(data):
+    """ Map the range of data onto int16. Returns the int16 array, and the
+    scale and offset that restore it as data = int16*scale + offset.
+    """
+    dmin, dmax = float(np.min(data)), float(np.max(data))
+    offset = (dmax+dmin)/2.
+    scale = (dmax-dmin)/65534. or 1.
+    return np.round((data-offset)/scale).astype(np.int16), scale, offset
+
+def read_h5Dataset(dset, start=None, stop=None):
+    """ Read a dataset (or samples start:stop along the first axis),
+    undoing the int16 storage if needed.
+    """
+    data = dset[start:stop]
+    if SCALE_ATTRS[0] in dset.attrs:
+        data = data*dset.attrs[SCALE_ATTRS[0]] + dset.attrs[SCALE_ATTRS[1]]
+    return data
+
 def set_attrs(source, item):
     """ Set attributes of h5 item or h5 group and dataset
     Source and item can be tree h5item or h5File group/dataset, the syntax is the same.
     """
-    for attr in source.attrs:
-        if type(source.attrs[attr]) is str:
-            item.attrs[attr] = str(source.attrs[attr])
+    for attr, value in source.attrs.items():   # one read per attribute
+        if attr in SCALE_ATTRS:
+            continue
+        if type(value) is str:
+            item.attrs[attr] = str(value)
         else:
-            item.attrs[attr] = source.attrs[attr] 
+            item.attrs[attr] = value
 
 
 def make_nameUnique(browser, parentWidget, name):
@@ -373,18 +1059,85 @@ def make_nameUnique(browser, parentWidget, name):
     print('name is', name)
     return name
     
+def get_previewFromFile(browser, item, points=PREVIEW_POINTS):
+    """ Get a min/max decimated version of a File Data tree item for
+    plotting, without reading the whole trace (see read_preview).
+    Returns x (in samples), y and the fraction of the samples read, or
+    None if there is nothing to plot.
+    """
+    if browser.dbType=='hdf5':
+        dset = browser.db[item.path]
+        if not isinstance(dset, h5py.Dataset) or not dset.shape:
+            return None
+        if len(dset.shape)>1:   # Images can't be shown as a trace
+            return None
+        chunk = dset.chunks[0] if dset.chunks else 1
+        x, y, fraction = read_preview(lambda start, stop: dset[start:stop], dset.shape[0], points, chunk)
+        if SCALE_ATTRS[0] in dset.attrs:   # Scale the preview only, not every read
+            y = y*dset.attrs[SCALE_ATTRS[0]] + dset.attrs[SCALE_ATTRS[1]]
+        return x, y, fraction
+    elif browser.dbType=='tdms':
+        if not item.channel:
+            return None
+        channel = browser.db[item.group][item.channel]
+        if not is_numericChannel(channel):
+            return None
+        return read_preview(lambda start, stop: channel[start:stop], len(channel), points)
+    elif browser.dbType=='abf':
+        proxy = make_abfProxy(browser, item)
+        return read_preview(proxy.read, len(proxy), points)
+    return None
+
+def read_preview(read, n, points=PREVIEW_POINTS, chunk=1, maxRead=PREVIEW_MAX_READ):
+    """ Min/max decimate a trace of n samples to about 'points' points,
+    getting samples with read(start, stop). Returns x, y and the
+    fraction of the samples that were read.
+
+    Traces up to maxRead samples are read in blocks and every sample is
+    used. Longer traces are sampled: about maxRead samples are read, as
+    one window per bin of whole chunks (chunk is the dataset's chunk
+    length), since reading part of a compressed chunk decompresses all
+    of it anyway. Bins are made longer if needed to fit a chunk each, so
+    there are fewer points. Events between the windows are not shown.
+    """
+    if n<=points:
+        return np.arange(n), read(0, n), 1.
+    nBins = points//2
+    if n>maxRead:
+        window = max(chunk, (maxRead//nBins)//chunk*chunk)
+        nBins = max(1, min(nBins, maxRead//window))
+    edges = np.linspace(0, n, nBins+1).astype(int)
+    ymin, ymax = np.empty(nBins), np.empty(nBins)
+    nRead = n
+    if n<=maxRead:
+        binsPerBlock = max(1, int(nBins*min(1., 1024**2/float(n))))   # ~1M samples per read
+        for b in range(0, nBins, binsPerBlock):
+            e = min(b+binsPerBlock, nBins)
+            data = read(edges[b], edges[e])
+            ymin[b:e] = np.minimum.reduceat(data, edges[b:e]-edges[b])
+            ymax[b:e] = np.maximum.reduceat(data, edges[b:e]-edges[b])
+    else:
+        nRead = 0
+        for b in range(nBins):
+            start = -(-edges[b]//chunk)*chunk   # First chunk boundary in the bin
+            data = read(start, min(start+window, edges[b+1]))
+            ymin[b], ymax[b] = data.min(), data.max()
+            nRead += len(data)
+    x = np.repeat(edges[:-1], 2)
+    y = np.column_stack([ymin, ymax]).ravel()
+    return x, y, nRead/float(n)
+
 def get_dataFromFile(browser, item):
     data = None
     if browser.dbType=='hdf5':
         if 'dataset' in str(browser.db[item.path]):
-            data = browser.db[item.path][:]
+            data = read_h5Dataset(browser.db[item.path])
             #data = browser.db[item.path].value
     elif browser.dbType=='tdms':
         if item.channel:
-            data = browser.db.object(item.group, item.channel).data
+            data = browser.db[item.group][item.channel][:]
     elif browser.dbType=='abf':
-        data = np.array(browser.bl.segments[item.sweep].analogsignals)
-        data = data.ravel()
+        data = make_abfProxy(browser, item).read()
     return data
 
 
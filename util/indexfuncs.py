@@ -0,0 +1,169 @@
+""" Functions for a searchable catalogue of data files
+
+index_folder scans a folder tree and stores the metadata of the data
+files in it (datasets with their shape, dtype and dt, sampling rate,
+Notes and description, video duration) in a SQLite catalogue. Files are
+read in a pool of spawned processes (see fileMetadata), and only files
+that are new or changed since the last scan (mtime and size) are read
+again.
+
+search_catalogue answers queries from the catalogue without opening any
+data file. The query is a list of words, all of which have to appear in
+the file name, folder, notes, description or dataset paths, plus
+optional filters:
+    type:abf         file type (hdf5, tdms, abf or video)
+    rate:10          sampling rate in kHz
+    dt:0.05          sampling interval in ms (same as rate:20)
+e.g. 'loom rate:10 type:hdf5'
+"""
+
+import os, sqlite3, time, multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from PyQt5 import QtCore
+from fileMetadata import FILE_TYPES, read_fileMetadata
+
+CATALOGUE = os.path.join(os.path.expanduser('~'), '.neurodaq', 'catalogue.sqlite')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, folder TEXT, name TEXT,
+    type TEXT, mtime REAL, size INTEGER, notes TEXT, description TEXT,
+    sampling_rate REAL, duration REAL, error TEXT);
+CREATE TABLE IF NOT EXISTS datasets (file TEXT, path TEXT, shape TEXT,
+    dtype TEXT, dt REAL);
+CREATE INDEX IF NOT EXISTS datasets_file ON datasets (file);
+CREATE INDEX IF NOT EXISTS files_folder ON files (folder);
+"""
+
+
+class indexThread(QtCore.QThread):
+    """ Runs index_folder off the GUI thread
+    """
+
+    progress = QtCore.pyqtSignal(int, int)   # files read, files to read
+
+    def __init__(self, folder, catalogue=None):
+        QtCore.QThread.__init__(self)
+        self.folder = folder
+        self.catalogue = catalogue
+        self.cancelled = False
+        self.nFiles = 0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def run(self):
+        self.nFiles = index_folder(self.folder, self.catalogue, progress=self.progress.emit,
+                                   cancelled=lambda: self.cancelled)
+
+
+def connect_catalogue(catalogue=None):
+    catalogue = catalogue or CATALOGUE
+    folder = os.path.dirname(catalogue)
+    if folder and not os.path.isdir(folder):
+        os.makedirs(folder)
+    db = sqlite3.connect(catalogue)
+    db.executescript(SCHEMA)
+    return db
+
+def index_folder(folder, catalogue=None, processes=None, progress=None, cancelled=None):
+    """ Add the data files in 'folder' and its subfolders to the
+    catalogue, reading only new or changed files, and remove files that
+    no longer exist. Returns the number of files read.
+
+    'progress' is called with (files read, files to read) and
+    'cancelled' is checked between files.
+    """
+    folder = os.path.abspath(folder)
+    db = connect_catalogue(catalogue)
+    known = dict((row[0], (row[1], row[2])) for row in
+                 db.execute('SELECT path, mtime, size FROM files WHERE folder=? OR folder LIKE ?',
+                            (folder, os.path.join(folder, '%'))))
+    found, changed = set(), []
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in dirs if not d.startswith('.')]
+        for name in files:
+            if os.path.splitext(name)[1].lower() not in FILE_TYPES:
+                continue
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            found.add(path)
+            if known.get(path)!=(stat.st_mtime, stat.st_size):
+                changed.append(path)
+    # Forget files that are gone
+    removed = [(path,) for path in known if path not in found]
+    db.executemany('DELETE FROM files WHERE path=?', removed)
+    db.executemany('DELETE FROM datasets WHERE file=?', removed)
+    db.commit()
+    # Read the others in parallel, writing from this process only
+    done = 0
+    if progress: progress(done, len(changed))
+    if changed:
+        # Forking the multithreaded GUI process can deadlock, so workers are spawned
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            futures = [pool.submit(read_fileMetadata, path) for path in changed]
+            lastCommit = time.time()
+            for future in as_completed(futures):
+                if cancelled and cancelled():
+                    for f in futures: f.cancel()
+                    break
+                store_fileMetadata(db, future.result())
+                done += 1
+                if time.time()-lastCommit>0.5:
+                    db.commit()
+                    lastCommit = time.time()
+                    if progress: progress(done, len(changed))
+    db.commit()
+    db.close()
+    if progress: progress(done, len(changed))
+    return done
+
+def store_fileMetadata(db, meta):
+    db.execute('DELETE FROM datasets WHERE file=?', (meta['path'],))
+    db.execute('INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?,?,?,?,?,?)',
+               (meta['path'], meta['folder'], meta['name'], meta['type'], meta['mtime'],
+                meta['size'], meta['notes'], meta['description'], meta['sampling_rate'],
+                meta['duration'], meta['error']))
+    db.executemany('INSERT INTO datasets VALUES (?,?,?,?,?)',
+                   [[meta['path']]+d for d in meta['datasets']])
+
+def search_catalogue(query, folder=None, catalogue=None):
+    """ Return the paths of the catalogued files matching 'query' (see
+    the module description), optionally only those in 'folder'. Raises
+    ValueError for incomplete filters, e.g. 'rate:' or 'dt:0'.
+    """
+    where, args = [], []
+    if folder:
+        folder = os.path.abspath(folder)
+        where.append('(folder=? OR folder LIKE ?)')
+        args += [folder, os.path.join(folder, '%')]
+    for word in query.split():
+        key, sep, value = word.partition(':')
+        if sep and key=='type':
+            where.append('type=?')
+            args.append(value)
+        elif sep and key in ['rate', 'dt']:
+            number = float(value)
+            if not (0<number<np.inf):   # e.g. 'dt:0' on the way to 'dt:0.05'
+                raise ValueError('Invalid '+key+' value '+value)
+            rate = number if key=='rate' else 1./number
+            where.append('(abs(sampling_rate-?)<1e-6*? OR path IN '
+                         '(SELECT file FROM datasets WHERE abs(1./dt-?)<1e-6*?))')
+            args += [rate, rate, rate, rate]
+        else:
+            pattern = '%'+word+'%'
+            where.append('(name LIKE ? OR folder LIKE ? OR notes LIKE ? OR description LIKE ? OR '
+                         'path IN (SELECT file FROM datasets WHERE path LIKE ?))')
+            args += [pattern]*5
+    if not os.path.isfile(catalogue or CATALOGUE):
+        return []
+    db = connect_catalogue(catalogue)
+    sql = 'SELECT path FROM files'
+    if where: sql += ' WHERE '+' AND '.join(where)
+    paths = [row[0] for row in db.execute(sql+' ORDER BY path', args)]
+    db.close()
+    return paths
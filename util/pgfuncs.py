@@ -4,12 +4,29 @@
 import numpy as np
 from PyQt5 import QtGui, QtCore, QtWidgets
 import pyqtgraph as pg
+from . import pyramidfuncs as pyramidfun
+from . import rangefuncs as rangefun
 
-def plot_singleData(browser, plotWidget, data):
-    """ Plot a single trace.
+# Plots of more items than this show them as one overlay item
+OVERLAY_ITEMS = 100
+
+# Time bases shared by traces with the same sampling, by (length, dt, t0),
+# least recently used first. At most TIME_BASE_BYTES are kept, longer
+# time bases are not cached.
+TIME_BASE_BYTES = 256*1024**2
+timeBases = {}
+
+# Traces listed in the cursor readout
+STATS_ITEMS = 4
+
+def plot_singleData(browser, plotWidget, data, x=None):
+    """ Plot a single trace, optionally against x.
     """
     plotWidget.clear()
-    plotWidget.plot(data, pen=pg.mkPen('#3790CC'))
+    if x is None:
+        plotWidget.plot(data, pen=pg.mkPen('#3790CC'))
+    else:
+        plotWidget.plot(x, data, pen=pg.mkPen('#3790CC'))
 
     
 def plot_multipleData(browser, plotWidget, itemList, clear=True, color='#3790CC'):
@@ -20,44 +37,26 @@ def plot_multipleData(browser, plotWidget, itemList, clear=True, color='#3790CC'
     
     Store max and min of data and x-axis for zoom out function.
     """
+    if use_overlay(plotWidget, itemList):
+        pens = [pg.mkPen('#3790CC')]
+    else:
+        pens = [pg.intColor(n) for n in range(len(itemList))]
+    plotted = plot_items(plotWidget, itemList, pens, clear)
     if clear: 
-        plotWidget.clear()
         plotWidget.plotDataIndex, plotWidget.plotDataItems = [], []
-        if plotWidget.cursor: replot_cursors(plotWidget) 
-    for n, item in enumerate(itemList):
-        if item.data is not None:
-            try:
-                x = item.attrs['timeStamp'] 
-            except KeyError:           
-                try:
-                    dt = item.attrs['dt']
-                except KeyError:
-                    dt = 1
-                x = make_xvector(item.data, dt)     
-            y = item.data
-            color = pg.intColor(n)
-            plotWidget.plot(x, y, pen=color)
-            plotWidget.plotDataItems.append(item)
+    plotWidget.plotDataItems.extend(plotted)
+    update_cursorStats(plotWidget)
 
 def browse_singleData(browser, plotWidget, currentItem, clear=True, color='#3790CC'):
     """ Plot single trace of currentItem.
     Different from plot_singleData because the source is an item
     instead of the data directly.
     """
+    plotted = plot_items(plotWidget, [currentItem], [pg.mkPen(color)], clear)
     if clear: 
-        plotWidget.clear()
         plotWidget.plotDataIndex, plotWidget.plotDataItems = [], []
-        if plotWidget.cursor: replot_cursors(plotWidget)   
-    if currentItem.data is not None:
-        try:
-            dt = currentItem.attrs['dt']
-        except KeyError:
-            dt = 1    
-        x = make_xvector(currentItem.data, dt)    
-        #x = np.arange(0, len(currentItem.data)*dt, dt)
-        y = currentItem.data
-        plotWidget.plot(x, y, pen=pg.mkPen(color))        
-        plotWidget.plotDataItems.append(currentItem) 
+    plotWidget.plotDataItems.extend(plotted)
+    update_cursorStats(plotWidget)
 
 def browse_image(browser, imageWidget, currentItem):
     imageWidget.setImage(currentItem.data)
@@ -65,19 +64,114 @@ def browse_image(browser, imageWidget, currentItem):
 def replot(browser, plotWidget):
     """ Function to replot the data currently in the data plot tab.
     Useful for visualising the data after any analysis transformation.
+    The existing curves get the new data, and pyramids and range indexes
+    of data in memory are rebuilt, as they may have changed.
     """
-    plotWidget.clear()
-    if plotWidget.cursor: replot_cursors(plotWidget)
-    for item in plotWidget.plotDataItems:  
+    for item in plotWidget.plotDataItems:
+        if item.isLoaded():
+            item.rangeIndex = None
+    pens = [pg.mkPen('#3790CC')]*len(plotWidget.plotDataItems)
+    plot_items(plotWidget, plotWidget.plotDataItems, pens, rebuild=True)
+    update_cursorStats(plotWidget)
+
+def plot_items(plotWidget, itemList, pens, clear=True, rebuild=False):
+    """ Plot items from the data trees, one curve per item.
+
+    Curves are kept by item in plotWidget.plotCurves and reused: the
+    curve of an item that is already plotted only gets the new data and
+    pen. With clear=True everything else is removed from the plot, apart
+    from the cursors if they are on. The plot is redrawn once, after all
+    curves are updated. Returns the items that have data.
+
+    More than OVERLAY_ITEMS items are shown as one overlay item in the
+    first pen, if the widget supports it (see widgets.plotWidget).
+    """
+    plotItem = plotWidget.getPlotItem()
+    shown = set(plotItem.items)
+    curves = dict((item, curve) for item, curve in getattr(plotWidget, 'plotCurves', {}).items()
+                  if curve in shown)
+    plotWidget.setUpdatesEnabled(False)
+    try:
+        if clear:
+            keep = set(curves[item] for item in itemList if item in curves)
+            if plotWidget.cursor: keep.update(get_cursors(plotWidget))
+            for graphicsItem in plotItem.items[:]:
+                if graphicsItem not in keep:
+                    plotItem.removeItem(graphicsItem)
+            curves = dict((item, curves[item]) for item in itemList if item in curves)
+            if plotWidget.cursor: replot_cursors(plotWidget)
+        plotted = []
+        if use_overlay(plotWidget, itemList):
+            plotted = [item for item in itemList if has_data(item)]
+            plot_overlay(plotWidget, plotted, pens[0], curves)
+            itemList = []
+        for item, pen in zip(itemList, pens):
+            if has_data(item):
+                curves[item] = plot_item(plotWidget, item, pen, curves.get(item), rebuild)
+                plotted.append(item)
+            elif item in curves:
+                plotItem.removeItem(curves.pop(item))
+    finally:
+        plotWidget.setUpdatesEnabled(True)
+    plotWidget.plotCurves = curves
+    return plotted
+
+def use_overlay(plotWidget, itemList):
+    return (len(itemList)>OVERLAY_ITEMS) and hasattr(plotWidget, 'plot_overlay')
+
+def plot_overlay(plotWidget, itemList, pen, curves):
+    """ Plot items as one overlay item, reusing the overlay they are
+    already in, and update curves
+    """
+    previous = set(curves[item] for item in itemList if item in curves)
+    overlay = None
+    for curve in previous:
+        if hasattr(curve, 'overlay') and (overlay is None):
+            overlay = curve
+        else:
+            plotWidget.removeItem(curve)
+    xs, ys = [], []
+    for item in itemList:
         try:
             dt = item.attrs['dt']
         except KeyError:
             dt = 1
-        #x = np.arange(0, len(item.data)*dt, dt)
-        x = make_xvector(item.data, dt) 
-        y = item.data
-        plotWidget.plot(x, y, pen=pg.mkPen('#3790CC'))
-              
+        x = item.attrs.get('timeStamp')
+        xs.append(get_timeBase(len(item.data), dt) if x is None else x)
+        ys.append(item.data)
+    overlay = plotWidget.plot_overlay(itemList, xs, ys, pen, overlay)
+    for item in itemList:
+        curves[item] = overlay
+
+def plot_item(plotWidget, item, pen=None, curve=None, rebuild=False):
+    """ Plot the data of an item, or set them as the data of 'curve'.
+    Long traces are plotted from their min/max pyramid if the widget
+    supports it, and are not loaded if they are still on file.
+    Returns the curve.
+    """
+    try:
+        dt = item.attrs['dt']
+    except KeyError:
+        dt = 1
+    x = item.attrs.get('timeStamp')
+    usePyramid = (x is None) and hasattr(plotWidget, 'plot_pyramid') and pyramidfun.use_pyramid(item)
+    if (curve is not None) and (hasattr(curve, 'pyramid')!=usePyramid):
+        plotWidget.removeItem(curve)
+        curve = None
+    if usePyramid:
+        pyramid = pyramidfun.get_pyramid(item, rebuild)
+        return plotWidget.plot_pyramid(pyramid, item.dataRange, dt, pen=pen, curve=curve)
+    if x is None: x = get_timeBase(len(item.data), dt)
+    if curve is None:
+        return plotWidget.plot(x, item.data, pen=pen)
+    curve.setData(x, item.data)
+    curve.setPen(pen)
+    return curve
+
+def has_data(item):
+    """ Check whether an item has data, without loading it from file
+    """
+    return (not item.isLoaded()) or (item.data is not None)
 
 def zoom_out(browser, plotWidget):
     """ Zoom out to the X and Y data boundaries.
@@ -87,7 +181,8 @@ def zoom_out(browser, plotWidget):
         plotWidget.setYRange(np.min(plotWidget.yBoundaries), np.max(plotWidget.yBoundaries))
 
 def show_cursors(browser, plotWidget):
-    """ Show two cursors for use in data analysis.
+    """ Show two cursors for use in data analysis, with a readout of
+    statistics of the data between them (see update_cursorStats).
     """
     axisRange = plotWidget.viewRange()
     x1, x2 = axisRange[0]
@@ -98,6 +193,12 @@ def show_cursors(browser, plotWidget):
     plotWidget.cursor2.setValue(plotWidget.cursor2Pos)      
     plotWidget.addItem(plotWidget.cursor1)
     plotWidget.addItem(plotWidget.cursor2)
+    if not hasattr(plotWidget, 'cursorStats'):
+        plotWidget.cursorStats = pg.TextItem(color='k', fill=pg.mkBrush(255, 255, 255, 200))
+        plotWidget.cursor1.sigPositionChanged.connect(lambda: update_cursorStats(plotWidget))
+        plotWidget.cursor2.sigPositionChanged.connect(lambda: update_cursorStats(plotWidget))
+    plotWidget.addItem(plotWidget.cursorStats, ignoreBounds=True)
+    update_cursorStats(plotWidget)
 
 def hide_cursors(browser, plotWidget):
     """ Remove the data cursors.
@@ -107,6 +208,8 @@ def hide_cursors(browser, plotWidget):
     plotWidget.cursor2Pos = []  
     plotWidget.removeItem(plotWidget.cursor1)
     plotWidget.removeItem(plotWidget.cursor2)
+    if hasattr(plotWidget, 'cursorStats'):
+        plotWidget.removeItem(plotWidget.cursorStats)
     plotWidget.cursor1.setValue('NaN')
     plotWidget.cursor2.setValue('NaN')
 
@@ -114,18 +217,79 @@ def replot_cursors(plotWidget):
     """ Replot the cursors in the current positions
     after the axis had been cleared for some reason
     """    
-    plotWidget.addItem(plotWidget.cursor1)
-    if hasattr(plotWidget, 'cursor2'):
-        plotWidget.addItem(plotWidget.cursor2)     
+    items = plotWidget.getPlotItem().items
+    for cursor in get_cursors(plotWidget):
+        if cursor not in items:
+            plotWidget.addItem(cursor, ignoreBounds=isinstance(cursor, pg.TextItem))
+
+def get_cursors(plotWidget):
+    return [getattr(plotWidget, name) for name in ['cursor1', 'cursor2', 'cursorStats']
+            if hasattr(plotWidget, name)]
+
+def update_cursorStats(plotWidget):
+    """ Show the mean, SD, minimum, maximum and area of the data between
+    the cursors for the first STATS_ITEMS plotted traces, next to the
+    right cursor. Statistics come from the range index of traces that
+    have one or are long enough to need one (see util.rangefuncs), so
+    the readout follows the cursors as they are dragged, however long
+    the traces; other traces are measured over the window directly.
+    Traces that are not loaded are not indexed, only the window between
+    the cursors is read.
+    """
+    stats = getattr(plotWidget, 'cursorStats', None)
+    if (stats is None) or (stats not in plotWidget.getPlotItem().items):
+        return
+    lines = []
+    for item in plotWidget.plotDataItems[:STATS_ITEMS]:
+        if 'dt' not in item.attrs:
+            continue
+        c1, c2 = rangefun.get_cursorWindow(plotWidget, item)
+        if c2<=c1:
+            continue
+        index, offset = rangefun.get_windowRange(item, c1, c2)
+        w1, w2 = c1-offset, c2-offset
+        yMin, xMin = index.min(w1, w2)
+        yMax, xMax = index.max(w1, w2)
+        lines.append('%s  mean %.4g \u00b1 %.4g  min %.4g  max %.4g  area %.4g' %
+                     (item.text(0), index.mean(w1, w2), index.std(w1, w2), yMin, yMax,
+                      index.area(w1, w2, item.attrs['dt'])))
+    if len(plotWidget.plotDataItems)>STATS_ITEMS:
+        lines.append('(first %d of %d traces)' % (STATS_ITEMS, len(plotWidget.plotDataItems)))
+    stats.setText('\n'.join(lines))
+    stats.setVisible(bool(lines))
+    yRange = plotWidget.viewRange()[1]
+    stats.setPos(max(plotWidget.cursor1.value(), plotWidget.cursor2.value()), yRange[1])
 
 
 def make_xvector(ydata, dt):
     """ Make a X vector to plot data against 
     and ensure it is has the same length as Y
+
+    The vector is shared with other traces of the same length and dt
+    (see get_timeBase), so it is read-only.
     """ 
-    x = np.arange(0, len(ydata)*dt, dt)
-    if len(x)<len(ydata):
-        x = np.append(x, dt)
-    elif len(x)>len(ydata):
-        x = np.delete(x, len(x)-1)
-    return x 
+    return get_timeBase(len(ydata), dt)
+
+def get_timeBase(length, dt, t0=0):
+    """ X vector t0 + n*dt for n in 0..length-1. Vectors are cached and
+    shared by all traces with the same length, dt and t0, so they are
+    made read-only; copy before changing one.
+    """
+    key = (int(length), float(dt), float(t0))
+    x = timeBases.pop(key, None)
+    if x is None:
+        x = t0 + np.arange(length)*dt
+        x.setflags(write=False)
+    if x.nbytes>TIME_BASE_BYTES:
+        return x
+    timeBases[key] = x
+    cached = sum(base.nbytes for base in timeBases.values())
+    while cached>TIME_BASE_BYTES:
+        cached -= timeBases.pop(next(iter(timeBases))).nbytes
+    return x
+
+def plot_uniform(plotWidget, y, dt, t0=0, **kwargs):
+    """ Plot data sampled every dt from t0, against the shared time base
+    instead of a new x vector. Keyword arguments go to plotWidget.plot.
+    """
+    return plotWidget.plot(get_timeBase(len(y), dt, t0), y, **kwargs)
@@ -0,0 +1,182 @@
+""" Min/max pyramids for drawing long traces
+
+A pyramid holds the minimum and maximum of a trace over blocks of 4,
+16, 64, ... samples (one level per factor of FACTOR). It is built once
+per trace: the first level in one pass over the data, read in blocks so
+that traces that are not loaded stay on disk, and each further level
+from the level below. Drawing then only needs the visible part of the
+coarsest level that still has a block per screen pixel (see
+minmaxPyramid.view and widgets.plotWidget), so redrawing takes the same
+time at any zoom, however long the trace.
+
+Pyramids of data that come from a file (datasets that are not loaded,
+or not changed since loading) are stored in a sidecar file next to the
+data file, '.<name>.pyramid', with one group per dataset keyed by the
+data file's modification time and size. All pyramids are also cached in
+memory, on the item and by source.
+"""
+
+import os
+import numpy as np
+import h5py
+
+FACTOR = 4
+PYRAMID_LENGTH = 2**18    # Shorter traces are plotted directly
+TOP_LENGTH = 1024         # No more levels once a level is this short
+BLOCK = 2**20             # Samples read at a time when building
+
+# Pyramids of file data by (filename, dataset name)
+pyramids = {}
+
+
+class minmaxPyramid():
+    """ Min/max levels of a trace of 'length' samples. levels is a list
+    of (factor, array) where array[i] holds the minimum and maximum of
+    samples i*factor:(i+1)*factor.
+    """
+
+    def __init__(self, length, levels, key=None):
+        self.length = length
+        self.levels = levels
+        self.key = key
+
+    def yBounds(self):
+        top = self.levels[-1][1]
+        return np.nanmin(top[:,0]), np.nanmax(top[:,1])
+
+    def view(self, start, stop, width, read):
+        """ x (in samples) and y for drawing samples start:stop on
+        'width' pixels. Uses the coarsest level with at least 'width'
+        blocks in the range, or the samples themselves, got with
+        read(start, stop), if there is no such level.
+        """
+        start, stop = max(0, int(start)), min(self.length, int(stop))
+        if stop<=start:
+            return np.zeros(0), np.zeros(0)
+        factor, level = None, None
+        for f, l in self.levels:
+            if (stop-start)//f>=width:
+                factor, level = f, l
+        if factor is None:
+            return np.arange(start, stop), read(start, stop)
+        b0, b1 = start//factor, -(-stop//factor)
+        return np.repeat(np.arange(b0, b1)*factor, 2), level[b0:b1].ravel()
+
+
+def use_pyramid(item):
+    """ Check whether an item is a trace long enough to need a pyramid
+    """
+    if item.isLoaded():
+        return (item.data is not None) and (np.ndim(item.data)==1) and (len(item.data)>PYRAMID_LENGTH)
+    proxy = item.dataProxy
+    return (len(proxy.shape)==1) and (proxy.shape[0]>PYRAMID_LENGTH)
+
+def get_pyramid(item, rebuild=False):
+    """ Get the pyramid of an item's data, from memory, the sidecar file
+    or by building it. With rebuild=True data in memory are read again,
+    e.g. after they were changed in place.
+    """
+    if (item.pyramid is not None) and not (rebuild and item.isLoaded()):
+        return item.pyramid
+    source = None if (rebuild and item.isLoaded()) else get_source(item)
+    pyramid = None
+    if source:
+        key = get_key(source[0])
+        pyramid = pyramids.get(source)
+        if (pyramid is None) or (pyramid.key!=key):
+            pyramid = load_pyramid(source, key)
+    if pyramid is None:
+        pyramid = build_pyramid(item.dataRange, item.dataLength())
+        if source:
+            pyramid.key = key
+            save_pyramid(source, pyramid)
+    if source:
+        pyramids[source] = pyramid
+    item.pyramid = pyramid
+    return pyramid
+
+def get_source(item):
+    """ File name and dataset name the item's data come from, or None
+    if the data only exist in memory or were changed since loading
+    """
+    if not item.isLoaded():
+        proxy = item.dataProxy
+        if hasattr(proxy, 'path'):
+            name = proxy.path
+        elif hasattr(proxy, 'sweep'):
+            name = '/stream_%d/channel_%d/sweep_%d' % (proxy.stream, proxy.channel, proxy.sweep)
+        else:
+            name = '/'+proxy.group+'/'+proxy.channel
+        return os.path.abspath(proxy.filename), name
+    tree = item.treeWidget()
+    savedFile = getattr(tree, 'savedFile', None)
+    if savedFile and item.savedPath and (not item.isChanged()) and os.path.isfile(savedFile):
+        return os.path.abspath(savedFile), item.savedPath
+    return None
+
+def get_key(filename):
+    stat = os.stat(filename)
+    return [stat.st_mtime, stat.st_size]
+
+def build_pyramid(read, length):
+    """ Build the pyramid of a trace of 'length' samples, reading
+    BLOCK samples at a time with read(start, stop)
+    """
+    blocks = []
+    for start in range(0, length, BLOCK):
+        data = np.asarray(read(start, min(start+BLOCK, length)))
+        blocks.append(reduce_block(data, data))
+    level = np.concatenate(blocks)
+    levels, factor = [(FACTOR, level)], FACTOR
+    while len(level)>TOP_LENGTH:
+        level = reduce_block(level[:,0], level[:,1])
+        factor *= FACTOR
+        levels.append((factor, level))
+    return minmaxPyramid(length, levels)
+
+def reduce_block(mins, maxs):
+    """ Min of each FACTOR values of mins and max of each FACTOR
+    values of maxs, as rows of a 2-column array
+    """
+    edges = np.arange(0, len(mins), FACTOR)
+    return np.column_stack([np.minimum.reduceat(mins, edges),
+                            np.maximum.reduceat(maxs, edges)])
+
+def sidecar_name(filename):
+    folder, name = os.path.split(filename)
+    return os.path.join(folder, '.'+name+'.pyramid')
+
+def load_pyramid(source, key):
+    """ Read a pyramid from the sidecar file, None if it is not there
+    or the data file changed since it was stored
+    """
+    filename, name = source
+    try:
+        with h5py.File(sidecar_name(filename), 'r') as f:
+            if name not in f:
+                return None
+            group = f[name]
+            if list(group.attrs['key'])!=key:
+                return None
+            levels = [(int(factor), group[factor][()]) for factor in
+                      sorted(group.keys(), key=int)]
+            return minmaxPyramid(int(group.attrs['length']), levels, key)
+    except (OSError, KeyError):
+        return None
+
+def save_pyramid(source, pyramid):
+    """ Store a pyramid in the sidecar file. Nothing is stored if the
+    folder is not writable, the pyramid is then kept in memory only.
+    """
+    filename, name = source
+    try:
+        with h5py.File(sidecar_name(filename), 'a') as f:
+            if name in f:
+                del f[name]
+            group = f.create_group(name)
+            group.attrs['key'] = pyramid.key
+            group.attrs['length'] = pyramid.length
+            for factor, level in pyramid.levels:
+                group.create_dataset(str(factor), data=level)
+    except OSError:
+        pass
@@ -0,0 +1,219 @@
+""" Constant time statistics over windows of long traces
+
+A rangeIndex is built once per trace, when asked for or on first use
+for traces of more than INDEX_LENGTH samples, and kept on the item
+until its data are replaced or marked changed (see get_rangeIndex).
+It takes 16 bytes per sample on top of the data, and holds
+
+- prefix sums of the data and of their squares, taken relative to the
+  trace mean to limit rounding errors, which give the mean, SD and area
+  of any window in constant time
+- the position of the minimum and maximum of each block of BLOCK
+  samples, with a sparse table over the blocks, so the min and max of
+  a window only need a scan of the partial blocks at its ends
+
+Windows of up to DIRECT samples are computed from the data directly, as
+differences of large prefix sums lose precision over few samples. Both
+ways take bounded time, whatever the length of the trace.
+
+Other traces get a directRange instead, which answers the same queries
+from the data each time: a window of a few million samples still takes
+milliseconds, and the index would take more memory than it saves time.
+
+Results are those of np.mean, np.std, np.trapz, np.argmin and np.argmax
+over data[start:stop], up to rounding. As in numpy, argmin and argmax
+give the first position, the mean and SD of an empty window are NaN and
+its min and max raise ValueError. Data are assumed to have no NaNs.
+
+Data that are not loaded are not indexed: get_windowRange reads the
+window asked for and answers from it directly.
+"""
+
+import copy
+import numpy as np
+
+INDEX_LENGTH = 2**23   # Longer traces are indexed on first use
+BLOCK = 256
+DIRECT = 4096
+SUM_BLOCK = 2**22   # Samples summed at a time when building
+
+
+class rangeIndex():
+    """ Range query index of a 1D array, see the module description
+    """
+
+    def __init__(self, data):
+        self.data = data
+        n = len(data)
+        self.ref = float(np.mean(data)) if n else 0.
+        self.sums = np.zeros(n+1)
+        self.squares = np.zeros(n+1)
+        for start in range(0, n, SUM_BLOCK):
+            stop = min(start+SUM_BLOCK, n)
+            d = np.asarray(data[start:stop], dtype=np.float64) - self.ref
+            np.cumsum(d, out=self.sums[start+1:stop+1])
+            self.sums[start+1:stop+1] += self.sums[start]
+            np.cumsum(d*d, out=self.squares[start+1:stop+1])
+            self.squares[start+1:stop+1] += self.squares[start]
+        self.minTable = self.make_table(np.argmin, np.less)
+        self.maxTable = self.make_table(np.argmax, np.greater)
+
+    def make_table(self, argfunc, better):
+        """ Sparse table of positions: level k holds, for each block, the
+        position of the extreme of the 2**k blocks starting there
+        """
+        data = self.data
+        nFull = len(data)//BLOCK
+        level = np.arange(nFull)*BLOCK + argfunc(np.asarray(data[:nFull*BLOCK]).reshape(nFull, BLOCK), axis=1)
+        table = [level]
+        k = 1
+        while 2**k<=nFull:
+            half = 2**(k-1)
+            left, right = level[:-half], level[half:]
+            level = np.where(better(data[right], data[left]), right, left)
+            table.append(level)
+            k += 1
+        return table
+
+    def offset(self, value, data=None):
+        """ Index of data+value, sharing this index's tables. For when a
+        constant is added to the data, e.g. a baseline is subtracted;
+        pass the shifted data if they were already computed.
+        """
+        index = copy.copy(self)
+        index.data = self.data + value if data is None else data
+        index.ref = self.ref + value
+        return index
+
+    def window(self, start, stop, allowEmpty=False):
+        start, stop, step = slice(start, stop).indices(len(self.data))
+        if stop<=start:
+            if allowEmpty:
+                return start, start
+            raise ValueError('Empty data range '+str(start)+':'+str(stop))
+        return start, stop
+
+    def sum(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        if stop-start<=DIRECT:
+            return np.sum(self.data[start:stop], dtype=np.float64)
+        return self.sums[stop]-self.sums[start] + self.ref*(stop-start)
+
+    def mean(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        if stop==start:
+            return np.nan
+        return self.sum(start, stop)/(stop-start)
+
+    def std(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        if stop==start:
+            return np.nan
+        if stop-start<=DIRECT:
+            return np.std(self.data[start:stop], dtype=np.float64)
+        n = stop-start
+        mean = (self.sums[stop]-self.sums[start])/n
+        return np.sqrt(max(0., (self.squares[stop]-self.squares[start])/n - mean**2))
+
+    def sem(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        if stop==start:
+            return np.nan
+        return self.std(start, stop)/np.sqrt(stop-start)
+
+    def area(self, start=None, stop=None, dt=1):
+        """ Trapezoidal area, as np.trapz(data[start:stop], dx=dt)
+        """
+        start, stop = self.window(start, stop, True)
+        if stop==start:
+            return 0.
+        return dt*(self.sum(start, stop) - (float(self.data[start])+float(self.data[stop-1]))/2.)
+
+    def min(self, start=None, stop=None):
+        """ Minimum of data[start:stop] and its position in data
+        """
+        i = self.extreme(start, stop, self.minTable, np.argmin, lambda i: (self.data[i], i))
+        return self.data[i], i
+
+    def max(self, start=None, stop=None):
+        """ Maximum of data[start:stop] and its position in data
+        """
+        i = self.extreme(start, stop, self.maxTable, np.argmax, lambda i: (-self.data[i], i))
+        return self.data[i], i
+
+    def extreme(self, start, stop, table, argfunc, key):
+        start, stop = self.window(start, stop)
+        b1, b2 = -(-start//BLOCK), stop//BLOCK   # Whole blocks in the window
+        if b2<=b1:
+            return start + int(argfunc(self.data[start:stop]))
+        candidates = []
+        if start<b1*BLOCK:
+            candidates.append(start + int(argfunc(self.data[start:b1*BLOCK])))
+        k = int(np.log2(b2-b1))
+        candidates += [int(table[k][b1]), int(table[k][b2-2**k])]
+        if b2*BLOCK<stop:
+            candidates.append(b2*BLOCK + int(argfunc(self.data[b2*BLOCK:stop])))
+        return min(candidates, key=key)
+
+
+class directRange(rangeIndex):
+    """ Same queries as rangeIndex, computed from the data each time
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.minTable, self.maxTable = None, None
+
+    def offset(self, value, data=None):
+        return directRange(self.data + value if data is None else data)
+
+    def sum(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        return np.sum(self.data[start:stop], dtype=np.float64)
+
+    def std(self, start=None, stop=None):
+        start, stop = self.window(start, stop, True)
+        if stop==start:
+            return np.nan
+        return np.std(self.data[start:stop], dtype=np.float64)
+
+    def extreme(self, start, stop, table, argfunc, key):
+        start, stop = self.window(start, stop)
+        return start + int(argfunc(self.data[start:stop]))
+
+
+def get_rangeIndex(item, build=None):
+    """ Get the range index of an item's data. If it has none, one is
+    built and kept if 'build' is True, or by default if the trace is
+    longer than INDEX_LENGTH; otherwise a directRange is returned.
+    """
+    if item.rangeIndex is not None:
+        return item.rangeIndex
+    if build is None:
+        build = len(item.data)>INDEX_LENGTH
+    if not build:
+        return directRange(item.data)
+    item.rangeIndex = rangeIndex(item.data)
+    return item.rangeIndex
+
+def get_windowRange(item, start, stop, data=None, build=None):
+    """ Range queries over samples start:stop of an item, and the offset
+    to subtract from positions in the trace when querying. This is the
+    item's range index (see get_rangeIndex for 'build') if its data are
+    loaded. Otherwise only the window is read (or 'data', if it was
+    already read) and a directRange over it is returned, so that the
+    trace is not loaded.
+    """
+    if item.isLoaded():
+        return get_rangeIndex(item, build), 0
+    if data is None:
+        data = item.dataRange(start, stop)
+    return directRange(data), start
+
+def get_cursorWindow(plotWidget, item):
+    """ Samples c1:c2 of an item between the data cursors, coerced to
+    the data limits
+    """
+    dt = item.attrs['dt']
+    c1, c2 = sorted([int(plotWidget.cursor1.value()/dt), int(plotWidget.cursor2.value()/dt)])
+    return max(0, c1), min(item.dataLength(), c2)
@@ -0,0 +1,49 @@
+""" Functions for getting video properties
+
+probe_video reads the container header with the ffmpeg binary that
+comes with imageio-ffmpeg, without decoding frames (read_videoHeader,
+in fileMetadata so that the catalogue workers can use it too). Results are cached
+in a sidecar file in the video's folder (VIDEO_INDEX), keyed by file
+name, modification time and size, so each video is only probed once.
+If the folder is not writable the cache is kept in memory.
+"""
+
+import os, json
+from fileMetadata import read_videoHeader
+
+VIDEO_INDEX = '.neurodaq_videos.json'
+
+# Sidecar contents for each folder already read
+indexes = {}
+
+def probe_video(filename):
+    """ Return the properties of a video file as a dictionary with
+    'size' [width, height], 'fps', 'duration' (sec), 'nframes' and 'codec'
+    """
+    filename = os.path.abspath(filename)
+    folder, name = os.path.split(filename)
+    stat = os.stat(filename)
+    key = [stat.st_mtime, stat.st_size]
+    index = load_index(folder)
+    if (name in index) and (index[name]['key']==key):
+        return index[name]['info']
+    info = read_videoHeader(filename)
+    index[name] = {'key': key, 'info': info}
+    save_index(folder)
+    return info
+
+def load_index(folder):
+    if folder not in indexes:
+        try:
+            with open(os.path.join(folder, VIDEO_INDEX)) as f:
+                indexes[folder] = json.load(f)
+        except (OSError, ValueError):
+            indexes[folder] = {}
+    return indexes[folder]
+
+def save_index(folder):
+    try:
+        with open(os.path.join(folder, VIDEO_INDEX), 'w') as f:
+            json.dump(indexes[folder], f)
+    except OSError:
+        pass
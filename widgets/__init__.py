@@ -10,6 +10,8 @@ from .TabWidget import TabWidget
 from .h5Widgets import h5Item
 from .h5Widgets import h5TreeWidget
 from .h5Widgets import h5itemSelect
+from .h5Widgets import h5SaveDialog
+from .h5Widgets import h5LoadProgress
 
 from .MplWidgets import matplotlibWidget
 from .IPythonWidget import QIPythonWidget
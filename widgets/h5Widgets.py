@@ -1,15 +1,52 @@
 import h5py
 import sip
 import re
+import time
+import zlib
+import numpy as np
 
 from PyQt5.QtCore import pyqtSignal
 from PyQt5 import QtGui, QtCore, QtWidgets
 
 
+def data_checksum(data):
+    """ Cheap checksum of numeric data (shape, dtype and CRC32 of the
+    bytes), used to find data changed in place. None for data that
+    cannot be checked, which are then always treated as changed.
+    """
+    try:
+        array = np.ascontiguousarray(data)
+    except ValueError:   # ragged lists
+        return None
+    if (array.dtype.kind not in 'biufc') or (array.size==0):
+        return None
+    return array.shape, array.dtype.str, zlib.crc32(array)
+
+
 class h5Item(QtWidgets.QTreeWidgetItem):
 
     """ HDF5 tree item for populating a HDF5 Tree Widget
     Use .attrs dictionary to store useful information, such as dt
+
+    Data can be loaded lazily by setting .dataProxy to an object with a
+    read(start, stop) method (see util.h5funcs.h5DataProxy,
+    tdmsDataProxy and abfDataProxy). The data are then only read from
+    file the first time .data is accessed. Setting .data directly drops
+    the proxy. Use .dataRange() to read part of the data without loading
+    all of it.
+
+    For incremental saving, .savedPath is the path of the item in the
+    file it was last loaded from or saved to, and .dirty is set whenever
+    .data is assigned. Changes made in place (e.g. item.data[i] = x) are
+    found by comparing the data with .savedChecksum, taken when they
+    were read from or written to that file (see isChanged). Attributes,
+    renames and deletions are picked up by comparing the tree with the
+    file (see util.h5funcs.save_h5).
+
+    .pyramid caches the min/max pyramid used to plot long traces (see
+    util.pyramidfuncs) and .rangeIndex the index for statistics over
+    windows of the data (see util.rangefuncs). Both are dropped with
+    the data.
     """
 
     def __init__(self, parent=None):
@@ -18,14 +55,105 @@ class h5Item(QtWidgets.QTreeWidgetItem):
         self.path = ''
         self.group = ''
         self.channel = ''
+        self.sweep = None
         self.listIndex = None
         self.originalIndex = None
         self.data = None
+        self.dataProxy = None
+        self.savedPath = None
+        self.dirty = True
+        self.savedChecksum = None
+        self.pyramid = None
+        self.rangeIndex = None
         self.attrs = {}
         self.attrs['dt'] = 1
         self.attrs['video'] = 'False'
         self.analysis = {}
         
+    def __getattribute__(self, name):
+        """ Read proxied data on first access to .data. This cannot be a
+        property: QTreeWidgetItem.data() is a virtual method that Qt calls
+        while painting, and sip would then read the file on every repaint.
+        Plain instance attributes are not callable, so sip ignores them.
+        """
+        if name=='data':
+            d = object.__getattribute__(self, '__dict__')
+            if d.get('dataProxy') is not None:
+                d['data'] = d['dataProxy'].read()
+                d['dataProxy'] = None
+                if not d.get('dirty'):
+                    d['savedChecksum'] = data_checksum(d['data'])
+        return QtWidgets.QTreeWidgetItem.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        if name=='data':
+            self.__dict__['dataProxy'] = None
+            self.__dict__['dirty'] = True
+            self.__dict__['pyramid'] = None
+            self.__dict__['rangeIndex'] = None
+        QtWidgets.QTreeWidgetItem.__setattr__(self, name, value)
+
+    def mark_changed(self):
+        """ Mark data changed in place (e.g. item.data[i] = x) as changed,
+        as assigning .data does, so that the cached pyramid and range
+        index are rebuilt straight away
+        """
+        d = self.__dict__
+        d['dirty'] = True
+        d['pyramid'] = None
+        d['rangeIndex'] = None
+
+    def isLoaded(self):
+        """ Check whether the data are in memory, without triggering
+        a read from file.
+        """
+        return self.__dict__.get('dataProxy') is None
+
+    def isChanged(self):
+        """ Check whether the data differ from those last read from or
+        written to .savedPath, including changes made in place. Data
+        that are not loaded are unchanged.
+        """
+        d = self.__dict__
+        if d.get('dirty'):
+            return True
+        if not self.isLoaded():
+            return False
+        checksum = data_checksum(d.get('data'))
+        return (checksum is None) or (checksum!=d.get('savedChecksum'))
+
+    def setLoadedData(self, proxy, data, checksum=None):
+        """ Set data read from 'proxy' elsewhere (by the background loader)
+        without marking the item as changed. Ignored if the item no longer
+        uses that proxy, e.g. it was read or assigned in the meantime.
+        'checksum' is data_checksum(data), if already taken.
+        """
+        d = self.__dict__
+        if d.get('dataProxy') is proxy:
+            d['data'] = data
+            d['dataProxy'] = None
+            if not d.get('dirty'):
+                d['savedChecksum'] = data_checksum(data) if checksum is None else checksum
+
+    def dataLength(self):
+        """ Number of samples (first axis), without reading proxied data
+        """
+        if self.isLoaded():
+            return len(self.data)
+        return len(self.dataProxy)
+
+    def dataRange(self, start=None, stop=None):
+        """ Get samples start:stop. If the data are not loaded only that
+        range is read from file, and the data stay unloaded.
+        """
+        if self.isLoaded():
+            return self.data[start:stop]
+        return self.dataProxy.read(start, stop)
+
+    # Defining __lt__ makes sip drop the default hash; items are hashed
+    # by identity so they can key dictionaries (e.g. plotted curves)
+    __hash__ = object.__hash__
+
     def set_name(self, name):
         self.name = name
         self.setText(0, self.name)
@@ -190,7 +318,97 @@ class h5itemSelect(QtWidgets.QDialog):
             self.reject()
 
 
+class h5SaveDialog(QtWidgets.QDialog):
 
+    """ Dialog for Save As: file name plus the options for writing
+    datasets (see util.h5funcs.SAVE_OPTIONS)
+    """
 
-            
-            
+    def __init__(self, options, parent=None):
+        QtWidgets.QDialog.__init__(self, parent)
+        self.setWindowTitle('New file')
+        self.nameInput = QtWidgets.QLineEdit()
+        self.compressionBox = QtWidgets.QComboBox()
+        self.compressionBox.addItems(['None', 'gzip', 'lzf'])
+        self.compressionBox.setCurrentText(str(options['compression']))
+        self.levelBox = QtWidgets.QSpinBox()
+        self.levelBox.setRange(0, 9)
+        self.levelBox.setValue(options['compression_opts'])
+        self.shuffleBox = QtWidgets.QCheckBox('Shuffle')
+        self.shuffleBox.setChecked(options['shuffle'])
+        self.int16Box = QtWidgets.QCheckBox('Store as int16 (ADC data, lossy)')
+        self.int16Box.setChecked(options['int16'])
+        self.makeButtons()
+        self.grid = QtWidgets.QGridLayout(self)
+        self.grid.addWidget(QtWidgets.QLabel('Enter file name:'), 0,0)
+        self.grid.addWidget(self.nameInput, 0,1)
+        self.grid.addWidget(QtWidgets.QLabel('Compression'), 1,0)
+        self.grid.addWidget(self.compressionBox, 1,1)
+        self.grid.addWidget(QtWidgets.QLabel('gzip level'), 2,0)
+        self.grid.addWidget(self.levelBox, 2,1)
+        self.grid.addWidget(self.shuffleBox, 3,0,1,2)
+        self.grid.addWidget(self.int16Box, 4,0,1,2)
+        self.grid.addWidget(self.Cancel_btn, 5,0)
+        self.grid.addWidget(self.OK_btn, 5,1)
+
+    def makeButtons(self):
+        self.OK_btn = QtWidgets.QPushButton("OK", self)
+        self.Cancel_btn = QtWidgets.QPushButton("Cancel", self)
+        self.OK_btn.clicked.connect(self.accept)
+        self.Cancel_btn.clicked.connect(self.reject)
+
+    def getOptions(self):
+        compression = str(self.compressionBox.currentText())
+        return {'compression': None if compression=='None' else compression,
+                'compression_opts': self.levelBox.value(),
+                'shuffle': self.shuffleBox.isChecked(),
+                'int16': self.int16Box.isChecked()}
+
+
+
+class h5LoadProgress(QtWidgets.QWidget):
+
+    """ Progress of a file loading in the background (see
+    util.h5funcs.start_loader), for the status bar. Shows the number of
+    items while the tree is built, then MB read and throughput.
+    """
+
+    cancelled = pyqtSignal()
+
+    def __init__(self, parent=None):
+        QtWidgets.QWidget.__init__(self, parent)
+        self.setLayoutDirection(QtCore.Qt.LeftToRight)
+        self.label = QtWidgets.QLabel()
+        self.bar = QtWidgets.QProgressBar()
+        self.bar.setMaximumWidth(150)
+        self.bar.setMaximumHeight(15)
+        self.bar.setTextVisible(False)
+        self.cancelButton = QtWidgets.QPushButton('Cancel')
+        self.cancelButton.clicked.connect(self.cancelled.emit)
+        layout = QtWidgets.QHBoxLayout(self)
+        layout.setContentsMargins(0,0,0,0)
+        layout.addWidget(self.label)
+        layout.addWidget(self.bar)
+        layout.addWidget(self.cancelButton)
+        self.hide()
+
+    def start(self, text):
+        self.text = text
+        self.startTime = None
+        self.label.setText(text)
+        self.bar.setRange(0, 0)   # Busy until the size is known
+        self.show()
+
+    def set_items(self, n):
+        self.label.setText(self.text+': '+str(n)+' datasets')
+
+    def set_progress(self, done, total):
+        if self.startTime is None:
+            self.startTime = time.time()
+        elapsed = max(time.time()-self.startTime, 1e-3)
+        self.bar.setRange(0, 1000)
+        self.bar.setValue(int(1000*done/total) if total else 1000)
+        self.label.setText('%s: %.1f of %.1f MB, %.1f MB/s' % (self.text, done/1e6, total/1e6, done/1e6/elapsed))
+
+    def stop(self):
+        self.hide()
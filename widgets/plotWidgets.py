@@ -1,22 +1,299 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 from PyQt5 import QtGui, QtCore, QtWidgets
 from PyQt5.QtCore import pyqtSignal
 import pyqtgraph as pg
 
+# Threads preparing what to draw after view changes, shared by all plots
+renderPool = None
+
+def get_renderPool():
+    global renderPool
+    if renderPool is None:
+        renderPool = ThreadPoolExecutor(min(4, os.cpu_count() or 1))
+    return renderPool
+
+# Whether an OpenGL context can be made current, checked once
+openGL = None
+
+def openGL_available():
+    """ Check whether OpenGL works here, by making a context current on
+    an offscreen surface. Software rendering (Mesa llvmpipe, e.g. with
+    LIBGL_ALWAYS_SOFTWARE=1) counts, so no GPU is needed.
+    """
+    global openGL
+    if openGL is None:
+        context = QtGui.QOpenGLContext()
+        surface = QtGui.QOffscreenSurface()
+        surface.create()
+        openGL = context.create() and surface.isValid() and context.makeCurrent(surface)
+        if openGL: context.doneCurrent()
+    return openGL
+
+
+class pyramidCurve(pg.PlotDataItem):
+
+    """ Curve drawn from a min/max pyramid (see util.pyramidfuncs).
+    Only the part in view is set as data, so the data bounds used for
+    auto range are those of the whole trace.
+    """
+
+    def __init__(self, pyramid, read, dt, *args, **kwargs):
+        pg.PlotDataItem.__init__(self, *args, **kwargs)
+        self.pyramid = pyramid
+        self.read = read
+        self.dt = dt
+
+    def get_view(self, x1, x2, width):
+        """ x and y to draw for the x range x1-x2 on 'width' pixels. Only
+        reads from the pyramid and the data, so it can run off the GUI
+        thread.
+        """
+        x, y = self.pyramid.view(np.floor(x1/self.dt), np.ceil(x2/self.dt)+1, width, self.read)
+        return x*self.dt, y
+
+    def update_view(self, x1, x2, width):
+        self.setData(*self.get_view(x1, x2, width))
+
+    def dataBounds(self, ax, frac=1.0, orthoRange=None):
+        if ax==0:
+            return 0, (self.pyramid.length-1)*self.dt
+        return self.pyramid.yBounds()
+
+
+class sweepOverlay():
+
+    """ Many sweeps packed into one x and one y array, in the order of
+    items. offsets holds where each sweep starts. Sweeps are taken to be
+    sampled every dt from x0 for picking.
+    """
+
+    def __init__(self, items, xs, ys):
+        self.items = items
+        self.lengths = np.array([len(y) for y in ys])
+        self.offsets = np.concatenate([[0], np.cumsum(self.lengths)[:-1]]).astype(int)
+        self.x = np.concatenate(xs)
+        self.y = np.concatenate(ys)
+        self.x0 = np.array([x[0] if len(x) else 0 for x in xs])
+        self.dt = np.array([x[1]-x[0] if len(x)>1 else 1 for x in xs])
+
+    def connect(self):
+        """ Connect array for drawing one curve broken between sweeps
+        """
+        connect = np.ones(len(self.y), dtype=bool)
+        connect[self.offsets+self.lengths-1] = False
+        return connect
+
+    def density(self, width, height):
+        """ Number of samples in each of width x height bins over the
+        data bounds, and the bounds as a QRectF
+        """
+        x1, x2 = np.nanmin(self.x), np.nanmax(self.x)
+        y1, y2 = np.nanmin(self.y), np.nanmax(self.y)
+        xScale, yScale = width/max(x2-x1, 1e-12), height/max(y2-y1, 1e-12)
+        counts = np.zeros(width*height, dtype=np.int64)
+        for start in range(0, len(self.y), 2**22):   # Keep the index arrays small
+            x, y = self.x[start:start+2**22], self.y[start:start+2**22]
+            finite = np.isfinite(y)
+            xb = np.clip(((x[finite]-x1)*xScale).astype(int), 0, width-1)
+            yb = np.clip(((y[finite]-y1)*yScale).astype(int), 0, height-1)
+            counts += np.bincount(xb*height+yb, minlength=width*height)
+        return counts.reshape(width, height), QtCore.QRectF(x1, y1, x2-x1, y2-y1)
+
+    def pick(self, x, y):
+        """ Index of the sweep closest to x, y in y, None if x is outside
+        all sweeps
+        """
+        index = np.round((x-self.x0)/self.dt).astype(int)
+        inside = (index>=0) & (index<self.lengths)
+        if not inside.any():
+            return None
+        distance = np.abs(self.y[self.offsets+np.clip(index, 0, self.lengths-1)]-y)
+        distance[~inside | np.isnan(distance)] = np.inf
+        return int(np.argmin(distance))
+
+
+class overlayCurve(pg.PlotDataItem):
+
+    """ All sweeps of a sweepOverlay as one curve
+    """
+
+    def set_overlay(self, overlay, pen):
+        self.overlay = overlay
+        self.setData(overlay.x, overlay.y, connect=overlay.connect(), pen=pen)
+
+
+class overlayDensity(pg.ImageItem):
+
+    """ All sweeps of a sweepOverlay as an image of how many samples
+    fall on each pixel, in the pen colour with alpha growing with the
+    log of the count
+    """
+
+    def set_overlay(self, overlay, pen, width, height):
+        self.overlay = overlay
+        counts, rect = overlay.density(width, height)
+        color = pg.mkPen(pen).color()
+        lut = np.zeros((256, 4), dtype=np.ubyte)
+        lut[:,:3] = color.red(), color.green(), color.blue()
+        lut[:,3] = np.linspace(0, 255, 256)
+        self.setImage(np.log1p(counts), lut=lut, levels=(0, max(1, np.log1p(counts.max()))))
+        self.setRect(rect)
+
+
 class plotWidget(pg.PlotWidget):
 
     """ Reimplement Pyqtgraph PlotWidget
+
+    Long traces are added with plot_pyramid, and redrawn from the pyramid
+    level that matches the view each time the x range or size changes.
+    Curves of plotted items are kept in .plotCurves (see
+    util.pgfuncs.plot_items).
+
+    Many sweeps can be plotted as one item with plot_overlay, as a curve
+    or, with the 'Overlay density' menu option or for more than
+    DENSITY_SAMPLES samples, as a density image. Clicking on the overlay
+    highlights the closest sweep and emits sweepPicked with its item.
+
+    When the x range or size changes, pyramid curves are redrawn with
+    data prepared in the render pool. Each view change is a new request,
+    and results of requests that were superseded before or while they
+    were prepared are dropped, so panning never waits for old views.
+
+    set_openGL switches between pyqtgraph's default raster painter and
+    an OpenGL viewport.
     """
     eventSelected = pyqtSignal()
+    sweepPicked = pyqtSignal(object)
+    viewReady = pyqtSignal(int, object, object, object)   # request, curve, x, y
+    DENSITY_SAMPLES = 2*10**7
     
     def __init__(self, *args, **kwargs):
         pg.PlotWidget.__init__(self, *args, **kwargs)
         self.plotItem = self.getPlotItem()
         self.plotDataItems = []        
+        self.plotCurves = {}
         self.viewBox = self.plotItem.getViewBox()
+        self.viewRequest = 0
+        self.viewReady.connect(self.show_view)
+        self.viewBox.sigXRangeChanged.connect(self.update_pyramids)
+        self.viewBox.sigResized.connect(self.update_pyramids)
+        self.scene().sigMouseClicked.connect(self.pick_sweep)
+        self.pickCurve = pg.PlotDataItem(pen=pg.mkPen('k', width=2))
+        self.densityAction = self.viewBox.menu.addAction('Overlay density')
+        self.densityAction.setCheckable(True)
+        self.densityAction.toggled.connect(self.update_overlay)
         self.D = False
         self.events = False
         self.eventOnsets = []
         self.currentEvent = 0
+
+    def set_openGL(self, on=True):
+        """ Draw with OpenGL, without antialiasing as dense traces are slow
+        to antialias. Returns False if OpenGL is not available, the default
+        painter is then kept.
+        """
+        available = openGL_available()
+        on = on and available
+        self.useOpenGL(on)
+        self.setAntialiasing(False if on else pg.getConfigOption('antialias'))
+        return available
+
+    def plot_pyramid(self, pyramid, read, dt, pen=None, curve=None):
+        """ Plot a long trace from its pyramid, or show it in an existing
+        pyramidCurve. read(start, stop) gets the samples when zoomed in
+        beyond the first level.
+        """
+        if curve is None:
+            curve = pyramidCurve(pyramid, read, dt, pen=pen)
+            self.addItem(curve)
+            x1, x2 = 0, pyramid.length*dt
+        else:
+            curve.pyramid, curve.read, curve.dt = pyramid, read, dt
+            curve.setPen(pen)
+            x1, x2 = self.viewBox.viewRange()[0]
+        self.viewRequest += 1   # Views still being prepared are out of date
+        curve.update_view(x1, x2, self.view_width())
+        return curve
+
+    def update_pyramids(self, *args):
+        """ Ask the render pool for the views of all pyramid curves
+        """
+        curves = [curve for curve in self.plotItem.items if isinstance(curve, pyramidCurve)]
+        if curves:
+            self.viewRequest += 1
+            x1, x2 = self.viewBox.viewRange()[0]
+            width = self.view_width()
+            for curve in curves:
+                get_renderPool().submit(self.prepare_view, self.viewRequest, curve, x1, x2, width)
+
+    def prepare_view(self, request, curve, x1, x2, width):
+        """ Runs in the render pool, skipped if the request is stale
+        """
+        if request==self.viewRequest:
+            x, y = curve.get_view(x1, x2, width)
+            self.viewReady.emit(request, curve, x, y)
+
+    def show_view(self, request, curve, x, y):
+        if (request==self.viewRequest) and (curve in self.plotItem.items):
+            curve.setData(x, y)
+
+    def plot_overlay(self, items, xs, ys, pen=None, curve=None):
+        """ Plot the sweeps ys (against xs) of items as one overlay item,
+        or show them in an existing one. Returns the graphics item.
+        """
+        return self.show_overlay(sweepOverlay(items, xs, ys), pen, curve)
+
+    def show_overlay(self, overlay, pen=None, curve=None):
+        density = self.densityAction.isChecked() or (len(overlay.y)>self.DENSITY_SAMPLES)
+        if (curve is not None) and (isinstance(curve, overlayDensity)!=density):
+            self.removeItem(curve)
+            curve = None
+        if curve is None:
+            curve = overlayDensity() if density else overlayCurve()
+            self.addItem(curve)
+        curve.overlayPen = pen
+        if density:
+            curve.set_overlay(overlay, pen, self.view_width(), max(100, int(self.viewBox.height())))
+        else:
+            curve.set_overlay(overlay, pen)
+        return curve
+
+    def get_overlay(self):
+        for curve in self.plotItem.items:
+            if hasattr(curve, 'overlay'):
+                return curve
+        return None
+
+    def update_overlay(self):
+        """ Redraw the overlay when switching density on or off
+        """
+        curve = self.get_overlay()
+        if curve is not None:
+            newCurve = self.show_overlay(curve.overlay, curve.overlayPen, curve)
+            for item, itemCurve in self.plotCurves.items():
+                if itemCurve is curve: self.plotCurves[item] = newCurve
+
+    def pick_sweep(self, event):
+        """ Highlight the overlay sweep closest to a left click
+        """
+        curve = self.get_overlay()
+        if (curve is None) or (event.button()!=QtCore.Qt.LeftButton):
+            return
+        pos = self.viewBox.mapSceneToView(event.scenePos())
+        overlay = curve.overlay
+        n = overlay.pick(pos.x(), pos.y())
+        if n is None:
+            return
+        start, stop = overlay.offsets[n], overlay.offsets[n]+overlay.lengths[n]
+        self.pickCurve.setData(overlay.x[start:stop], overlay.y[start:stop])
+        if self.pickCurve not in self.plotItem.items:
+            self.addItem(self.pickCurve)
+        self.sweepPicked.emit(overlay.items[n])
+
+    def view_width(self):
+        return max(100, int(self.viewBox.width()))
         
     def keyPressEvent(self, event):
         """ Specify some key press events.
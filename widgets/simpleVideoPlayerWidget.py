@@ -14,7 +14,7 @@ import platform
 class simpleVideoPlayerWidget(QtWidgets.QWidget):
     """A simple Media Player using Phonon
 
-    Moviepy is used to read some video properties
+    Video properties are read with util.videofuncs.probe_video
     """
 
     def __init__(self, parent = None):
@@ -94,10 +94,6 @@ class simpleVideoPlayerWidget(QtWidgets.QWidget):
 
     def OpenFile(self, filename):
         self.media = self.instance.media_new(filename)
-        self.media.parse_with_options(1,0)
-        while True:
-            if str(self.media.get_parsed_status()) == 'MediaParsedStatus.done':
-                break #Might be a good idea to add a failsafe in here.
         self.mediaplayer.set_media(self.media)
         self.status.setText('%02d:%02d:%02d' % (0, 0, 0))
         
@@ -112,8 +108,12 @@ class simpleVideoPlayerWidget(QtWidgets.QWidget):
         elif platform.system() == "Darwin": # for MacOS
             self.mediaplayer.set_nsobject(window_id)
 
-        self.fps = self.mediaplayer.get_fps()
-        self.nframes = int(self.media.get_duration()/1000 * self.fps)
+        # Properties from the cached header, VLC does not need to parse the file.
+        # Imported here, util imports the widgets when it is initialised
+        from util import videofuncs as videofun
+        info = videofun.probe_video(filename)
+        self.fps = info['fps']
+        self.nframes = info['nframes']
             
         self.playPause()
 